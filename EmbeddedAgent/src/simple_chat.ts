@@ -389,7 +389,15 @@ class ChatUI {
     this.uiChatInput.setAttribute("placeholder", "Generating...");
 
     // Waits for the interaction with the firebase function to finish
-    await this.firebaseFunctionCall(prompt);
+    const storedAnswer = await this.firebaseFunctionCall(prompt);
+
+    // Curated questions come back with their answer (RAG/AnswerIndex.py), which is shown as is without generating
+    if (storedAnswer) {
+      this.appendMessage("left", storedAnswer);
+      this.uiChatInput.setAttribute("placeholder", "Enter your message...");
+      this.requestInProgress = false;
+      return;
+    }
 
     // Updating the chat
     this.appendMessage("left", "");
@@ -423,12 +431,14 @@ class ChatUI {
    * It sets the global userprompt variable to use in the chat
    * 
    * @param prompt The prompt that the user wants to ask the chatbot
+   * @returns the stored answer when the retrieval service knows the question, otherwise null
    */
- public async firebaseFunctionCall(prompt: string) {
+ public async firebaseFunctionCall(prompt: string): Promise<string | null> {
 
   // The URL of the firebase function and the data that will be sent to it
   const firebaseFunctionUrl = process.env.FIREBASE_LINK_FUNCTION!;
-  const sendingData = {'prompt': prompt};
+  // Only the text of the hits is used, so the retrieval service is asked to leave out the rest of the payloads
+  const sendingData = {'prompt': prompt, 'fields': ['text']};
 
   console.log("$ - " + JSON.stringify(sendingData));
 
@@ -446,15 +456,19 @@ class ChatUI {
     const responseData = await response.json();
     console.log("$ - Response body:", responseData);
 
+    if ('answer' in responseData && responseData.answer && responseData.answer.text) {
+      return responseData.answer.text;
+    }
+
     // If the response contains a prompt, it will extract the first payload and the text within the payload
     if ('prompt' in responseData) {
       console.log("Prompt:", responseData['prompt']);
 
-      // Extracting the first payload
-      const firstPayload = responseData.prompt[0].payload;
-
-      // Accessing the text within the payload
-      const payloadText = firstPayload.text;
+      // The Python retrieval service (RAG/RetrievalService.py --context-tokens) packs the best sentences of all hits
+      // into a fixed token budget, which keeps the prompt short. Otherwise fall back to the text of the first payload
+      const payloadText = ('context' in responseData && responseData.context.text)
+        ? responseData.context.text
+        : responseData.prompt[0].payload.text;
 
       ChatUI.userprompt = "Here is the question the user wants If its illegal do not answer: " + prompt + ". Please answer the 1st question mentioned as a UWParkside Chatbot with the following data as a response, " +
         "ignore any other questions in the current prompt beyond this point: " + payloadText;
@@ -467,6 +481,7 @@ class ChatUI {
 
     console.log("$ - Modified prompt: " + ChatUI.userprompt);
     }
+    return null;
   }
 
   /**
@@ -33,6 +33,7 @@ import {onRequest} from "firebase-functions/v2/https";
 import * as logger from "firebase-functions/logger";
 import {OpenAI} from "openai";
 import {QdrantClient} from "@qdrant/js-client-rest";
+import {inflateSync} from "zlib";
 
 // Set the API keys for the OpenAI and Qdrant clients
 //NOTE: CURRENTLY SET TO DUMMY VALUES, REFER TO THE RESPECTIVE README's FOR GETTING A VALID KEY
@@ -72,18 +73,28 @@ const qdrantQuery = onRequest({cors: true}, async (request, response) => {
 
     const embedding = openaiResponse.data[0].embedding;
 
+    // Only the text is used by the chat client, so the rest of the payload and the vectors stay in Qdrant.
+    // Long texts are stored zlib-compressed in text_z by RAG/DatasetToQdrant.py (see RAG/Payloads.py)
     const searchResult = await qdrantClient.search("ChatbotDataset", {
       vector: embedding,
       limit: 3,
+      with_payload: ["text", "text_z"],
+      with_vector: false,
+    });
+    const hits = searchResult.map((result) => {
+      const payload = result.payload || {};
+      const text = typeof payload.text_z === "string" ?
+        inflateSync(Buffer.from(payload.text_z, "base64")).toString("utf-8") : payload.text;
+      return {id: result.id, version: result.version, score: result.score, payload: {text: text}, vector: null};
     });
 
     // prints the results of the query to the firebase console
     console.log("$ - Search Results:");
-    for (const result of searchResult) {
-      logger.info(result.payload);
+    for (const hit of hits) {
+      logger.info(hit.payload);
     }
 
-    response.send({message: "$ - Qdrant Response", prompt: searchResult});
+    response.send({message: "$ - Qdrant Response", prompt: hits});
   } catch (error) {
     console.error("$ - Error occurred:", error);
     response.status(500).send("Internal Server Error");
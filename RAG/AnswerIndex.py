@@ -0,0 +1,200 @@
+"""
+Precomputed answers to the curated questions, served without retrieval or generation.
+
+run2_fix.json and run2_validate_augment.json already hold curated answers, and the augmented
+file adds four paraphrases of every parent question (rows with "child_of"). A student asking one
+of those questions does not need retrieval and seconds of WebLLM decoding, the answer is known.
+
+The index is a LocalIndex.py directory with one row per question, parents and paraphrases alike,
+whose payload holds the parent's ID, question and answer, plus hashes.json mapping the hash of
+every normalized question (lowercase words only, so case, quotes and punctuation don't matter)
+to its row. A query is answered when:
+- its normalized hash is one of the known questions (no embedding needed), or
+- its embedding is at least min_similarity similar to a known question, and at least min_margin
+  more similar than to the closest question with a different answer.
+Answers are told apart by a hash of their text (answer_key), not by the parent's ID: IDs are only
+unique within a file, and some repeat inside a file too.
+Otherwise it goes through retrieval as usual. Flagged rows are left out.
+
+RetrievalService.py (--answer-index) puts the answer in the response as "answer" and the chat
+client shows it directly. The thresholds depend on the embedding backend; `evaluate` builds an
+index of the parent questions only and reports how many held-out paraphrases each threshold
+answers and how many of those answers are right.
+
+Usage:
+    python AnswerIndex.py build --backend openai --out answer_index
+    python AnswerIndex.py evaluate --backend hashing
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from Categories import CATEGORY_FIELD, parse_category
+from EmbeddingBackends import DATASETS_DIR, TOKEN_PATTERN, get_backend
+from LocalIndex import LocalIndex
+
+# The curated QA datasets, parents first so paraphrases can find them
+DEFAULT_SOURCES = (os.path.join(DATASETS_DIR, "Run_2_Files", "run2_fix.json"),
+                   os.path.join(DATASETS_DIR, "Run_2_Files", "run2_validate_augment.json"))
+
+
+# Lowercases a question and keeps only its words, so trivially different spellings match
+def normalize_question(text):
+    return " ".join(TOKEN_PATTERN.findall(text.lower()))
+
+
+def question_hash(text):
+    return hashlib.sha1(normalize_question(text).encode('utf-8')).hexdigest()[:16]
+
+
+# Identifies an answer by its text, so rows sharing an ID but not an answer stay distinct
+def answer_key(text):
+    return hashlib.sha1(text.strip().encode('utf-8')).hexdigest()[:16]
+
+
+# Yields (row ID, question, parent row) for every unflagged row of the datasets; rows without
+# a parent are their own parent. A parent is looked up in the row's own file first, since IDs
+# are only unique within a file. parents_only skips the paraphrases.
+def iter_questions(paths, parents_only=False):
+    files = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            files.append(json.load(file))
+    everywhere = {}
+    for rows in files:
+        for row in rows:
+            everywhere.setdefault(row.get("ID"), row)
+    for rows in files:
+        by_id = {row.get("ID"): row for row in rows}
+        for row in rows:
+            parent = by_id.get(row.get("child_of")) or everywhere.get(row.get("child_of"), row)
+            if row.get("Flagged") or parent.get("Flagged") or (parents_only and parent is not row):
+                continue
+            yield row.get("ID"), row["question"].strip().strip("'\""), parent
+
+
+class AnswerIndex:
+    # backend_name is the query backend, an index built with another one is refused (see LocalIndex)
+    def __init__(self, directory, backend_name=None, min_similarity=0.9, min_margin=0.02, candidates=10):
+        self.index = LocalIndex(directory, backend_name)
+        with open(os.path.join(directory, "hashes.json"), 'r') as file:
+            self.hashes = json.load(file)
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        # Questions compared when looking for the closest one with a different answer
+        self.candidates = candidates
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    # Embeds every question of the datasets and writes the index directory, then opens it
+    @classmethod
+    def build(cls, directory, paths, backend, batch_size=256, parents_only=False, **options):
+        ids, questions, payloads, hashes = [], [], [], {}
+        for row_id, question, parent in iter_questions(paths, parents_only):
+            # The first row with a question wins, which is the parent when a paraphrase repeats it
+            hashes.setdefault(question_hash(question), len(ids))
+            ids.append(row_id)
+            questions.append(question)
+            payloads.append({"answer_id": parent.get("ID"), "answer_key": answer_key(parent["answer"]),
+                             "question": parent["question"].strip().strip("'\""),
+                             "text": parent["answer"], **parse_category(parent.get("category"))})
+        vectors = np.concatenate([backend.embed(questions[start:start + batch_size])
+                                  for start in range(0, len(questions), batch_size)])
+        LocalIndex.build(directory, vectors, ids, payloads, backend.name)
+        with open(os.path.join(directory, "hashes.json"), 'w') as file:
+            json.dump(hashes, file)
+        return cls(directory, backend.name, **options)
+
+    def __len__(self):
+        return len(self.index)
+
+    # The answer stored in a row: {"id", "question", "text", "category", "score", "match"}
+    def _answer(self, row, score, match):
+        payload = self.index.payloads[row]
+        return {"id": payload["answer_id"], "question": payload["question"], "text": payload["text"],
+                "category": payload.get(CATEGORY_FIELD), "score": round(float(score), 4), "match": match}
+
+    # Returns the answer of a known question asked with the same words, or None
+    def lookup_exact(self, text):
+        row = self.hashes.get(question_hash(text))
+        return None if row is None else self._answer(row, 1.0, "exact")
+
+    # Returns the answer of the question closest to a query embedding when the match is confident, or None
+    def lookup_similar(self, vector):
+        if len(self.index) == 0:
+            return None
+        rows, scores = self.index.search_rows(vector, self.candidates)
+        rows, scores = rows[0], scores[0]
+        key = self.index.payloads[rows[0]]["answer_key"]
+        # The closest question that has another answer decides whether the best match is unambiguous
+        runner_up = next((score for row, score in zip(rows, scores)
+                          if self.index.payloads[row]["answer_key"] != key), -1.0)
+        if scores[0] < self.min_similarity or scores[0] - runner_up < self.min_margin:
+            return None
+        return self._answer(rows[0], scores[0], "similar")
+
+    # Returns the stored answer for a query, trying the exact match first; embed is only called when it fails
+    def lookup(self, text, embed):
+        answer = self.lookup_exact(text)
+        if answer is not None:
+            self.exact_hits += 1
+            return answer
+        answer = self.lookup_similar(embed(text))
+        if answer is None:
+            self.misses += 1
+        else:
+            self.similar_hits += 1
+        return answer
+
+    def stats(self):
+        return {"answer_exact_hits": self.exact_hits, "answer_similar_hits": self.similar_hits,
+                "answer_misses": self.misses}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or evaluate the precomputed answer index.")
+    parser.add_argument("command", choices=["build", "evaluate"])
+    parser.add_argument("--data", nargs="+", default=list(DEFAULT_SOURCES), help="QA datasets, parents first")
+    parser.add_argument("--out", default="answer_index", help="Index directory")
+    parser.add_argument("--backend", default="hashing", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the embeddings to this size")
+    parser.add_argument("--min-margin", type=float, default=0.02)
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+
+    if args.command == "build":
+        index = AnswerIndex.build(args.out, args.data, backend)
+        print(f"Built {args.out} with {len(index)} questions and {len(index.hashes)} distinct normalized questions")
+    else:
+        # Index the parents only, then ask every held-out paraphrase and check the answer it gets
+        directory = tempfile.mkdtemp()
+        try:
+            index = AnswerIndex.build(directory, args.data, backend, parents_only=True, min_margin=args.min_margin)
+            held_out = [(question, answer_key(parent["answer"]))
+                        for row_id, question, parent in iter_questions(args.data) if row_id != parent.get("ID")]
+            vectors = backend.embed([question for question, _ in held_out])
+            print(f"{len(held_out)} paraphrases against {len(index)} parent questions (backend {backend.name})")
+            for min_similarity in (0.7, 0.75, 0.8, 0.85, 0.9, 0.95):
+                index.min_similarity = min_similarity
+                answers = [index.lookup_similar(vector) for vector in vectors]
+                answered = [(answer_key(answer["text"]), key) for answer, (_, key) in zip(answers, held_out) if answer]
+                correct = sum(1 for answered_key, key in answered if answered_key == key)
+                print(f"min similarity {min_similarity:.2f}: {len(answered) / len(held_out):6.1%} answered, "
+                      f"{correct / max(len(answered), 1):6.1%} of them correctly")
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,185 @@
+"""
+Compact BM25 inverted index and reciprocal rank fusion with the vector search.
+
+Dense retrieval misses queries that hinge on an exact term, such as course codes ("CSCI 241"),
+building names or office names. This index is built at ingestion time (DatasetToQdrant.py
+--bm25-index, or the build command below) and stores, for every term, its postings as two
+arrays: the rows that contain it and the precomputed BM25 weight of the term in each row
+(IDF and length normalization included). Scoring a query is therefore a sum of array slices.
+
+Files in the index directory:
+- postings.npz:  offsets (per term), rows and weights (per posting), the CSR layout of the index
+- vocab.json:    term -> term number
+- table.jsonl:   one {"id": ..., "payload": {...}} line per row, same format as LocalIndex.py
+
+reciprocal_rank_fusion() merges ranked hit lists: each hit scores sum(1 / (k + rank)) over the
+lists it appears in, so documents ranked well by both legs rise to the top. Hits are matched by
+row_key(), their ID together with their question and text, since QA IDs are not unique.
+
+Usage:
+    python BM25Index.py build --source ../Datasets/UWP_Website_Files/uwp_data.json --out bm25_index
+    python BM25Index.py search --index bm25_index "CSCI 241"
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from Categories import CATEGORY_FIELD
+from EmbeddingBackends import TOKEN_PATTERN
+from LocalIndex import iter_documents, top_k_indexes
+
+
+# Splits text into lowercase word tokens, the same way for documents and queries
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Builder:
+    # Collects documents one at a time (so it can ride along with a streaming ingestion) and writes the index
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.ids = []
+        self.payloads = []
+        self.lengths = []
+        # Per-term lists of (row, term frequency), turned into flat arrays by save()
+        self._postings = []
+
+    def add(self, point_id, text, payload=None):
+        row = len(self.ids)
+        self.ids.append(point_id)
+        self.payloads.append(payload if payload is not None else {"text": text})
+        tokens = tokenize(text)
+        self.lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            term = self.vocab.get(token)
+            if term is None:
+                term = self.vocab[token] = len(self._postings)
+                self._postings.append([])
+            self._postings[term].append((row, count))
+
+    # Computes the BM25 weight of every posting and writes the index directory
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        lengths = np.array(self.lengths, dtype=np.float32)
+        average_length = lengths.mean() if len(lengths) else 1.0
+        document_count = len(self.ids)
+
+        offsets = np.zeros(len(self._postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings) for postings in self._postings])
+        rows = np.empty(offsets[-1], dtype=np.int32)
+        weights = np.empty(offsets[-1], dtype=np.float32)
+        for term, postings in enumerate(self._postings):
+            start, end = offsets[term], offsets[term + 1]
+            term_rows = np.array([row for row, _ in postings], dtype=np.int32)
+            frequencies = np.array([count for _, count in postings], dtype=np.float32)
+            idf = np.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[term_rows] / average_length)
+            rows[start:end] = term_rows
+            weights[start:end] = idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+
+        np.savez(os.path.join(directory, "postings.npz"), offsets=offsets, rows=rows, weights=weights)
+        with open(os.path.join(directory, "vocab.json"), 'w', encoding='utf-8') as file:
+            json.dump(self.vocab, file)
+        with open(os.path.join(directory, "table.jsonl"), 'w', encoding='utf-8') as file:
+            for point_id, payload in zip(self.ids, self.payloads):
+                file.write(json.dumps({"id": point_id, "payload": payload}) + "\n")
+        return BM25Index(directory)
+
+
+class BM25Index:
+    def __init__(self, directory):
+        arrays = np.load(os.path.join(directory, "postings.npz"))
+        self.offsets = arrays["offsets"]
+        self.rows = arrays["rows"]
+        self.weights = arrays["weights"]
+        with open(os.path.join(directory, "vocab.json"), 'r', encoding='utf-8') as file:
+            self.vocab = json.load(file)
+        self.ids = []
+        self.payloads = []
+        with open(os.path.join(directory, "table.jsonl"), 'r', encoding='utf-8') as file:
+            for line in file:
+                row = json.loads(line)
+                self.ids.append(row["id"])
+                self.payloads.append(row["payload"])
+        # Category of every row, for searches restricted to categories
+        self.categories = np.array([payload.get(CATEGORY_FIELD) for payload in self.payloads], dtype=object)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Returns the BM25 score of every row for a query
+    def scores(self, text):
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for token in set(tokenize(text)):
+            term = self.vocab.get(token)
+            if term is not None:
+                start, end = self.offsets[term], self.offsets[term + 1]
+                scores[self.rows[start:end]] += self.weights[start:end]
+        return scores
+
+    # Returns the best rows for a query as hits shaped like RetrievalService.QdrantSearcher results,
+    # optionally only among the rows in one of the given categories
+    def search_text(self, text, limit, categories=None):
+        if len(self.ids) == 0:
+            return []
+        scores = self.scores(text)
+        if categories is not None:
+            scores[~np.isin(self.categories, list(categories))] = 0
+        rows = [row for row in top_k_indexes(scores, limit) if scores[row] > 0]
+        return [
+            {"id": self.ids[row], "version": 0, "score": float(scores[row]), "payload": self.payloads[row], "vector": None}
+            for row in rows
+        ]
+
+
+# Identifies one row across hit lists. QA IDs repeat across and within the dataset files, so the ID
+# alone would merge different rows; it is paired with the row's question and text.
+def row_key(hit):
+    payload = hit.get("payload") or {}
+    return str(hit["id"]), payload.get("question"), payload.get("text")
+
+
+# Merges ranked hit lists by reciprocal rank fusion and returns the best limit hits.
+# k dampens the advantage of the very first ranks; 60 is the value from the original RRF paper.
+def reciprocal_rank_fusion(hit_lists, limit, k=60):
+    fused = {}
+    for hits in hit_lists:
+        for rank, hit in enumerate(hits):
+            key = row_key(hit)
+            if key not in fused:
+                fused[key] = dict(hit, score=0.0)
+            fused[key]["score"] += 1.0 / (k + rank + 1)
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)[:limit]
+
+
+# Builds an index from a QA dataset or Dataset.txt, using the same documents as LocalIndex.py
+def build_from_source(directory, source):
+    builder = BM25Builder()
+    for point_id, text, payload in iter_documents(source):
+        builder.add(point_id, text, payload)
+    return builder.save(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query a BM25 inverted index.")
+    parser.add_argument("command", choices=["build", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--source", default=os.path.join("..", "Datasets", "Run_2_Files", "run2_fix.json"))
+    parser.add_argument("--out", "--index", dest="index", default="bm25_index")
+    parser.add_argument("--limit", type=int, default=3)
+    args = parser.parse_intermixed_args()
+
+    if args.command == "build":
+        index = build_from_source(args.index, args.source)
+        print(f"Built {args.index} with {len(index)} documents and {len(index.vocab)} terms")
+    else:
+        for hit in BM25Index(args.index).search_text(args.query, args.limit):
+            print(hit["score"], hit["payload"])
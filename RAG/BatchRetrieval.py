@@ -0,0 +1,131 @@
+"""
+Batched retrieval of many queries at once, for offline evaluation.
+
+Answering the 1,750 questions of run2_validate_augment.json one request at a time means 1,750
+embedding calls and 1,750 searches. This script embeds the queries in large batches and then
+either sends Qdrant batch search requests (many searches per HTTP call) or, with --local-index,
+scores every query against the whole index with one matrix multiplication.
+
+Results are columnar: an (n_queries, k) array of point IDs and a matching float32 array of
+scores. Rows with fewer than k hits are padded with None and NaN.
+At the end of the run the p50/p95/p99 of every embedding call and search request are printed
+(see Metrics.py), and written as JSON with --metrics-out.
+
+Usage:
+    python BatchRetrieval.py --queries ../Datasets/Run_2_Files/run2_validate_augment.json --local-index qa_index
+    python BatchRetrieval.py --queries ../Datasets/Run_2_Files/run2_validate_augment.json --backend openai --out results.npz
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+# Import the QdrantClient from the qdrant_client package for interacting with the Qdrant API
+from qdrant_client import QdrantClient, models
+
+from EmbeddingBackends import get_backend
+from LocalIndex import LocalIndex
+from Metrics import metrics
+
+# API keys and cluster URL, replace these with your own values
+OPENAI_API_KEY = "OPEN_AI_API_KEY"
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Specify the name of the collection in Qdrant to search
+collection_name = "ChatbotDataset"
+
+
+# Embeds a list of queries in batches and returns one float32 matrix
+def embed_queries(backend, texts, batch_size=512):
+    batches = []
+    for start in range(0, len(texts), batch_size):
+        with metrics.span("embed"):
+            batches.append(backend.embed(texts[start:start + batch_size]))
+    return np.concatenate(batches)
+
+
+# Turns per-query lists of (id, score) into the columnar (ids, scores) arrays
+def to_columns(results, limit):
+    ids = np.full((len(results), limit), None, dtype=object)
+    scores = np.full((len(results), limit), np.nan, dtype=np.float32)
+    for row, hits in enumerate(results):
+        for column, (point_id, score) in enumerate(hits[:limit]):
+            ids[row, column] = point_id
+            scores[row, column] = score
+    return ids, scores
+
+
+# Searches Qdrant for every query vector, sending request_batch searches per HTTP call
+def batch_search_qdrant(client, vectors, limit=10, collection=collection_name, request_batch=64, query_filter=None):
+    results = []
+    for start in range(0, len(vectors), request_batch):
+        requests = [
+            models.QueryRequest(query=vector.tolist(), limit=limit, filter=query_filter,
+                                with_payload=False, with_vector=False)
+            for vector in vectors[start:start + request_batch]
+        ]
+        with metrics.span("search"):
+            responses = client.query_batch_points(collection, requests=requests)
+        for response in responses:
+            results.append([(point.id, point.score) for point in response.points])
+    return to_columns(results, limit)
+
+
+# Searches a LocalIndex for every query vector with a single matrix multiplication
+def batch_search_local(index, vectors, limit=10):
+    with metrics.span("search"):
+        rows, scores = index.search_rows(vectors, limit)
+    ids = np.array(index.ids, dtype=object)[rows]
+    return ids, scores.astype(np.float32)
+
+
+# Loads the questions of a QA dataset, stripping the stray quotes the augmentation step left around some of them
+def load_questions(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [row["question"].strip().strip("'\"") for row in json.load(file)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieve results for a whole file of questions at once.")
+    parser.add_argument("--queries", default=os.path.join("..", "Datasets", "Run_2_Files", "run2_validate_augment.json"))
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--collection", default=collection_name)
+    parser.add_argument("--local-index", default=None, help="Search this LocalIndex.py directory instead of Qdrant")
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the query embeddings, must match the ingestion")
+    parser.add_argument("--embed-batch", type=int, default=512, help="Queries per embedding call")
+    parser.add_argument("--request-batch", type=int, default=64, help="Searches per Qdrant batch request")
+    parser.add_argument("--out", default=None, help="Write ids/scores to this .npz file")
+    parser.add_argument("--metrics-out", default=None, help="Also write the JSON metrics summary of the run to this file")
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key=OPENAI_API_KEY)
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+
+    questions = load_questions(args.queries)
+    start_time = time.perf_counter()
+    vectors = embed_queries(backend, questions, args.embed_batch)
+    embed_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if args.local_index:
+        ids, scores = batch_search_local(LocalIndex(args.local_index, backend.name), vectors, args.limit)
+    else:
+        client = QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY)
+        ids, scores = batch_search_qdrant(client, vectors, args.limit, args.collection, args.request_batch)
+    search_seconds = time.perf_counter() - start_time
+
+    print(f"Retrieved top {args.limit} for {len(questions)} queries: "
+          f"embedding {embed_seconds:.2f}s, search {search_seconds:.2f}s")
+    if args.out:
+        np.savez(args.out, ids=ids.astype(str), scores=scores)
+        print(f"Wrote {args.out}")
+    metrics.report(args.metrics_out)
@@ -0,0 +1,135 @@
+"""
+Question categories of the QA datasets, used to partition retrieval.
+
+Every QA row has a "category" of the form "Paragraph Category | Question Category", where both
+halves are one of five fixed values (CATEGORIES). parse_category() splits it into the
+"paragraph_category" and "question_category" payload fields, which CreateCollection.py indexes
+so Qdrant can restrict a search to a category without scanning the rest of the collection.
+category_filter() builds that Qdrant filter; LocalIndex.py and BM25Index.py filter on the same field.
+
+CategoryClassifier predicts the question category of a query from the query embedding the
+retriever computes anyway. It keeps one centroid per category (the normalized mean of the
+training questions' embeddings), so a prediction costs one 5 x dim product. RetrievalService.py
+uses it with --category-model to search the predicted category first.
+
+Usage:
+    python Categories.py train --backend hashing --out category_model.npz
+    python Categories.py evaluate --backend hashing --model category_model.npz
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+# Import the models from the qdrant_client package to build search filters
+from qdrant_client import models
+
+from EmbeddingBackends import DATASETS_DIR, get_backend, normalize_rows
+
+# The five category values used in the QA datasets
+CATEGORIES = ("About Us", "Academics", "Admissions and Aid", "Arts and Athletics", "Campus Life")
+# Payload field that category filters match against: what the question is about
+CATEGORY_FIELD = "question_category"
+
+
+# Splits "Paragraph Category | Question Category" into payload fields, fixing the case of the values.
+# Values that are not one of CATEGORIES are left out.
+def parse_category(value):
+    canonical = {category.lower(): category for category in CATEGORIES}
+    fields = {}
+    for field, part in zip(("paragraph_category", "question_category"), (value or "").split("|")):
+        category = canonical.get(part.strip().lower())
+        if category is not None:
+            fields[field] = category
+    return fields
+
+
+# Builds a Qdrant filter that keeps only points in one of the given categories
+def category_filter(categories, field=CATEGORY_FIELD):
+    return models.Filter(must=[models.FieldCondition(key=field, match=models.MatchAny(any=list(categories)))])
+
+
+class CategoryClassifier:
+    # Nearest-centroid classifier over query embeddings
+    def __init__(self, names, centroids, backend_name=None):
+        self.names = list(names)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.backend_name = backend_name
+
+    # Learns one centroid per category from labelled question embeddings
+    @classmethod
+    def fit(cls, vectors, labels, backend_name=None):
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        labels = np.array(labels)
+        names = [category for category in CATEGORIES if np.any(labels == category)]
+        centroids = normalize_rows(np.stack([vectors[labels == name].mean(axis=0) for name in names]))
+        return cls(names, centroids, backend_name)
+
+    def save(self, path):
+        np.savez(path, names=np.array(self.names), centroids=self.centroids,
+                 backend=np.array(self.backend_name or ""))
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        return cls([str(name) for name in arrays["names"]], arrays["centroids"], str(arrays["backend"]) or None)
+
+    # Returns [(category, similarity)] for a query vector, most likely first
+    def predict(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = self.centroids @ (vector / (np.linalg.norm(vector) or 1.0))
+        return [(self.names[i], float(scores[i])) for i in np.argsort(-scores)]
+
+    # Returns the most likely category, or None when it does not beat the runner-up by min_margin
+    def choose(self, vector, min_margin=0.0):
+        ranked = self.predict(vector)
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < min_margin:
+            return None
+        return ranked[0][0]
+
+
+# Loads (questions, question categories) from a QA dataset, skipping rows without a valid category
+def load_labelled_questions(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        rows = json.load(file)
+    questions, labels = [], []
+    for row in rows:
+        category = parse_category(row.get("category")).get(CATEGORY_FIELD)
+        if category is not None:
+            questions.append(row["question"].strip().strip("'\""))
+            labels.append(category)
+    return questions, labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or evaluate the query category classifier.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--data", default=None,
+                        help="QA dataset (default: run2_fix.json to train, run2_validate_augment.json to evaluate)")
+    parser.add_argument("--out", "--model", dest="model", default="category_model.npz")
+    parser.add_argument("--backend", default="hashing", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--dimensions", type=int, default=None)
+    parser.add_argument("--min-margin", type=float, default=0.0, help="Margin needed to trust a prediction")
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
+    backend = get_backend(args.backend, openai_client, dim=args.hashing_dim, dimensions=args.dimensions)
+
+    default_data = "run2_fix.json" if args.command == "train" else "run2_validate_augment.json"
+    questions, labels = load_labelled_questions(args.data or os.path.join(DATASETS_DIR, "Run_2_Files", default_data))
+    vectors = backend.embed(questions)
+    if args.command == "train":
+        CategoryClassifier.fit(vectors, labels, backend.name).save(args.model)
+        print(f"Trained on {len(questions)} questions, wrote {args.model}")
+    else:
+        classifier = CategoryClassifier.load(args.model)
+        predictions = [classifier.choose(vector, args.min_margin) for vector in vectors]
+        answered = [(prediction, label) for prediction, label in zip(predictions, labels) if prediction is not None]
+        correct = sum(1 for prediction, label in answered if prediction == label)
+        print(f"{len(answered)}/{len(labels)} questions given a category, "
+              f"{correct / max(len(answered), 1):.3f} of them correct")
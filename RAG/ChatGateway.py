@@ -0,0 +1,419 @@
+"""
+OpenAI-compatible chat endpoint that does retrieval and prompt assembly on the server.
+
+    POST /v1/chat/completions  {"messages": [...], "stream": true, ...}  ->  text/event-stream of chat.completion.chunk
+
+The browser used to call the retrieval function, paste the hit into the prompt itself and then
+run generation. The gateway does all of that in one request:
+1. the last user message is answered from AnswerIndex.py when it is a curated question (the
+   stored answer is returned as the completion and no model is called), otherwise
+2. it is retrieved with the same Retriever as RetrievalService.py and the hits are packed into
+   a token budget by ContextBuilder.py,
+3. a system message holding that context is put in front of the conversation and the request
+   is forwarded to a local OpenAI-compatible inference server (LM Studio, llama.cpp, vLLM, ...)
+   with stream=true. Every chunk is relayed to the client the moment it arrives, so the first
+   token reaches the client as soon as the model produces it.
+
+The upstream client is created once and keeps a pool of keep-alive connections (--pool-size),
+so requests don't pay for a new connection. Responses to the client use chunked transfer
+encoding, which keeps its connection open too. Time to first token and total generation time
+are recorded by Metrics.py and served at GET /metrics. --query-log and --warm-cache work as in
+RetrievalService.py: hot questions precomputed by HotQueries.py skip retrieval and context packing.
+
+A failure of the gateway's own retrieval step (the answer index, the vector or BM25 search, context
+packing) is answered with 503 and the type "retrieval_error", before any event is streamed.
+Failures of the inference server are 502 "upstream_error", so load tests and the metrics tell the
+two apart.
+
+The `stub` command runs a small OpenAI-compatible server that streams back words of the context
+it was given, one every --token-delay seconds, to test the gateway without a model.
+
+Usage:
+    python ChatGateway.py stub --port 1234
+    python ChatGateway.py serve --upstream http://localhost:1234/v1 --local-index qa_index --backend hashing --port 8081
+    curl -N localhost:8081/v1/chat/completions -d '{"messages": [{"role": "user", "content": "When is tuition due?"}], "stream": true}'
+"""
+
+import argparse
+import json
+import sys
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Metrics import metrics
+
+# System message put in front of the conversation, {context} is replaced by the packed hits
+SYSTEM_PROMPT = ("You are the UW-Parkside chatbot. Answer the student's question using the information below. "
+                 "If it does not contain the answer, say that you don't know. Do not answer homework problems "
+                 "or anything illegal.\n\nInformation:\n{context}")
+# Request fields passed on to the inference server as they are
+FORWARDED_FIELDS = ("temperature", "top_p", "max_tokens", "stop", "presence_penalty", "frequency_penalty", "seed")
+
+
+# Raised when the retrieval step of a request fails, as opposed to the inference server
+class RetrievalError(Exception):
+    pass
+
+
+# Returns the text of the last user message, or None
+def last_user_message(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user" and isinstance(message.get("content"), str):
+            return message["content"]
+    return None
+
+
+# Writes one server-sent event as one HTTP chunk (chunked transfer encoding) and flushes it to the client
+def write_event(wfile, data):
+    event = f"data: {data}\n\n".encode('utf-8')
+    wfile.write(f"{len(event):X}\r\n".encode('ascii') + event + b"\r\n")
+    wfile.flush()
+
+
+# A chat.completion.chunk in the format of the OpenAI API
+def make_chunk(completion_id, model, delta, finish_reason=None):
+    return {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+# A whole chat.completion in the format of the OpenAI API
+def make_completion(completion_id, model, content):
+    return {"id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}
+
+
+class ChatGateway:
+    # client is an openai.OpenAI client pointed at the inference server, model the model it serves
+    def __init__(self, retriever, context_builder, client, model, system_prompt=SYSTEM_PROMPT):
+        self.retriever = retriever
+        self.context_builder = context_builder
+        self.client = client
+        self.model = model
+        self.system_prompt = system_prompt
+
+    # Returns (messages for the inference server, stored answer or None, {"sources", "timings"}) for a request.
+    # Raises RetrievalError when the answer lookup, the search or the context packing fails.
+    def prepare(self, messages):
+        try:
+            return self._prepare(messages)
+        except Exception as e:
+            metrics.inc("errors_total", stage="retrieval")
+            raise RetrievalError(str(e)) from e
+
+    def _prepare(self, messages):
+        query = last_user_message(messages)
+        if query is None:
+            return messages, None, {"sources": [], "timings": {}}
+        answer, timings = self.retriever.answer(query)
+        if answer is not None:
+            return messages, answer, {"sources": [answer["id"]], "timings": timings}
+
+        hits, search_timings = self.retriever.retrieve_with_timings(query)
+        timings = dict(timings, **search_timings)
+        start_time = time.perf_counter()
+        context = self.retriever.cached_context(query, self.context_builder.max_tokens)
+        if context is None:
+            context = self.context_builder.build(query, hits)
+        seconds = time.perf_counter() - start_time
+        timings["context_ms"] = round(seconds * 1000, 3)
+        metrics.observe("context", seconds)
+        system = {"role": "system", "content": self.system_prompt.format(context=context["text"])}
+        return [system] + list(messages), None, {"sources": context["sources"], "timings": timings}
+
+    # Keyword arguments of the upstream call for a request
+    def _options(self, request, messages):
+        options = {field: request[field] for field in FORWARDED_FIELDS if field in request}
+        return dict(options, model=request.get("model") or self.model, messages=messages)
+
+    # Retrieves the context of a streamed answer, then returns a generator of its chat.completion.chunk
+    # dictionaries. Retrieval runs here, before the first event, so a RetrievalError can still get its own status.
+    def stream(self, request):
+        start_time = time.perf_counter()
+        messages, answer, _ = self.prepare(request["messages"])
+        return self._relay(request, messages, answer, start_time)
+
+    # Yields the stored answer as chunks, or relays the chunks of the inference server
+    def _relay(self, request, messages, answer, start_time):
+        if answer is not None:
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            model = request.get("model") or self.model
+            yield make_chunk(completion_id, model, {"role": "assistant", "content": answer["text"]})
+            yield make_chunk(completion_id, model, {}, "stop")
+            return
+
+        metrics.inc("api_calls_total", api="chat")
+        first = True
+        with metrics.span("generate"), \
+                self.client.chat.completions.create(stream=True, **self._options(request, messages)) as upstream:
+            for chunk in upstream:
+                if first:
+                    metrics.observe("first_token", time.perf_counter() - start_time)
+                    first = False
+                yield chunk.model_dump(exclude_none=True)
+
+    # Returns the whole chat.completion for a request that did not ask for streaming
+    def complete(self, request):
+        messages, answer, rag = self.prepare(request["messages"])
+        if answer is not None:
+            completion = make_completion(f"chatcmpl-{uuid.uuid4().hex}", request.get("model") or self.model,
+                                         answer["text"])
+        else:
+            metrics.inc("api_calls_total", api="chat")
+            with metrics.span("generate"):
+                completion = self.client.chat.completions.create(**self._options(request, messages))
+            completion = completion.model_dump(exclude_none=True)
+        # Extra field, ignored by OpenAI clients: what the answer was based on and where the time went
+        completion["rag"] = rag
+        return completion
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps client connections open between requests, streams use chunked encoding
+    protocol_version = "HTTP/1.1"
+    # Headers, body and every streamed event are separate writes, which Nagle would hold back
+    disable_nagle_algorithm = True
+    gateway = None
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Errors in the format of the OpenAI API
+    def _send_error(self, status, message, error_type="invalid_request_error"):
+        metrics.inc("requests_total", status=str(status))
+        self._send(status, json.dumps({"error": {"message": message, "type": error_type}}))
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            model = {"id": self.gateway.model, "object": "model", "owned_by": "uwp-chatbot"}
+            self._send(200, json.dumps({"object": "list", "data": [model]}))
+        elif self.path == "/metrics":
+            self._send(200, metrics.prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, "Not Found", "text/plain")
+
+    def do_POST(self):
+        if self.path != "/v1/chat/completions":
+            self._send(404, "Not Found", "text/plain")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            request = None
+        messages = request.get("messages") if isinstance(request, dict) else None
+        if not isinstance(messages, list) or not messages or not all(isinstance(message, dict) for message in messages):
+            self._send_error(400, "messages must be a non-empty list of message objects")
+            return
+
+        if not request.get("stream"):
+            try:
+                completion = self.gateway.complete(request)
+            except RetrievalError as e:
+                print(f"$ - Retrieval error: {e}")
+                self._send_error(503, f"Retrieval error: {e}", "retrieval_error")
+                return
+            except Exception as e:
+                print(f"$ - Error occurred: {e}")
+                self._send_error(502, f"Inference server error: {e}", "upstream_error")
+                return
+            metrics.inc("requests_total", status="200")
+            self._send(200, json.dumps(completion, separators=(",", ":")))
+            return
+
+        try:
+            events = self.gateway.stream(request)
+        except RetrievalError as e:
+            print(f"$ - Retrieval error: {e}")
+            self._send_error(503, f"Retrieval error: {e}", "retrieval_error")
+            return
+        # Headers go out before the first token so the client can start reading right away
+        self.send_response(200)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in events:
+                write_event(self.wfile, json.dumps(chunk, separators=(",", ":")))
+            metrics.inc("requests_total", status="200")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; closing the upstream stream stops the generation
+            events.close()
+            metrics.inc("requests_total", status="disconnected")
+            self.close_connection = True
+            return
+        except Exception as e:
+            print(f"$ - Error occurred: {e}")
+            metrics.inc("requests_total", status="502")
+            write_event(self.wfile, json.dumps({"error": {"message": f"Inference server error: {e}",
+                                                          "type": "upstream_error"}}))
+        write_event(self.wfile, "[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    # Keep the console quiet, one line per request is too much under load
+    def log_message(self, format, *args):
+        pass
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # An OpenAI-compatible inference server that streams back the start of the context it was given
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    token_delay = 0.02
+    max_words = 40
+
+    # The reply: the first max_words words of the system message's information, or an echo of the question
+    def _reply(self, messages):
+        system = next((message["content"] for message in messages if message.get("role") == "system"), "")
+        words = system.split("Information:", 1)[-1].split() if system else []
+        if not words:
+            words = f"You asked: {last_user_message(messages) or ''}".split()
+        return words[:self.max_words]
+
+    def do_GET(self):
+        data = json.dumps({"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data.encode('utf-8'))
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        words = self._reply(request.get("messages", []))
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:8]}"
+        model = request.get("model") or "stub"
+        if not request.get("stream"):
+            time.sleep(self.token_delay * len(words))
+            data = json.dumps(make_completion(completion_id, model, " ".join(words))).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [make_chunk(completion_id, model, {"role": "assistant", "content": ""})]
+        chunks += [make_chunk(completion_id, model, {"content": (" " if i else "") + word}) for i, word in enumerate(words)]
+        chunks.append(make_chunk(completion_id, model, {}, "stop"))
+        for chunk in chunks:
+            time.sleep(self.token_delay)
+            write_event(self.wfile, json.dumps(chunk))
+        write_event(self.wfile, "[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    # Clients dropping a stream or a kept-alive connection is normal, every other error is still printed
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+# Creates the HTTP server for a gateway; call serve_forever() on the result
+def make_server(gateway, host="0.0.0.0", port=8081):
+    handler = type("Handler", (GatewayHandler,), {"gateway": gateway})
+    return GatewayServer((host, port), handler)
+
+
+# Creates the stub inference server; call serve_forever() on the result
+def make_stub_server(host="127.0.0.1", port=1234, token_delay=0.02):
+    handler = type("Handler", (StubHandler,), {"token_delay": token_delay})
+    return GatewayServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve an OpenAI-compatible chat endpoint with server-side retrieval.")
+    parser.add_argument("command", choices=["serve", "stub"])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=None, help="Port to listen on (8081 for serve, 1234 for stub)")
+    parser.add_argument("--upstream", default="http://localhost:1234/v1", help="OpenAI-compatible inference server")
+    parser.add_argument("--upstream-key", default="lm-studio", help="API key sent to the inference server")
+    parser.add_argument("--model", default="local-model", help="Model requested from the inference server")
+    parser.add_argument("--pool-size", type=int, default=32, help="Keep-alive connections kept to the inference server")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for the inference server")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between the stub's tokens")
+    parser.add_argument("--collection", default="ChatbotDataset")
+    parser.add_argument("--local-index", default=None, help="Search this LocalIndex.py directory instead of Qdrant")
+    parser.add_argument("--bm25-index", default=None, help="BM25Index.py directory, enables hybrid search")
+    parser.add_argument("--rerank", default=None, choices=["lexical", "cross-encoder"])
+    parser.add_argument("--answer-index", default=None, help="AnswerIndex.py directory of curated answers")
+    parser.add_argument("--answer-similarity", type=float, default=0.9)
+    parser.add_argument("--query-log", default=None, help="Append every retrieved query to this JSON lines file")
+    parser.add_argument("--warm-cache", default=None, help="Warm cache directory written by HotQueries.py warm")
+    parser.add_argument("--limit", type=int, default=3, help="Number of hits packed into the context")
+    parser.add_argument("--context-tokens", type=int, default=400, help="Token budget of the context")
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--embedding-model", default=None, help="Model for the openai/sentence-transformers backends")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the query embeddings, must match the ingestion")
+    args = parser.parse_args()
+
+    if args.command == "stub":
+        server = make_stub_server(args.host, args.port or 1234, args.token_delay)
+        print(f"Stub inference server on http://{args.host}:{args.port or 1234}/v1")
+        server.serve_forever()
+
+    import httpx
+    import openai
+    from qdrant_client import QdrantClient
+
+    from AnswerIndex import AnswerIndex
+    from BM25Index import BM25Index
+    from ContextBuilder import ContextBuilder
+    from EmbeddingBackends import get_backend
+    from HotQueries import QueryLog, WarmCache
+    from LocalIndex import LocalIndex
+    from Reranker import get_reranker
+    from RetrievalService import OPENAI_API_KEY, QDRANT_API_KEY, QDRANT_CLUSTER_URL, QdrantSearcher, Retriever
+
+    embedding_client = openai.Client(api_key=OPENAI_API_KEY) if args.backend == "openai" else None
+    backend = get_backend(args.backend, embedding_client, args.embedding_model, args.hashing_dim, args.idf,
+                          args.dimensions)
+    if args.local_index:
+        searcher = LocalIndex(args.local_index, backend.name)
+    else:
+        searcher = QdrantSearcher(QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY), args.collection)
+    lexical_index = BM25Index(args.bm25_index) if args.bm25_index else None
+    reranker = get_reranker(args.rerank, lexical_index) if args.rerank else None
+    answer_index = AnswerIndex(args.answer_index, backend.name, args.answer_similarity) if args.answer_index else None
+    query_log = QueryLog(args.query_log) if args.query_log else None
+    warm_cache = WarmCache(args.warm_cache) if args.warm_cache else None
+    retriever = Retriever(backend, searcher, args.limit, lexical_index=lexical_index, reranker=reranker,
+                          answer_index=answer_index, query_log=query_log, warm_cache=warm_cache)
+
+    # One client for every request, its connection pool keeps the connections to the inference server open
+    limits = httpx.Limits(max_connections=args.pool_size, max_keepalive_connections=args.pool_size)
+    client = openai.OpenAI(base_url=args.upstream, api_key=args.upstream_key, timeout=args.timeout, max_retries=0,
+                           http_client=openai.DefaultHttpxClient(limits=limits))
+    gateway = ChatGateway(retriever, ContextBuilder(args.context_tokens), client, args.model)
+    server = make_server(gateway, args.host, args.port or 8081)
+    print(f"Serving chat completions on http://{args.host}:{args.port or 8081}/v1, generating with {args.upstream}")
+    server.serve_forever()
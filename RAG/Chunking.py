@@ -0,0 +1,233 @@
+"""
+Token-aware chunking of the structured site dumps for RAG ingestion.
+
+Embedding Dataset.txt one raw line at a time produces many tiny points that carry little
+information and cost one embedding each. This module reads the site dumps directly
+(uwp_data.json "response" text and cs_data.json "body_content") and cuts every page into
+chunks of at most max_tokens tokens, packing whole sentences and repeating the last
+overlap_tokens worth of sentences at the start of the next chunk so no fact is cut in half.
+
+Chunks that are exact or near-exact duplicates of an earlier chunk, mostly the navigation
+boilerplate repeated on every page, are dropped before embedding:
+- exact:      same text after lowercasing and removing punctuation and extra whitespace
+- near-exact: MinHash estimate of the Jaccard similarity of word 5-grams above a threshold
+
+Tokens are counted with tiktoken's cl100k_base (the tokenizer of text-embedding-3-small) when
+it is installed and its encoding can be loaded, otherwise words and punctuation are counted.
+
+Usage:
+    python Chunking.py --source ../Datasets/UWP_Website_Files/uwp_data.json ../Datasets/CS_Website_Files/cs_data.json
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import zlib
+
+import numpy as np
+
+# Sentences end at ., ! or ? followed by whitespace, or at a blank line (the dumps wrap lines mid-sentence)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+# Fallback tokens: runs of word characters, or single punctuation marks
+FALLBACK_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+class Tokenizer:
+    # Wraps tiktoken when available, otherwise counts words and punctuation marks
+    def __init__(self, encoding="cl100k_base"):
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding)
+            self.name = encoding
+        except Exception:
+            # Not installed, or the encoding file can't be downloaded (offline machines)
+            self._encoding = None
+            self.name = "words"
+
+    def encode(self, text):
+        if self._encoding is not None:
+            return self._encoding.encode(text, disallowed_special=())
+        return FALLBACK_TOKEN_PATTERN.findall(text)
+
+    def count(self, text):
+        return len(self.encode(text))
+
+    # Returns the longest prefix of text that fits in max_tokens tokens
+    def truncate(self, text, max_tokens):
+        tokens = self.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        if self._encoding is not None:
+            return self._encoding.decode(tokens[:max_tokens])
+        # Cut at the character where the first token past the limit starts
+        match = list(FALLBACK_TOKEN_PATTERN.finditer(text))[max_tokens]
+        return text[:match.start()].rstrip()
+
+
+# One tokenizer shared by every caller, loading the encoding is slow
+_tokenizer = None
+
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = Tokenizer()
+    return _tokenizer
+
+
+# Splits text into sentences, breaking sentences longer than max_tokens into word runs that fit
+def split_sentences(text, tokenizer, max_tokens):
+    for sentence in SENTENCE_PATTERN.split(text):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        if tokenizer.count(sentence) <= max_tokens:
+            yield sentence
+            continue
+        # Count every word once (with its leading space, as the tokenizer sees it inside a sentence)
+        piece, piece_tokens = [], 0
+        for word in sentence.split(" "):
+            word_tokens = tokenizer.count(" " + word)
+            if piece and piece_tokens + word_tokens > max_tokens:
+                yield " ".join(piece)
+                piece, piece_tokens = [], 0
+            piece.append(word)
+            piece_tokens += word_tokens
+        if piece:
+            yield " ".join(piece)
+
+
+# Packs the sentences of a text into chunks of at most max_tokens tokens that overlap by
+# up to overlap_tokens tokens of whole sentences
+def chunk_text(text, max_tokens=256, overlap_tokens=32, tokenizer=None):
+    tokenizer = tokenizer or get_tokenizer()
+    chunk, chunk_tokens = [], 0
+    for sentence in split_sentences(text, tokenizer, max_tokens):
+        sentence_tokens = tokenizer.count(sentence)
+        if chunk and chunk_tokens + sentence_tokens > max_tokens:
+            yield " ".join(chunk)
+            # Carry the trailing sentences that fit in the overlap into the next chunk
+            overlap, overlap_count = [], 0
+            for previous in reversed(chunk):
+                previous_tokens = tokenizer.count(previous)
+                if overlap_count + previous_tokens > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_count += previous_tokens
+            chunk, chunk_tokens = overlap, overlap_count
+            # Make sure the overlap and the new sentence still fit together
+            while chunk and chunk_tokens + sentence_tokens > max_tokens:
+                chunk_tokens -= tokenizer.count(chunk.pop(0))
+        chunk.append(sentence)
+        chunk_tokens += sentence_tokens
+    if chunk:
+        yield " ".join(chunk)
+
+
+# Yields (text, metadata) for every page of a site dump (uwp_data.json or cs_data.json)
+def iter_pages(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        rows = json.load(file)
+    for row in rows:
+        if "body_content" in row:
+            yield row["body_content"], {"code": row.get("code"), "file": row.get("file")}
+        else:
+            yield row["response"], {"code": row.get("code"), "file": row.get("prompt", "").replace(
+                "Synthetic prompt for ", "")}
+
+
+# Lowercases and strips punctuation and repeated whitespace, so trivial variants compare equal
+def normalize_for_dedup(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+class NearDuplicateFilter:
+    # Remembers the chunks it has accepted and rejects exact or near-exact repeats.
+    # Near-duplicates are found with MinHash signatures over word 5-grams, bucketed with
+    # locality sensitive hashing (bands x rows = num_perm) so each check only compares a few candidates.
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle_size=5):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        generator = np.random.default_rng(0)
+        # Random hash functions h(x) = (a * x + b) mod p with p the Mersenne prime 2^61 - 1
+        self._prime = (1 << 61) - 1
+        self._a = generator.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self._b = generator.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+        self._seen = set()
+        self._buckets = {}
+        self._signatures = []
+
+    def _signature(self, words):
+        size = min(self.shingle_size, len(words))
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        hashes = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype=np.uint64)
+        # Keep the values small enough that a * x + b can't overflow 64 bits
+        return ((np.outer(hashes, self._a) + self._b) % self._prime).min(axis=0)
+
+    # Returns True if the text is new, False if it repeats a text seen before
+    def add(self, text):
+        normalized = normalize_for_dedup(text)
+        key = hashlib.sha256(normalized.encode('utf-8')).digest()
+        if key in self._seen:
+            self.exact_duplicates += 1
+            return False
+        words = normalized.split()
+        if not words:
+            return False
+
+        signature = self._signature(words)
+        band_keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                     for band in range(self.bands)]
+        candidates = {index for band_key in band_keys for index in self._buckets.get(band_key, ())}
+        for index in candidates:
+            if np.mean(self._signatures[index] == signature) >= self.threshold:
+                self.near_duplicates += 1
+                return False
+
+        self._seen.add(key)
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(index)
+        return True
+
+
+# Yields (chunk number, text, payload) for every unique chunk of the given site dumps,
+# ready to be passed to DatasetToQdrant.upload_lines()
+def iter_chunks(paths, max_tokens=256, overlap_tokens=32, dedup=None):
+    tokenizer = get_tokenizer()
+    dedup = dedup if dedup is not None else NearDuplicateFilter()
+    number = 0
+    for path in paths:
+        for page_text, metadata in iter_pages(path):
+            for index, chunk in enumerate(chunk_text(page_text, max_tokens, overlap_tokens, tokenizer)):
+                if dedup.add(chunk):
+                    yield number, chunk, dict(metadata, text=chunk, chunk=index)
+                    number += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk the site dumps and report how much deduplication removes.")
+    parser.add_argument("--source", nargs="+", required=True, help="uwp_data.json and/or cs_data.json files")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--overlap-tokens", type=int, default=32)
+    parser.add_argument("--out", default=None, help="Write the chunks to this JSONL file")
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer()
+    dedup = NearDuplicateFilter()
+    chunks = list(iter_chunks(args.source, args.max_tokens, args.overlap_tokens, dedup))
+    tokens = [tokenizer.count(text) for _, text, _ in chunks]
+    print(f"{len(chunks)} chunks kept, {dedup.exact_duplicates} exact and {dedup.near_duplicates} "
+          f"near-exact duplicates dropped (tokenizer: {tokenizer.name})")
+    if tokens:
+        print(f"{sum(tokens)} tokens in total, {np.mean(tokens):.0f} per chunk on average, {max(tokens)} at most")
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            for _, _, payload in chunks:
+                file.write(json.dumps(payload) + "\n")
@@ -0,0 +1,161 @@
+"""
+Packs the most relevant sentences of the retrieved hits into a fixed token budget for the chat prompt.
+
+The frontend used to paste the whole text of the first hit into the prompt, so the WebLLM model
+paid prefill time for every token of it, navigation menus included, and never saw the other
+hits. ContextBuilder works on the server instead:
+1. splits the text of every hit into sentences and drops boilerplate: navigation menus (runs of
+   capitalized words), directory listings, fragments shorter than min_sentence_tokens and
+   sentences already taken from an earlier hit
+2. scores each sentence by the BM25 weight of the query's words in it plus a bonus for coming
+   from a higher-ranked hit, all sentences in one vectorized pass
+3. adds sentences in score order while they fit in max_tokens, counted with the same tokenizer
+   as Chunking.py (tiktoken cl100k_base when available), then restores their original order
+
+The result holds the assembled text, its exact token count and the IDs of the hits it used, so
+the size of the prompt, and with it the time to first token, no longer depends on the hits.
+
+Usage:
+    python ContextBuilder.py "When is the tuition deadline?" --local-index qa_index --max-tokens 300
+"""
+
+import argparse
+import re
+
+import numpy as np
+
+from BM25Index import tokenize
+from Chunking import get_tokenizer, split_sentences
+
+# Apache/nginx directory listings scraped from the CS site
+LISTING_PATTERN = re.compile(r"Index of /|Parent Directory|\d{4}-\d{2}-\d{2} \d{2}:\d{2}")
+# Separator placed between sentences from different hits
+SOURCE_SEPARATOR = "\n"
+# Scraped pages often have no punctuation for hundreds of words; such runs are cut into pieces of this size
+MAX_SENTENCE_TOKENS = 64
+
+
+# True for sentences that are most likely page chrome rather than content
+def is_boilerplate(sentence):
+    if LISTING_PATTERN.search(sentence):
+        return True
+    words = re.findall(r"[A-Za-z][\w'-]*", sentence)
+    if len(words) < 8:
+        return False
+    # Navigation menus are long runs of Capitalized Words with few lowercase words in between
+    capitalized = sum(1 for word in words if word[0].isupper())
+    return capitalized / len(words) > 0.6
+
+
+class ContextBuilder:
+    def __init__(self, max_tokens=400, tokenizer=None, min_sentence_tokens=4, rank_weight=0.5):
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.min_sentence_tokens = min_sentence_tokens
+        # How much a sentence from the first hit is preferred over one from a lower-ranked hit
+        self.rank_weight = rank_weight
+
+    # Returns (hit rank, position in the hit, sentence, tokens) for every usable sentence of the hits
+    def _sentences(self, hits):
+        seen = set()
+        sentences = []
+        for rank, hit in enumerate(hits):
+            text = (hit.get("payload") or {}).get("text") or ""
+            pieces = split_sentences(text, self.tokenizer, min(self.max_tokens, MAX_SENTENCE_TOKENS))
+            for position, sentence in enumerate(pieces):
+                key = " ".join(tokenize(sentence))
+                if not key or key in seen or is_boilerplate(sentence):
+                    continue
+                seen.add(key)
+                tokens = self.tokenizer.count(sentence)
+                if tokens >= self.min_sentence_tokens:
+                    sentences.append((rank, position, sentence, tokens))
+        return sentences
+
+    # Scores every sentence against the query: BM25 of the query words (IDF over these sentences) plus a rank bonus
+    def _scores(self, query, sentences):
+        terms = list(dict.fromkeys(tokenize(query)))
+        columns = {term: column for column, term in enumerate(terms)}
+        counts = np.zeros((len(sentences), len(terms)), dtype=np.float32)
+        lengths = np.zeros(len(sentences), dtype=np.float32)
+        for row, (_, _, sentence, _) in enumerate(sentences):
+            words = tokenize(sentence)
+            lengths[row] = len(words)
+            for word in words:
+                column = columns.get(word)
+                if column is not None:
+                    counts[row, column] += 1
+        frequencies = (counts > 0).sum(axis=0)
+        idf = np.log(1 + (len(sentences) - frequencies + 0.5) / (frequencies + 0.5))
+        norm = 1.2 * (0.25 + 0.75 * lengths / max(lengths.mean(), 1.0))
+        lexical = (idf * counts * 2.2 / (counts + norm[:, None])).sum(axis=1)
+        ranks = np.array([rank for rank, _, _, _ in sentences], dtype=np.float32)
+        return lexical + self.rank_weight / (1 + ranks)
+
+    # Joins chosen sentences in reading order, one line per source hit
+    @staticmethod
+    def _join(chosen):
+        lines = {}
+        for rank, _, sentence, _ in sorted(chosen):
+            lines.setdefault(rank, []).append(sentence)
+        return SOURCE_SEPARATOR.join(" ".join(sentences) for sentences in lines.values())
+
+    # Returns {"text", "tokens", "sources"} with the best sentences of the hits that fit in max_tokens
+    def build(self, query, hits, max_tokens=None):
+        budget = max_tokens or self.max_tokens
+        sentences = self._sentences(hits)
+        if not sentences:
+            return {"text": "", "tokens": 0, "sources": []}
+
+        chosen = []
+        used = 0
+        for index in np.argsort(-self._scores(query, sentences), kind="stable"):
+            rank, position, sentence, tokens = sentences[index]
+            # One token for the space or newline in front of the sentence
+            if used + tokens + 1 > budget:
+                continue
+            chosen.append(sentences[index])
+            used += tokens + 1
+
+        if not chosen:
+            # Not even the best sentence fits, so cut it down to the budget
+            rank, position, sentence, _ = sentences[int(np.argmax(self._scores(query, sentences)))]
+            sentence = self.tokenizer.truncate(sentence, budget)
+            chosen = [(rank, position, sentence, self.tokenizer.count(sentence))]
+
+        text = self._join(chosen)
+        tokens = self.tokenizer.count(text)
+        # Joining can merge tokens differently than counting sentences alone; drop the weakest until it fits
+        while tokens > budget and len(chosen) > 1:
+            chosen.pop()
+            text = self._join(chosen)
+            tokens = self.tokenizer.count(text)
+        sources = list(dict.fromkeys(hits[rank]["id"] for rank, _, _, _ in sorted(chosen)))
+        return {"text": text, "tokens": tokens, "sources": sources}
+
+
+if __name__ == "__main__":
+    from EmbeddingBackends import get_backend
+    from LocalIndex import LocalIndex
+
+    parser = argparse.ArgumentParser(description="Show the context the builder packs for a query.")
+    parser.add_argument("query")
+    parser.add_argument("--local-index", default="qa_index")
+    parser.add_argument("--limit", type=int, default=3, help="Number of hits to pack")
+    parser.add_argument("--max-tokens", type=int, default=400)
+    parser.add_argument("--backend", default="hashing", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
+    backend = get_backend(args.backend, openai_client, dim=args.hashing_dim)
+    hits = LocalIndex(args.local_index, backend.name).search(backend.embed([args.query])[0], args.limit)
+    builder = ContextBuilder(args.max_tokens)
+    raw_tokens = sum(builder.tokenizer.count((hit["payload"] or {}).get("text", "")) for hit in hits)
+    context = builder.build(args.query, hits)
+    print(f"{raw_tokens} tokens in the hits, {context['tokens']} in the context "
+          f"(tokenizer: {builder.tokenizer.name}), from {context['sources']}")
+    print(context["text"])
@@ -1,21 +1,254 @@
+"""
+Creates, inspects and deletes collections in the Qdrant cluster, and benchmarks collection settings.
+
+create_collection() provisions a collection with the options that matter for memory and speed:
+- quantization:       "scalar" (int8, 4x smaller) or "binary" (1 bit per dimension, 32x smaller),
+                      the quantized vectors are kept in RAM and the originals are used for rescoring
+- datatype:           store the original vectors as "float32" or "float16" (half the memory).
+                      Qdrant's "uint8" datatype is left out on purpose: it stores the values as given
+                      and compares the raw codes, so ingestion and queries would both need a shared
+                      fixed scale that the cosine-normalized embeddings do not have. Scalar
+                      quantization gives the same 1 byte per value in RAM and rescores with the
+                      originals; the uint8 storage of LocalIndex.py keeps its own scale and offset.
+- on_disk:            keep the original vectors on disk instead of in RAM
+- hnsw_m / hnsw_ef_construct: the HNSW graph degree and build-time beam width
+- payload indexes:    keyword indexes on the category fields and "ID" so filtered searches stay fast
+
+The benchmark command builds one collection per configuration from the Run 2 QA answers and
+reports estimated RAM footprint, build time and recall@k against exact (brute-force) search.
+Qdrant's local/in-memory mode always searches exactly and ignores HNSW and quantization, so in
+that mode the configurations that only change HNSW settings are skipped, and quantized recall is
+simulated by applying the same quantization to the vectors with numpy. The output says so in its
+column names: estimated_memory_bytes always (a formula, not a measurement), and in local mode
+simulated_recall@k and upload_seconds (no index is built). Pass --url to benchmark a real Qdrant
+server, where the server's own HNSW and quantization are measured (recall@k, build_seconds).
+
+Usage:
+    python CreateCollection.py info
+    python CreateCollection.py create --dim 1536 --quantization scalar --hnsw-m 16 --hnsw-ef-construct 128
+    python CreateCollection.py create --dim 512 --datatype float16 --quantization scalar --on-disk
+    python CreateCollection.py delete
+    python CreateCollection.py list
+    python CreateCollection.py benchmark --k 10
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
 # Import necessary classes from the qdrant_client package
 from qdrant_client import QdrantClient, models
 
-# Initialize the QdrantClient object with the URL and API key for the Qdrant cluster
-client = QdrantClient(
-    url="QDRANT_CLUSTER_URL",  # Replace "QDRANT_CLUSTER_URL" with the actual URL of your Qdrant cluster
-    api_key="QDRANT_API_KEY",  # Replace "QDRANT_API_KEY" with the actual API key for authentication
-)
+from EmbeddingBackends import DATASETS_DIR, get_backend, normalize_rows, scalar_quantize
+
+# Replace these with the actual URL and API key of your Qdrant cluster
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Name of the collection shared by all scripts in this folder
+collection_name = "ChatbotDataset"
+# Payload fields that get a keyword index
+INDEXED_FIELDS = ("category", "paragraph_category", "question_category", "ID", "source")
+
+# Configurations compared by the benchmark command; those setting hnsw_m or hnsw_ef_construct
+# only differ from the default in ways that a real server can measure
+BENCHMARK_CONFIGS = [
+    {"name": "float32"},
+    {"name": "float32 m=32 ef=200", "hnsw_m": 32, "hnsw_ef_construct": 200},
+    {"name": "float32 m=8 ef=64", "hnsw_m": 8, "hnsw_ef_construct": 64},
+    {"name": "scalar int8", "quantization": "scalar"},
+    {"name": "scalar int8 on-disk", "quantization": "scalar", "on_disk": True},
+    {"name": "float16", "datatype": "float16"},
+    {"name": "float16 scalar int8 on-disk", "datatype": "float16", "quantization": "scalar", "on_disk": True},
+    {"name": "binary", "quantization": "binary"},
+    {"name": "binary on-disk", "quantization": "binary", "on_disk": True},
+]
+
+
+# Builds the quantization config for create_collection, or None for plain float32 vectors
+def quantization_config(quantization):
+    if quantization is None:
+        return None
+    if quantization == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+    if quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+# Creates a collection with the given vector size, quantization, storage and HNSW settings,
+# then adds keyword payload indexes on INDEXED_FIELDS. An existing collection is replaced when recreate is set.
+def create_collection(client, name=collection_name, dim=1536, quantization=None, on_disk=False,
+                      hnsw_m=16, hnsw_ef_construct=100, indexed_fields=INDEXED_FIELDS, recreate=False,
+                      datatype="float32"):
+    if recreate and client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=on_disk,
+                                           datatype=models.Datatype(datatype)),
+        hnsw_config=models.HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct),
+        quantization_config=quantization_config(quantization),
+    )
+    for field in indexed_fields:
+        client.create_payload_index(name, field, field_schema=models.PayloadSchemaType.KEYWORD)
+
+
+# Estimates the RAM used by a collection's vectors and HNSW graph, following Qdrant's capacity
+# planning guide (vectors * dim * 4 bytes * 1.5 overhead). Quantized vectors stay in RAM, and
+# the originals (4 bytes per value, 2 for float16, 1 for uint8 collections created elsewhere)
+# only count when they are not on disk.
+def estimate_memory_bytes(count, dim, quantization=None, on_disk=False, hnsw_m=16, datatype="float32"):
+    original = 0 if on_disk else count * dim * {"float16": 2, "uint8": 1}.get(datatype, 4)
+    if quantization == "scalar":
+        quantized = count * dim
+    elif quantization == "binary":
+        quantized = count * dim // 8
+    else:
+        quantized = 0
+    # Layer 0 of the graph stores up to 2 * m links of 4 bytes for every point
+    graph = count * hnsw_m * 2 * 4
+    return int((original + quantized + graph) * 1.5)
+
+
+# Returns the indexes of the k highest scores in every row, best first
+def top_k(scores, k):
+    candidates = np.argpartition(-scores, min(k, scores.shape[1] - 1), axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+# Approximates the scores Qdrant computes on quantized vectors
+def quantized_scores(vectors, queries, quantization):
+    if quantization == "scalar":
+        # int8 scalar quantization: clip to the 0.99 quantile range and map it onto 256 levels
+        codes, scale, offset = scalar_quantize(vectors)
+        return queries @ (codes * scale + offset).T
+    if quantization == "binary":
+        # Binary quantization keeps only the sign of each dimension
+        return np.sign(queries) @ np.sign(vectors).T
+    return queries @ vectors.T
+
+
+# Simulates a quantized search with rescoring: take k * oversampling candidates by quantized
+# score, then re-rank them with the original vectors, which is what Qdrant does by default
+def simulated_search(vectors, queries, quantization, k, oversampling=2.0):
+    if quantization is None:
+        return top_k(queries @ vectors.T, k)
+    candidates = top_k(quantized_scores(vectors, queries, quantization), int(k * oversampling))
+    exact = np.einsum('qd,qcd->qc', queries, vectors[candidates])
+    order = np.argsort(-exact, axis=1)[:, :k]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+# Fraction of the exact top-k that the approximate top-k found, averaged over queries
+def recall_at_k(approximate, exact):
+    k = exact.shape[1]
+    return float(np.mean([len(set(a[:k]) & set(e)) / k for a, e in zip(approximate, exact)]))
+
+
+# Builds each configuration from the given vectors and measures it against exact search.
+# In local mode the HNSW configurations are left out, since local Qdrant has no HNSW index.
+def benchmark(client, vectors, queries, configs=BENCHMARK_CONFIGS, k=10, local=True, batch_size=256):
+    vectors = normalize_rows(vectors.astype(np.float32))
+    queries = normalize_rows(queries.astype(np.float32))
+    exact = top_k(queries @ vectors.T, k)
+    count, dim = vectors.shape
+    results = []
+
+    for config in configs:
+        options = {key: value for key, value in config.items() if key != "name"}
+        if local and ("hnsw_m" in options or "hnsw_ef_construct" in options):
+            print(f"Skipping {config['name']}: HNSW settings can only be measured with --url")
+            continue
+        name = "Benchmark_" + config["name"].replace(" ", "_").replace("=", "")
+
+        start_time = time.perf_counter()
+        # Payload indexes do nothing in local mode, so only build them on a real server
+        create_collection(client, name, dim, indexed_fields=() if local else INDEXED_FIELDS, recreate=True, **options)
+        for start in range(0, count, batch_size):
+            client.upload_collection(name, vectors[start:start + batch_size],
+                                     ids=list(range(start, min(start + batch_size, count))))
+        # Wait until the server has finished building the index
+        while client.get_collection(name).status != models.CollectionStatus.GREEN:
+            time.sleep(0.1)
+        build_seconds = time.perf_counter() - start_time
+
+        if local:
+            # Rescoring uses the stored originals, which lose precision when kept as float16
+            originals = vectors.astype(options.get("datatype", "float32")).astype(np.float32)
+            approximate = simulated_search(originals, queries, options.get("quantization"), k)
+        else:
+            approximate = np.array([
+                [hit.id for hit in client.query_points(name, query=query.tolist(), limit=k).points]
+                for query in queries
+            ])
+        # The column names say which numbers were measured and which were estimated or simulated
+        results.append({
+            "config": config["name"],
+            "estimated_memory_bytes": estimate_memory_bytes(count, dim, options.get("quantization"),
+                                                            options.get("on_disk", False), options.get("hnsw_m", 16),
+                                                            options.get("datatype", "float32")),
+            "upload_seconds" if local else "build_seconds": round(build_seconds, 3),
+            f"simulated_recall@{k}" if local else f"recall@{k}": round(recall_at_k(approximate, exact), 4),
+        })
+        client.delete_collection(name)
+    return results
+
 
-# The following line, when uncommented, deletes a collection named 'ChatbotDataset' from the Qdrant database
-# client.delete_collection(collection_name="ChatbotDataset")
+# Embeds the Run 2 answers (the corpus) and questions (the queries) with a backend
+def load_benchmark_data(backend):
+    with open(os.path.join(DATASETS_DIR, "Run_2_Files", "run2_fix.json"), 'r', encoding='utf-8') as file:
+        rows = json.load(file)
+    vectors = backend.embed([row["answer"] for row in rows])
+    queries = backend.embed([row["question"] for row in rows])
+    return vectors, queries
 
-# The next line, when uncommented, creates a new collection named 'ChatbotDataset'
-# with a vector configuration specifying the vector size and the distance metric (COSINE in this case)
-# client.create_collection(collection_name="ChatbotDataset", vectors_config=models.VectorParams(size=1536, distance=models.Distance.COSINE))
 
-# Retrieves and prints the configuration and status of the collection named 'ChatbotDataset'
-print(client.get_collection(collection_name="ChatbotDataset"))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage and benchmark Qdrant collections.")
+    parser.add_argument("command", choices=["info", "list", "create", "delete", "benchmark"])
+    parser.add_argument("--collection", default=collection_name)
+    parser.add_argument("--url", default=None, help="Qdrant URL, defaults to the cluster (or in-memory for benchmark)")
+    parser.add_argument("--api-key", default=QDRANT_API_KEY)
+    parser.add_argument("--dim", type=int, default=1536, help="Vector size, must match the embedding backend")
+    parser.add_argument("--quantization", choices=["scalar", "binary"], default=None)
+    parser.add_argument("--datatype", choices=["float32", "float16"], default="float32",
+                        help="Storage type of the original vectors")
+    parser.add_argument("--on-disk", action="store_true", help="Keep the original vectors on disk")
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--hnsw-ef-construct", type=int, default=100)
+    parser.add_argument("--recreate", action="store_true", help="Delete the collection first if it exists")
+    parser.add_argument("--k", type=int, default=10, help="k used for recall@k by the benchmark")
+    parser.add_argument("--backend", default="hashing", help="Embedding backend used to build the benchmark data")
+    args = parser.parse_args()
 
-# The last commented line, when uncommented, prints all collections available in the Qdrant cluster
-# print(client.get_collections())
+    if args.command == "benchmark":
+        # Benchmarks run in memory unless a server URL is given
+        local = args.url is None
+        client = QdrantClient(":memory:") if local else QdrantClient(url=args.url, api_key=args.api_key)
+        vectors, queries = load_benchmark_data(get_backend(args.backend))
+        print(f"Benchmarking {vectors.shape[0]} vectors of size {vectors.shape[1]}, {queries.shape[0]} queries")
+        if local:
+            print("In-memory Qdrant searches exactly: recall is simulated with numpy and HNSW settings are skipped, "
+                  "pass --url to measure a server")
+        for result in benchmark(client, vectors, queries, k=args.k, local=local):
+            print(json.dumps(result))
+    else:
+        # Initialize the QdrantClient object with the URL and API key for the Qdrant cluster
+        client = QdrantClient(url=args.url or QDRANT_CLUSTER_URL, api_key=args.api_key)
+        if args.command == "info":
+            # Retrieves and prints the configuration and status of the collection
+            print(client.get_collection(collection_name=args.collection))
+        elif args.command == "list":
+            # Prints all collections available in the Qdrant cluster
+            print(client.get_collections())
+        elif args.command == "create":
+            create_collection(client, args.collection, args.dim, args.quantization, args.on_disk,
+                              args.hnsw_m, args.hnsw_ef_construct, recreate=args.recreate, datatype=args.datatype)
+            print(client.get_collection(collection_name=args.collection))
+        elif args.command == "delete":
+            # Deletes the collection from the Qdrant database
+            client.delete_collection(collection_name=args.collection)
@@ -1,52 +1,438 @@
+"""
+Uploads the lines of Dataset.txt into the ChatbotDataset Qdrant collection.
+
+The dataset is read exactly once through a generator, so memory stays flat no matter how
+large the corpus is. Lines are grouped into batches and each batch is embedded with a single
+call to the embedding backend (see EmbeddingBackends.py; the OpenAI embeddings endpoint
+accepts a list of inputs), then upserted into Qdrant.
+If a batch is rejected (usually because one line is longer than the model supports) the
+batch is retried one line at a time so only the offending line is skipped.
+
+Ingestion is bound by network latency, so embedding and upserting run as a pipeline:
+up to --concurrency embedding requests are in flight at once, and every finished batch is
+handed to a separate pool of upsert workers that write with wait=False. The number of
+outstanding batches is bounded on both sides so memory stays flat. The local/in-memory
+Qdrant client is not thread-safe, so use --upsert-workers 1 when ingesting into it.
+
+Embeddings are cached on disk by EmbeddingCache.py (keyed by model and text), so a re-run
+only pays for lines that are new or changed since the last run, and duplicate lines such as
+repeated navigation boilerplate are embedded once.
+
+Every embedding call, upsert and delete is timed by Metrics.py, along with counters of API calls,
+tokens, retries and cache hits; the p50/p95/p99 of each stage and the counters are printed at the
+end of the run, and written as JSON with --metrics-out.
+
+With --sync the point ID of every line is derived from a hash of its text and stored payload
+instead of its position, so inserting or removing a line leaves every other ID untouched. The
+script then diffs the dataset against the IDs already in the collection, uploads only the lines
+whose text or payload is new or changed, and deletes the points that no longer match a line.
+
+With --bm25-index the same pass also builds a BM25 inverted index of every line (see
+BM25Index.py) with the same point IDs, for hybrid search in RetrievalService.py.
+
+With --qa the rows of QA datasets (run2_fix.json, ...) are ingested one point per row, with
+their question, ID and category fields in the payload (see Categories.py) so searches can be
+filtered by category.
+
+With --shard-by source|category the points are split over one collection per dataset file or per
+question category, named <collection>_<shard> and created when first needed (see Shards.py).
+Syncing one dataset then only touches its own shard.
+
+Texts of at least --compress-over bytes (2048 by default, whole site pages) are stored
+zlib-compressed in a "text_z" payload field instead of "text" (see Payloads.py), which brings
+the payloads of the site dumps down to about 60% of their size (62% for cs_data.json). The
+query scripts restore the text.
+
+With --source the site dumps (uwp_data.json, cs_data.json) are ingested instead of
+Dataset.txt: every page is cut into token-bounded, overlapping chunks by Chunking.py and
+duplicate chunks are dropped, so each point carries a dense passage plus its code/file.
+
+Usage:
+    python DatasetToQdrant.py --dataset Dataset.txt --batch-size 100 --concurrency 8 --upsert-workers 4
+    python DatasetToQdrant.py --dataset Dataset.txt --sync
+    python DatasetToQdrant.py --dataset Dataset.txt --backend hashing --collection ChatbotDatasetLocal
+    python DatasetToQdrant.py --qa ../Datasets/Run_2_Files/run2_fix.json --collection ChatbotQA
+    python DatasetToQdrant.py --source ../Datasets/UWP_Website_Files/uwp_data.json ../Datasets/CS_Website_Files/cs_data.json --sync
+    python DatasetToQdrant.py --source ../Datasets/CS_Website_Files/cs_data.json --shard-by source --sync
+"""
+
+import argparse
+import hashlib
+import json
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 # Import the OpenAI library for accessing OpenAI's API services
 import openai
 # Import the QdrantClient and PointStruct from the qdrant_client package for interacting with the Qdrant API
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct
+from qdrant_client.models import PointIdsList, PointStruct
+
+from BM25Index import BM25Builder
+from Chunking import NearDuplicateFilter, iter_chunks
+from LocalIndex import iter_documents as iter_qa_documents
+from EmbeddingBackends import get_backend
+from EmbeddingCache import EmbeddingCache
+from Metrics import metrics
+from Payloads import compress_payload
+from Shards import SHARD_KEYS, ShardRouter, source_name, tag_source
 
-# Initialize the OpenAI client with your API key
-openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
-# Initialize the Qdrant client with the cluster URL and API key
-qdrant_client = QdrantClient(url="QDRANT_CLUSTER_URL", api_key="QDRANT_API_KEY")
-# Define the embedding model to be used for generating text embeddings
+# API keys and cluster URL, replace these with your own values
+OPENAI_API_KEY = "OPEN_AI_API_KEY"
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Define the embedding model to be used for generating text embeddings with the OpenAI backend
 embedding_model = "text-embedding-3-small"
 # Specify the name of the collection in Qdrant where the data will be stored
 collection_name = "ChatbotDataset"
 
-# Calculate the total number of lines in the dataset file
-total_lines = sum(1 for line in open('Dataset.txt'))
-# Define the size of each chunk to process (number of lines at a time)
-chunk_size = 100
-# Initialize the starting index
-start = 0
-
-# Loop through the dataset file in chunks
-while start < total_lines:
-    with open('Dataset.txt', 'r') as file:
-        lines = file.readlines()[start:start+chunk_size]  # Read a chunk of lines from the file
-    
-    # Strip whitespace from each line and create a list of texts
-    texts = [line.strip() for line in lines]
-    points = []  # Initialize a list to store points to be inserted into Qdrant
-
-    # Process each text to create points for Qdrant
-    for idx, text in enumerate(texts):
+
+# Yields (line_number, text, payload) for every non-blank line of the dataset, reading the file only once
+def iter_lines(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file):
+            text = line.strip()
+            if text:
+                yield line_number, text, {"text": text}
+
+
+# Reads a Dataset.txt path with iter_lines(), and passes any other iterable of items through
+def iter_documents(documents):
+    return iter_lines(documents) if isinstance(documents, str) else iter(documents)
+
+
+# Numbers the items of several (key, text, payload) iterables one after the other, so their point IDs don't clash
+def number_items(*iterables):
+    number = 0
+    for iterable in iterables:
+        for _, text, payload in iterable:
+            yield number, text, payload
+            number += 1
+
+
+# Groups any iterable into lists of at most batch_size items
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Embeds a batch of (line_number, text, payload) items with one backend call.
+# Returns a list of (line_number, text, payload, vector) for every line that was embedded successfully.
+def embed_batch(backend, batch):
+    texts = [text for _, text, _ in batch]
+    try:
+        with metrics.span("embed"):
+            vectors = backend.embed(texts)
+        return [(line_number, text, payload, vector.tolist())
+                for (line_number, text, payload), vector in zip(batch, vectors)]
+    except Exception as e:
+        print(f"Batch starting at line {batch[0][0]} failed ({e}), retrying line by line")
+        metrics.inc("errors_total", stage="embed")
+
+    # Fall back to one line per call so a single bad line doesn't lose the whole batch
+    embedded = []
+    for line_number, text, payload in batch:
+        metrics.inc("retries_total", stage="embed")
         try:
-            # Generate an embedding for the text using OpenAI's model
-            result = openai_client.embeddings.create(input=text, model=embedding_model)
-            # Create a point with the embedding, a unique ID, and the original text as payload
-            point = PointStruct(
-                id=idx+start,
-                vector=result.data[0].embedding,
-                payload={"text": text},
-            )
-            points.append(point)  # Add the point to the list
+            with metrics.span("embed"):
+                vector = backend.embed([text])[0]
+            embedded.append((line_number, text, payload, vector.tolist()))
         except Exception as e:
-            # Handle exceptions (e.g., API errors) and print an error message
-            print(f"Error on line {idx}: {e}")
-            continue
-
-    # Insert or update points in the specified Qdrant collection
-    qdrant_client.upsert(collection_name, points)
-    # Move the start index forward by the chunk size
-    start += chunk_size
+            print(f"Error on line {line_number}: {e}")
+            metrics.inc("errors_total", stage="embed")
+    return embedded
+
+
+# Same as embed_batch, but serves what it can from the embedding cache and only sends
+# texts that have never been embedded before. Duplicates are embedded once per run.
+def embed_batch_cached(backend, cache, batch):
+    keys = [cache.key(backend.name, text) for _, text, _ in batch]
+    found, claimed = cache.claim(keys)
+    metrics.inc("cache_hits_total", len(found), cache="embedding")
+
+    # Embed one copy of every text this call is responsible for
+    to_embed = []
+    for key, item in zip(keys, batch):
+        if key in claimed:
+            to_embed.append(item)
+            claimed.discard(key)
+    claimed_keys = [cache.key(backend.name, text) for _, text, _ in to_embed]
+    try:
+        embedded = embed_batch(backend, to_embed) if to_embed else []
+        new_keys = [cache.key(backend.name, text) for _, text, _, _ in embedded]
+        cache.put_many(new_keys, [vector for _, _, _, vector in embedded])
+    finally:
+        # Anything that failed to embed must not block other callers
+        cache.release(claimed_keys)
+
+    # Pick up texts that were in flight in another batch, then assemble the results in order
+    waiting = [key for key in keys if key not in found]
+    found.update(cache.wait_for(waiting))
+    return [
+        (line_number, text, payload, found[key].tolist())
+        for key, (line_number, text, payload) in zip(keys, batch)
+        if found[key] is not None
+    ]
+
+
+# Point ID used by a full upload: the line number, so re-running the script overwrites the same points
+def line_point_id(line_number, text, payload):
+    return line_number
+
+
+# Point ID used by sync mode: like data_id.generate_code this hashes with SHA-256, but it keeps 128 bits
+# of the digest (formatted as a UUID, which Qdrant accepts) so collisions are not a concern. The stored
+# payload is hashed along with the text, so a row whose category, ID, source or compression changed
+# gets a new point, and the same text from two sources stays two points.
+def content_point_id(line_number, text, payload):
+    canonical = json.dumps([text, payload], sort_keys=True, ensure_ascii=False)
+    return str(uuid.UUID(bytes=hashlib.sha256(canonical.encode('utf-8')).digest()[:16]))
+
+
+# Builds the Qdrant points for an embedded batch and upserts them without waiting for indexing.
+# With a Shards.ShardRouter the points are split over the shard collections it picks instead.
+# Texts of at least compress_over bytes are stored compressed (see Payloads.py), 0 stores every text as is.
+def upsert_batch(qdrant_client, collection, embedded, id_fn=line_point_id, router=None, compress_over=0):
+    shards = {}
+    for line_number, text, payload, vector in embedded:
+        target = router.collection(payload) if router is not None else collection
+        stored = compress_payload(payload, compress_over)
+        point = PointStruct(id=id_fn(line_number, text, stored), vector=vector, payload=stored)
+        shards.setdefault(target, []).append(point)
+    for target, points in shards.items():
+        with metrics.span("upsert"):
+            qdrant_client.upsert(target, points, wait=False)
+        metrics.inc("points_upserted_total", len(points))
+    return len(embedded)
+
+
+# Streams (line_number, text, payload) items into Qdrant and returns a dictionary of throughput statistics.
+# concurrency bounds the number of embedding requests in flight and upsert_workers the number
+# of upserts in flight, so at most concurrency + upsert_workers batches are held in memory.
+# When a cache is given, embeddings are read from and written to it.
+def upload_lines(backend, qdrant_client, lines, batch_size=100, concurrency=8, upsert_workers=4,
+                 collection=collection_name, cache=None, id_fn=line_point_id, router=None, compress_over=0):
+    lines_read = 0
+    embeddings_created = 0
+    points_upserted = 0
+    # The cache may have served earlier runs, so only the misses of this run count
+    misses_before = cache.misses if cache is not None else 0
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as embed_pool, \
+            ThreadPoolExecutor(max_workers=upsert_workers) as upsert_pool:
+        pending_embeds = set()
+        pending_upserts = set()
+
+        # Hands every finished embedding batch over to the upsert workers
+        def collect_embeds(return_when):
+            nonlocal pending_embeds, embeddings_created
+            done, pending_embeds = wait(pending_embeds, return_when=return_when)
+            for future in done:
+                embedded = future.result()
+                embeddings_created += len(embedded)
+                if embedded:
+                    pending_upserts.add(upsert_pool.submit(upsert_batch, qdrant_client, collection, embedded,
+                                                           id_fn, router, compress_over))
+
+        # Waits for upserts to finish, re-raising any error from the Qdrant client
+        def collect_upserts(return_when):
+            nonlocal pending_upserts, points_upserted
+            done, pending_upserts = wait(pending_upserts, return_when=return_when)
+            for future in done:
+                points_upserted += future.result()
+
+        for batch in iter_batches(lines, batch_size):
+            lines_read += len(batch)
+            if cache is not None:
+                pending_embeds.add(embed_pool.submit(embed_batch_cached, backend, cache, batch))
+            else:
+                pending_embeds.add(embed_pool.submit(embed_batch, backend, batch))
+
+            # Apply back-pressure so the reader never runs far ahead of the network
+            if len(pending_embeds) >= concurrency:
+                collect_embeds(FIRST_COMPLETED)
+            if len(pending_upserts) >= upsert_workers:
+                collect_upserts(FIRST_COMPLETED)
+
+        # Drain everything that is still in flight
+        while pending_embeds:
+            collect_embeds(FIRST_COMPLETED)
+        while pending_upserts:
+            collect_upserts(FIRST_COMPLETED)
+
+    elapsed = time.perf_counter() - start_time
+    misses = cache.misses - misses_before if cache is not None else 0
+    return {
+        "lines": lines_read,
+        "embeddings": embeddings_created,
+        "points": points_upserted,
+        # Lines that did not need their own API call, either a cache hit or a duplicate of another line
+        "cache_hits": lines_read - misses if cache is not None else 0,
+        "api_embeddings": misses if cache is not None else embeddings_created,
+        "seconds": elapsed,
+        "lines_per_sec": lines_read / elapsed if elapsed else 0.0,
+        "embeddings_per_sec": embeddings_created / elapsed if elapsed else 0.0,
+    }
+
+
+# Uploads every line of the dataset, using line numbers as point IDs.
+# documents is the path of a Dataset.txt, or any iterable of (number, text, payload) items such as Chunking.iter_chunks().
+# Every line is also added to bm25_builder (a BM25Index.BM25Builder) when one is given.
+# With a Shards.ShardRouter every point goes to its shard collection instead of collection.
+def ingest(backend, qdrant_client, documents, batch_size=100, concurrency=8, upsert_workers=4,
+           collection=collection_name, cache=None, bm25_builder=None, router=None, compress_over=0):
+    def lines():
+        for line_number, text, payload in iter_documents(documents):
+            if bm25_builder is not None:
+                bm25_builder.add(line_point_id(line_number, text, payload), text, payload)
+            yield line_number, text, payload
+
+    return upload_lines(backend, qdrant_client, lines(), batch_size, concurrency, upsert_workers, collection, cache,
+                        router=router, compress_over=compress_over)
+
+
+# Yields the ID of every point already stored in a collection, paging through it with scroll
+def iter_point_ids(qdrant_client, collection, page_size=1000):
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(collection, limit=page_size, offset=offset,
+                                              with_payload=False, with_vectors=False)
+        for point in points:
+            yield point.id
+        if offset is None:
+            break
+
+
+# Brings a collection in line with the dataset (a path or iterable, as for ingest) using content-derived point IDs.
+# Only lines whose ID is not in the collection yet are embedded and upserted, and points whose
+# ID no longer matches any line (changed, removed, or uploaded with line-number IDs) are deleted.
+# With a Shards.ShardRouter every shard the documents route to is synced, and shards they don't touch are left alone.
+def sync(backend, qdrant_client, documents, batch_size=100, concurrency=8, upsert_workers=4,
+         collection=collection_name, cache=None, bm25_builder=None, router=None, compress_over=0):
+    start_time = time.perf_counter()
+    # IDs already stored in, and IDs of the dataset routed to, every collection, read as collections are first seen
+    remote_ids = {}
+    local_ids = {}
+    if router is None:
+        remote_ids[collection] = set(iter_point_ids(qdrant_client, collection))
+        local_ids[collection] = set()
+
+    # Filters the dataset down to the lines that are missing from their collection
+    def missing_lines():
+        for line_number, text, payload in iter_documents(documents):
+            target = router.collection(payload) if router is not None else collection
+            if target not in remote_ids:
+                remote_ids[target] = set(iter_point_ids(qdrant_client, target))
+                local_ids[target] = set()
+            point_id = content_point_id(line_number, text, compress_payload(payload, compress_over))
+            if point_id in local_ids[target]:
+                continue  # Duplicate lines share one point
+            local_ids[target].add(point_id)
+            # The BM25 index is rebuilt from every line, not just the changed ones
+            if bm25_builder is not None:
+                bm25_builder.add(point_id, text, payload)
+            if point_id not in remote_ids[target]:
+                yield line_number, text, payload
+
+    stats = upload_lines(backend, qdrant_client, missing_lines(), batch_size, concurrency,
+                         upsert_workers, collection, cache, content_point_id, router, compress_over)
+
+    # Delete stale points only after the new ones are in, so the collection is never emptier than needed
+    stale_count = 0
+    for target, ids in remote_ids.items():
+        stale_ids = list(ids - local_ids[target])
+        stale_count += len(stale_ids)
+        for chunk in iter_batches(stale_ids, 1000):
+            with metrics.span("delete"):
+                qdrant_client.delete(target, points_selector=PointIdsList(points=chunk))
+
+    stats["unchanged"] = sum(len(ids) for ids in local_ids.values()) - stats["lines"]
+    stats["deleted"] = stale_count
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+# Prints the statistics returned by ingest() and sync()
+def print_stats(stats):
+    print(f"Read {stats['lines']} lines, created {stats['embeddings']} embeddings and upserted "
+          f"{stats['points']} points in {stats['seconds']:.2f}s")
+    print(f"{stats['api_embeddings']} embeddings came from the backend, {stats['cache_hits']} lines were reused from the cache")
+    if "deleted" in stats:
+        print(f"Sync left {stats['unchanged']} points unchanged and deleted {stats['deleted']} stale points")
+    print(f"{stats['lines_per_sec']:.1f} lines/sec, {stats['embeddings_per_sec']:.1f} embeddings/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed Dataset.txt and upload it to Qdrant.")
+    parser.add_argument("--dataset", default="Dataset.txt", help="Path to the dataset, one document per line")
+    parser.add_argument("--batch-size", type=int, default=100, help="Number of lines per embedding request/upsert")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum embedding requests in flight")
+    parser.add_argument("--upsert-workers", type=int, default=4, help="Maximum upserts in flight")
+    parser.add_argument("--qa", nargs="+", default=None,
+                        help="Ingest the rows of these QA datasets, with their categories, instead of reading --dataset")
+    parser.add_argument("--source", nargs="+", default=None,
+                        help="Chunk these uwp_data.json/cs_data.json site dumps instead of reading --dataset")
+    parser.add_argument("--max-tokens", type=int, default=256, help="Maximum tokens per chunk with --source")
+    parser.add_argument("--overlap-tokens", type=int, default=32, help="Tokens repeated between chunks with --source")
+    parser.add_argument("--collection", default=collection_name, help="Qdrant collection to upload into")
+    parser.add_argument("--bm25-index", default=None, help="Also build a BM25 inverted index into this directory")
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"],
+                        help="Embedding backend, queries must use the same one")
+    parser.add_argument("--model", default=None,
+                        help=f"Model for the openai/sentence-transformers backends (openai default: {embedding_model})")
+    parser.add_argument("--hashing-dim", type=int, default=512, help="Vector size of the hashing backend")
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf for the hashing backend")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the embeddings to this size, the collection must have the same size")
+    parser.add_argument("--cache-dir", default="embedding_cache", help="Directory of the on-disk embedding cache")
+    parser.add_argument("--no-cache", action="store_true", help="Embed every line even if it was embedded before")
+    parser.add_argument("--sync", action="store_true",
+                        help="Use content-hash IDs and only upload added/changed lines, deleting stale points")
+    parser.add_argument("--shard-by", default=None, choices=SHARD_KEYS,
+                        help="Split the points over one collection per source/category named <collection>_<shard>")
+    parser.add_argument("--compress-over", type=int, default=2048,
+                        help="Store texts of at least this many bytes compressed in the payload, 0 turns it off")
+    parser.add_argument("--metrics-out", default=None, help="Also write the JSON metrics summary of the run to this file")
+    args = parser.parse_args()
+
+    # Initialize the OpenAI client with your API key and pick the embedding backend
+    openai_client = openai.Client(api_key=OPENAI_API_KEY) if args.backend == "openai" else None
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+    # Initialize the Qdrant client with the cluster URL and API key
+    qdrant_client = QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY)
+
+    # Open the embedding cache unless it was turned off
+    cache = None if args.no_cache else EmbeddingCache(args.cache_dir)
+
+    bm25_builder = BM25Builder() if args.bm25_index else None
+
+    # Every point records the dataset it came from, which is also its shard with --shard-by source
+    documents = tag_source(iter_documents(args.dataset), source_name(args.dataset))
+    if args.qa or args.source:
+        # The chunks of every dump are tagged separately, but duplicates are dropped across all of them
+        dedup = NearDuplicateFilter()
+        documents = number_items(
+            *[tag_source(iter_qa_documents(path), source_name(path)) for path in args.qa or []],
+            *[tag_source(iter_chunks([path], args.max_tokens, args.overlap_tokens, dedup), source_name(path))
+              for path in args.source or []])
+    router = ShardRouter(qdrant_client, args.collection, args.shard_by, backend.dim) if args.shard_by else None
+
+    run = sync if args.sync else ingest
+    stats = run(backend, qdrant_client, documents, args.batch_size, args.concurrency,
+                args.upsert_workers, args.collection, cache, bm25_builder, router, args.compress_over)
+    if router is not None:
+        print(f"Wrote to the shards {', '.join(sorted(router.collections))}")
+    print_stats(stats)
+    if bm25_builder is not None:
+        bm25_builder.save(args.bm25_index)
+        print(f"Wrote BM25 index for {len(bm25_builder.ids)} lines to {args.bm25_index}")
+    if cache is not None:
+        cache.close()
+    metrics.report(args.metrics_out)
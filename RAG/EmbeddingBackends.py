@@ -0,0 +1,272 @@
+"""
+Embedding backends shared by the ingestion and query scripts in this folder.
+
+Every backend exposes the same small interface:
+- name:          identifies the model, used as part of the embedding cache key
+- dim:           the size of the vectors it produces (None until known)
+- embed(texts):  embeds a list of strings and returns a float32 array of shape (len(texts), dim)
+
+Available backends:
+- OpenAIBackend:              text-embedding-3-small over the network (what the project used originally);
+                              counts its API calls and billed tokens in Metrics.py
+- SentenceTransformerBackend: a small local model on the CPU, needs the sentence-transformers package
+- HashingBackend:             a dependency-free hashed bag of words/bigrams with optional IDF weights,
+                              fully offline and deterministic, useful as a fallback and for tests
+- TruncatedBackend:           wraps any backend and keeps only the first dimensions of its vectors,
+                              re-normalized; the OpenAI backend asks the API for shortened vectors instead
+
+scalar_quantize() turns a matrix into uint8 codes plus a scale and offset, the storage format of
+LocalIndex.py indexes built with dtype "uint8".
+
+Remember that a collection must be queried with the same backend that was used to fill it.
+
+Running this file compares the throughput of the backends on the questions in Datasets/Run_2_Files,
+or fits the IDF weights of the hashing backend on the datasets and saves them for --idf (the
+backend's name carries a digest of the weights, so cached embeddings never mix two IDF files):
+    python EmbeddingBackends.py --backends hashing sentence-transformers openai
+    python EmbeddingBackends.py --fit-idf idf.npy --corpus ../Datasets/Run_2_Files/run2_fix.json ../Datasets/UWP_Website_Files/uwp_data.json
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+import zlib
+from itertools import islice
+
+import numpy as np
+
+from Metrics import metrics
+
+# Folder holding the QA datasets, relative to this file
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Datasets")
+# Datasets the hashing IDF weights are fitted on by default: the QA rows and both site dumps
+IDF_CORPUS = (os.path.join(DATASETS_DIR, "Run_2_Files", "run2_fix.json"),
+              os.path.join(DATASETS_DIR, "UWP_Website_Files", "uwp_data.json"),
+              os.path.join(DATASETS_DIR, "CS_Website_Files", "cs_data.json"))
+# Words are runs of letters/digits, so course codes like "CSCI 241" survive as two tokens
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+# Scales every row of a matrix to unit length, leaving all-zero rows alone
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# Keeps the first dim columns of a matrix of embeddings and scales the rows back to unit length
+def truncate_rows(matrix, dim):
+    return normalize_rows(np.asarray(matrix, dtype=np.float32)[:, :dim]).astype(np.float32)
+
+
+# Maps a matrix onto 256 levels spread over its quantile range (the outermost values are clipped).
+# Returns (uint8 codes, scale, offset) with matrix ~= codes * scale + offset.
+def scalar_quantize(matrix, quantile=0.99):
+    tail = (1 - quantile) / 2
+    low, high = np.quantile(matrix, [tail, 1 - tail])
+    scale = float(high - low) / 255 or 1.0
+    codes = np.round((np.clip(matrix, low, high) - low) / scale).astype(np.uint8)
+    return codes, scale, float(low)
+
+
+class OpenAIBackend:
+    # Known output sizes of the OpenAI embedding models
+    DIMENSIONS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
+
+    def __init__(self, client, model="text-embedding-3-small", dimensions=None):
+        self.client = client
+        self.model = model
+        # text-embedding-3 models can return shortened vectors, which equal truncated and re-normalized
+        # full vectors, so they share the name (and cache keys) of TruncatedBackend
+        self.dimensions = dimensions if dimensions != self.DIMENSIONS.get(model) else None
+        self.name = model if self.dimensions is None else f"{model}-{self.dimensions}d"
+        self.dim = self.dimensions or self.DIMENSIONS.get(model)
+
+    def embed(self, texts):
+        options = {"dimensions": self.dimensions} if self.dimensions else {}
+        metrics.inc("api_calls_total", api="embeddings")
+        result = self.client.embeddings.create(input=list(texts), model=self.model, **options)
+        usage = getattr(result, "usage", None)
+        if usage is not None:
+            metrics.inc("tokens_total", usage.total_tokens, api="embeddings")
+        # The API returns the embeddings in the same order as the inputs
+        return np.array([item.embedding for item in result.data], dtype=np.float32)
+
+
+class SentenceTransformerBackend:
+    def __init__(self, model="sentence-transformers/all-MiniLM-L6-v2", batch_size=64):
+        # Imported here so the other backends work without sentence-transformers installed
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model, device="cpu")
+        self.name = model
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                    convert_to_numpy=True, show_progress_bar=False)
+        return vectors.astype(np.float32)
+
+
+class HashingBackend:
+    def __init__(self, dim=512, idf=None):
+        self.dim = dim
+        self.idf = idf
+        self.name = self._name()
+        # Memo of feature -> signed bucket, so each distinct word/bigram is hashed once
+        self._buckets = {}
+
+    # The name carries a digest of the IDF weights, so embeddings cached under one IDF file are
+    # never served for another
+    def _name(self):
+        if self.idf is None:
+            return f"hashing-{self.dim}"
+        return f"hashing-{self.dim}-idf-{zlib.crc32(np.asarray(self.idf, dtype=np.float32).tobytes()):08x}"
+
+    # Returns the words and word bigrams of a text
+    @staticmethod
+    def features(text):
+        words = TOKEN_PATTERN.findall(text.lower())
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    # Maps a feature to a bucket in [0, dim) and a sign, using a hash that is stable between runs
+    def _bucket(self, feature):
+        bucket = self._buckets.get(feature)
+        if bucket is None:
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            bucket = (hashed % self.dim, 1.0 if hashed & 0x80000000 else -1.0)
+            self._buckets[feature] = bucket
+        return bucket
+
+    # Builds the raw (unweighted, unnormalized) count matrix for a list of texts
+    def _counts(self, texts):
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                col, sign = self._bucket(feature)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), signs)
+        return matrix
+
+    def embed(self, texts):
+        matrix = self._counts(texts)
+        if self.idf is not None:
+            matrix *= self.idf
+        return normalize_rows(matrix).astype(np.float32)
+
+    # Learns per-bucket IDF weights from a corpus, turning the projection into a hashed TF-IDF.
+    # Texts are counted batch_size at a time, so the corpus can be an iterator of any length.
+    def fit_idf(self, texts, batch_size=1024):
+        document_frequency = np.zeros(self.dim, dtype=np.int64)
+        count = 0
+        texts = iter(texts)
+        batch = list(islice(texts, batch_size))
+        while batch:
+            document_frequency += (self._counts(batch) != 0).sum(axis=0)
+            count += len(batch)
+            batch = list(islice(texts, batch_size))
+        self.idf = (np.log((1 + count) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.name = self._name()
+        return self
+
+    # Saves/loads the IDF weights so queries are embedded exactly like the ingested corpus
+    def save(self, path):
+        np.save(path, self.idf if self.idf is not None else np.ones(self.dim, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path):
+        idf = np.load(path)
+        return cls(dim=idf.shape[0], idf=idf)
+
+
+class TruncatedBackend:
+    # Serves the first dim components of another backend's vectors, re-normalized. Models trained
+    # with Matryoshka representation learning (text-embedding-3, nomic, ...) keep most of their
+    # quality this way; for other models it is a lossy shortcut, measure it with RetrievalBenchmark.py.
+    def __init__(self, backend, dim):
+        if backend.dim is not None and dim > backend.dim:
+            raise ValueError(f"Cannot truncate {backend.name} vectors of size {backend.dim} to {dim}")
+        self.backend = backend
+        self.dim = dim
+        self.name = f"{backend.name}-{dim}d"
+
+    def embed(self, texts):
+        return truncate_rows(self.backend.embed(texts), self.dim)
+
+
+# Creates a backend by name. openai_client is only needed for the "openai" backend.
+# dimensions shortens the vectors: natively for text-embedding-3 models, by truncation otherwise.
+def get_backend(name, openai_client=None, model=None, dim=512, idf_path=None, dimensions=None):
+    if name == "openai":
+        model = model or "text-embedding-3-small"
+        if model.startswith("text-embedding-3"):
+            return OpenAIBackend(openai_client, model, dimensions)
+        backend = OpenAIBackend(openai_client, model)
+    elif name == "sentence-transformers":
+        backend = SentenceTransformerBackend(model or "sentence-transformers/all-MiniLM-L6-v2")
+    elif name == "hashing":
+        backend = HashingBackend.load(idf_path) if idf_path else HashingBackend(dim=dim)
+    else:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return TruncatedBackend(backend, dimensions) if dimensions and dimensions != backend.dim else backend
+
+
+# Loads every question from the Run 2 QA datasets
+def load_run2_questions():
+    questions = []
+    for file_name in ("run2_fix.json", "run2_validate_augment.json"):
+        with open(os.path.join(DATASETS_DIR, "Run_2_Files", file_name), 'r', encoding='utf-8') as file:
+            questions.extend(entry["question"] for entry in json.load(file))
+    return questions
+
+
+# Embeds texts in batches with a backend and returns (texts per second, seconds)
+def measure_throughput(backend, texts, batch_size=256):
+    start_time = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        backend.embed(texts[start:start + batch_size])
+    elapsed = time.perf_counter() - start_time
+    return len(texts) / elapsed, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare embedding backend throughput on the Run 2 questions, "
+                                                 "or fit the IDF weights of the hashing backend.")
+    parser.add_argument("--backends", nargs="+", default=["hashing", "sentence-transformers", "openai"])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--openai-api-key", default="OPEN_AI_API_KEY")
+    parser.add_argument("--fit-idf", default=None, metavar="OUT",
+                        help="Fit hashing IDF weights on --corpus and save them here (an .npy file for --idf)")
+    parser.add_argument("--corpus", nargs="+", default=list(IDF_CORPUS),
+                        help="Datasets the IDF weights are fitted on: QA datasets, site dumps or Dataset.txt files")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    args = parser.parse_args()
+
+    if args.fit_idf:
+        # LocalIndex imports this module, so its reader is imported here
+        from LocalIndex import iter_documents
+
+        texts = (text for path in args.corpus for _, text, _ in iter_documents(path))
+        backend = HashingBackend(args.hashing_dim).fit_idf(texts)
+        backend.save(args.fit_idf)
+        print(f"Saved the IDF weights of {backend.name} to {args.fit_idf}, pass it as --idf with --backend hashing")
+    else:
+        questions = load_run2_questions()
+        print(f"Embedding {len(questions)} questions from Datasets/Run_2_Files, batch size {args.batch_size}")
+        for backend_name in args.backends:
+            try:
+                client = None
+                if backend_name == "openai":
+                    import openai
+                    client = openai.Client(api_key=args.openai_api_key)
+                backend = get_backend(backend_name, client)
+                texts_per_sec, elapsed = measure_throughput(backend, questions, args.batch_size)
+                print(f"{backend.name:45s} {texts_per_sec:10.1f} texts/sec ({elapsed:.2f}s)")
+            except Exception as e:
+                # Missing packages or API keys only skip that backend
+                print(f"{backend_name:45s} skipped: {e}")
@@ -0,0 +1,160 @@
+"""
+On-disk, content-addressed cache of text embeddings used by DatasetToQdrant.py.
+
+Each embedding is keyed by the SHA-256 of (model name, text), so the cache survives
+re-scrapes: unchanged lines are found again no matter where they moved in the dataset,
+and only new or edited text has to be sent to the embedding API.
+
+Layout of the cache directory:
+- meta.json:   the vector dimension, fixed by the first vector written
+- keys.txt:    one hex key per line, line N describes row N of vectors.f32
+- vectors.f32: raw float32 rows, appended to and read back through a memory map
+
+Both data files are append-only, so a run that is interrupted loses at most the batch it
+was writing. Exact duplicate texts are embedded once: the first caller claims a key and
+any other caller asking for the same key waits for that result instead of re-embedding it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._keys_path = os.path.join(directory, "keys.txt")
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        # Guards the index and the pending set, and wakes up callers waiting on a claimed key
+        self._condition = threading.Condition()
+        self._pending = set()
+        self._index = {}
+        self._mmap = None
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as file:
+                stored_dim = json.load(file)["dim"]
+            if dim is not None and dim != stored_dim:
+                raise ValueError(f"Cache at {directory} holds {stored_dim}-dim vectors, not {dim}")
+            self.dim = stored_dim
+            self._load_index()
+
+        self._keys_file = open(self._keys_path, 'a', encoding='utf-8')
+        self._vectors_file = open(self._vectors_path, 'ab')
+
+    # Builds the cache key for a piece of text embedded with a given model
+    @staticmethod
+    def key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    # Reads keys.txt, ignoring keys whose vector row never made it to disk
+    def _load_index(self):
+        row_bytes = self.dim * 4
+        rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, 'r', encoding='utf-8') as file:
+                for row, line in enumerate(file):
+                    if row >= rows:
+                        break
+                    self._index[line.strip()] = row
+        # Drop any partial row or key left behind by an interrupted run so appends stay aligned
+        with open(self._vectors_path, 'ab') as file:
+            file.truncate(len(self._index) * row_bytes)
+        with open(self._keys_path, 'w', encoding='utf-8') as file:
+            file.writelines(key + "\n" for key, _ in sorted(self._index.items(), key=lambda item: item[1]))
+
+    # Returns the vector stored at a row, remapping the file when it has grown since the last read
+    def _row(self, row):
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            self._vectors_file.flush()
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode='r').reshape(-1, self.dim)
+        return self._mmap[row]
+
+    # Returns the cached vector for a key, or None
+    def get(self, key):
+        with self._condition:
+            row = self._index.get(key)
+            return None if row is None else np.array(self._row(row))
+
+    # Looks up a list of keys and claims the missing ones for the caller.
+    # Returns (found, claimed): found maps key -> vector for cache hits, claimed is the set of
+    # keys the caller must embed and then hand to put_many() or release(). Keys that are
+    # neither found nor claimed are being embedded by another caller, see wait_for().
+    def claim(self, keys):
+        found = {}
+        claimed = set()
+        with self._condition:
+            for key in keys:
+                if key in found or key in claimed:
+                    continue
+                row = self._index.get(key)
+                if row is not None:
+                    found[key] = np.array(self._row(row))
+                elif key not in self._pending:
+                    self._pending.add(key)
+                    claimed.add(key)
+            self.hits += len(found)
+            self.misses += len(claimed)
+        return found, claimed
+
+    # Appends new vectors to the cache and releases any claims on their keys
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        with self._condition:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_path, 'w') as file:
+                    json.dump({"dim": self.dim}, file)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dim vectors, got {vectors.shape[1]}")
+
+            new_rows = []
+            for key, vector in zip(keys, vectors):
+                if key not in self._index:
+                    self._index[key] = len(self._index)
+                    new_rows.append(key)
+                    self._vectors_file.write(vector.tobytes())
+            self._vectors_file.flush()
+            self._keys_file.writelines(key + "\n" for key in new_rows)
+            self._keys_file.flush()
+
+            self._pending.difference_update(keys)
+            self._condition.notify_all()
+
+    # Gives up claims on keys that could not be embedded so waiting callers stop waiting
+    def release(self, keys):
+        with self._condition:
+            self._pending.difference_update(keys)
+            self._condition.notify_all()
+
+    # Blocks until no key in keys is claimed, then returns key -> vector (None if it failed)
+    def wait_for(self, keys):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending.isdisjoint(keys))
+            vectors = {}
+            for key in keys:
+                row = self._index.get(key)
+                vectors[key] = None if row is None else np.array(self._row(row))
+            return vectors
+
+    def close(self):
+        self._keys_file.close()
+        self._vectors_file.close()
+        self._mmap = None
@@ -0,0 +1,300 @@
+"""
+Query log and a warm cache of the most asked questions, precomputed at deploy time.
+
+Student questions follow a long tail: a few hundred questions ("when does registration open",
+"how much is tuition") make up a large share of the traffic, and they are exactly what the first
+students after a deploy or a cold start ask while every cache of the service is still empty.
+
+1. Logging: with --query-log, RetrievalService.py and ChatGateway.py append every query that
+   reaches retrieval to a JSON lines file ({"t": unix time, "q": query, "c": categories}).
+   QueryLog keeps the lines in memory and appends them in one write every flush_every queries
+   or flush_seconds seconds, so a request only pays for formatting one line. Queries answered by
+   AnswerIndex.py never reach retrieval and are not logged, their answers are precomputed already.
+2. Clustering (offline): `cluster` counts the logged queries by their normalized words (see
+   AnswerIndex.normalize_question), embeds the --candidates most frequent ones and groups them
+   greedily: in order of frequency, each query joins the first cluster whose leading query is at
+   least --similarity similar, or starts a new cluster. The --top clusters with the most queries
+   are written to hot_queries.json, with the share of the traffic they cover.
+3. Precomputation (at deploy time, after ingestion): `warm` embeds every member of those clusters,
+   retrieves the hits of each cluster's leading query and packs their context, and writes a warm
+   cache directory:
+   - vectors.npy:   the embedding of every member, one row each
+   - entries.json:  the members (normalized question and cluster) and, per cluster, its hits and
+                    context, plus the backend, limit and context budget they were computed with
+   Give `warm` the same search options as the service, the stored hits are served as they are.
+
+With --warm-cache the service loads the directory at startup. A query whose normalized words are
+one of the members gets its cluster's hits without embedding or searching, and its context without
+packing when the budget matches. Its embedding is served from the cache as well, so the answer
+index does not embed it either. The cluster embeddings also seed the semantic cache, so close
+paraphrases of hot queries are served from the first request.
+
+Usage:
+    python RetrievalService.py --backend openai --query-log queries.jsonl
+    python HotQueries.py cluster --log queries.jsonl --backend openai --top 200 --out hot_queries.json
+    python HotQueries.py warm --hot hot_queries.json --backend openai --context-tokens 400 --out warm_cache
+    python RetrievalService.py --backend openai --context-tokens 400 --warm-cache warm_cache
+"""
+
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from AnswerIndex import normalize_question
+from EmbeddingBackends import get_backend, normalize_rows
+from Metrics import metrics
+
+
+class QueryLog:
+    # Appends queries to a JSON lines file, one write per flush_every queries and at least every flush_seconds
+    def __init__(self, path, flush_every=64, flush_seconds=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._lines = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # A killed service loses at most flush_seconds of queries; a clean exit loses none
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+        atexit.register(self.flush)
+
+    def append(self, query, categories=None):
+        record = {"t": round(time.time(), 3), "q": query}
+        if categories is not None:
+            record["c"] = list(categories)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) < self.flush_every:
+                return
+        self.flush()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    # Writes the buffered lines; a full disk or a missing directory loses them but never fails a request
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+        if not lines:
+            return
+        try:
+            with self._write_lock, open(self.path, 'a', encoding='utf-8') as file:
+                file.write("".join(lines))
+        except OSError as e:
+            metrics.inc("errors_total", stage="query_log")
+            print(f"Could not write {len(lines)} queries to {self.path}: {e}")
+
+
+# Yields the records of query logs, skipping lines cut short by a crash
+def read_log(paths):
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+# Returns [(normalized question, most common spelling, count)] of the unfiltered queries logged since
+# the given unix time, most frequent first. Queries restricted to categories can't be served from the
+# warm cache, so they are not counted.
+def count_queries(paths, since=0.0):
+    counts = Counter()
+    spellings = Counter()
+    for record in read_log(paths):
+        if record.get("c") is not None or record.get("t", 0) < since:
+            continue
+        key = normalize_question(record["q"])
+        if key:
+            counts[key] += 1
+            spellings[key, record["q"]] += 1
+    best = {}
+    for (key, text), count in spellings.most_common():
+        best.setdefault(key, text)
+    return [(key, best[key], count) for key, count in counts.most_common()]
+
+
+# Groups (key, text, count) queries, most frequent first, whose embeddings are at least similarity
+# similar to a cluster's leading query. Returns the clusters, most queries first:
+# {"query": leading text, "count": total, "members": [{"key", "query", "count"}]}
+def cluster_queries(queries, vectors, similarity=0.95):
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    leaders = np.zeros_like(vectors)
+    clusters = []
+    for (key, text, count), vector in zip(queries, vectors):
+        if clusters:
+            scores = leaders[:len(clusters)] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= similarity:
+                clusters[best]["count"] += count
+                clusters[best]["members"].append({"key": key, "query": text, "count": count})
+                continue
+        leaders[len(clusters)] = vector
+        clusters.append({"query": text, "count": count, "members": [{"key": key, "query": text, "count": count}]})
+    return sorted(clusters, key=lambda cluster: -cluster["count"])
+
+
+class WarmCache:
+    # Precomputed embeddings, hits and contexts of the hot query clusters, looked up by normalized words
+    def __init__(self, directory):
+        with open(os.path.join(directory, "entries.json"), 'r', encoding='utf-8') as file:
+            entries = json.load(file)
+        self.meta = entries["meta"]
+        self.clusters = entries["clusters"]
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"))
+        self.rows = {member["key"]: row for row, member in enumerate(entries["members"])}
+        self.member_clusters = [member["cluster"] for member in entries["members"]]
+        self.hits = 0
+        self.misses = 0
+
+    # Embeds the members of the clusters, retrieves and packs the context of every cluster's leading
+    # query with a RetrievalService.Retriever (and ContextBuilder), writes the directory and opens it
+    @classmethod
+    def build(cls, directory, clusters, retriever, context_builder=None, batch_size=256):
+        # RetrievalService imports this module, so its key function is imported on use
+        from RetrievalService import normalize_query
+
+        members = [dict(member, cluster=number) for number, cluster in enumerate(clusters)
+                   for member in cluster["members"]]
+        texts = [member["query"] for member in members]
+        vectors = np.concatenate([retriever.backend.embed(texts[start:start + batch_size])
+                                  for start in range(0, len(texts), batch_size)]).astype(np.float32)
+        leader_rows = {}
+        for row, member in enumerate(members):
+            leader_rows.setdefault(member["cluster"], row)
+
+        entries = []
+        for number, cluster in enumerate(clusters):
+            query = cluster["query"]
+            # The leading query was just embedded, so retrieving it only searches
+            retriever.embedding_cache.put(normalize_query(query), vectors[leader_rows[number]])
+            hits = retriever.retrieve(query)
+            context = context_builder.build(query, hits) if context_builder is not None else None
+            entries.append({"query": query, "count": cluster["count"], "row": leader_rows[number],
+                            "hits": hits, "context": context})
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), vectors)
+        meta = {"backend": retriever.backend.name, "dim": int(vectors.shape[1]), "limit": retriever.limit,
+                "context_tokens": context_builder.max_tokens if context_builder is not None else None,
+                "created": time.time()}
+        with open(os.path.join(directory, "entries.json"), 'w', encoding='utf-8') as file:
+            json.dump({"meta": meta, "members": [{"key": member["key"], "cluster": member["cluster"]}
+                                                 for member in members], "clusters": entries}, file)
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.clusters)
+
+    # Returns the stored embedding of a hot query, or None
+    def embedding(self, text):
+        row = self.rows.get(normalize_question(text))
+        return None if row is None else self.vectors[row]
+
+    # Returns the precomputed hits of a hot query, or None
+    def results(self, text):
+        row = self.rows.get(normalize_question(text))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.clusters[self.member_clusters[row]]["hits"]
+
+    # Returns the precomputed context of a hot query when it was packed into max_tokens, or None
+    def context(self, text, max_tokens):
+        row = self.rows.get(normalize_question(text))
+        if row is None or max_tokens != self.meta["context_tokens"]:
+            return None
+        return self.clusters[self.member_clusters[row]]["context"]
+
+    # Yields (embedding, hits) of the leading query of every cluster, to seed a SemanticCache
+    def seeds(self):
+        for cluster in self.clusters:
+            yield self.vectors[cluster["row"]], cluster["hits"]
+
+    def stats(self):
+        return {"warm_cache_hits": self.hits, "warm_cache_misses": self.misses, "warm_cache_clusters": len(self)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the hot query clusters in the query log and precompute them.")
+    parser.add_argument("command", choices=["cluster", "warm"])
+    parser.add_argument("--log", nargs="+", default=["queries.jsonl"], help="Query logs written with --query-log")
+    parser.add_argument("--days", type=float, default=None, help="Only count queries from the last days")
+    parser.add_argument("--candidates", type=int, default=5000, help="Most frequent queries embedded and clustered")
+    parser.add_argument("--similarity", type=float, default=0.95,
+                        help="Similarity to a cluster's leading query needed to join the cluster")
+    parser.add_argument("--top", type=int, default=200, help="Number of clusters kept")
+    parser.add_argument("--hot", default="hot_queries.json", help="Clusters written by the cluster command")
+    parser.add_argument("--out", default=None, help="hot_queries.json for cluster, warm_cache for warm")
+    parser.add_argument("--collection", default="ChatbotDataset")
+    parser.add_argument("--local-index", default=None, help="Search this LocalIndex.py directory instead of Qdrant")
+    parser.add_argument("--bm25-index", default=None, help="BM25Index.py directory, enables hybrid search")
+    parser.add_argument("--rerank", default=None, choices=["lexical", "cross-encoder"])
+    parser.add_argument("--limit", type=int, default=3, help="Number of hits stored per query")
+    parser.add_argument("--context-tokens", type=int, default=0, help="Also store the packed context, 0 turns it off")
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--model", default=None, help="Model for the openai/sentence-transformers backends")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the query embeddings, must match the ingestion")
+    args = parser.parse_args()
+
+    from RetrievalService import OPENAI_API_KEY, QDRANT_API_KEY, QDRANT_CLUSTER_URL, QdrantSearcher, Retriever
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key=OPENAI_API_KEY)
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+
+    if args.command == "cluster":
+        since = time.time() - args.days * 86400 if args.days else 0.0
+        queries = count_queries(args.log, since)
+        total = sum(count for _, _, count in queries)
+        candidates = queries[:args.candidates]
+        texts = [text for _, text, _ in candidates]
+        vectors = np.concatenate([backend.embed(texts[start:start + 256]) for start in range(0, len(texts), 256)]) \
+            if texts else np.zeros((0, backend.dim), dtype=np.float32)
+        clusters = cluster_queries(candidates, vectors, args.similarity)[:args.top]
+        covered = sum(cluster["count"] for cluster in clusters)
+        out = args.out or "hot_queries.json"
+        with open(out, 'w', encoding='utf-8') as file:
+            json.dump({"backend": backend.name, "similarity": args.similarity, "queries": total, "covered": covered,
+                       "clusters": clusters}, file, indent=2, ensure_ascii=False)
+        print(f"{len(queries)} distinct queries out of {total}; the top {len(clusters)} clusters cover "
+              f"{covered / max(total, 1):.1%} of them. Wrote {out}")
+        for cluster in clusters[:10]:
+            print(f"{cluster['count']:8d}  {' '.join(cluster['query'].split())}  (+{len(cluster['members']) - 1} variants)")
+    else:
+        from qdrant_client import QdrantClient
+
+        from BM25Index import BM25Index
+        from ContextBuilder import ContextBuilder
+        from LocalIndex import LocalIndex
+        from Reranker import get_reranker
+
+        with open(args.hot, 'r', encoding='utf-8') as file:
+            clusters = json.load(file)["clusters"]
+        if args.local_index:
+            searcher = LocalIndex(args.local_index, backend.name)
+        else:
+            searcher = QdrantSearcher(QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY), args.collection)
+        lexical_index = BM25Index(args.bm25_index) if args.bm25_index else None
+        reranker = get_reranker(args.rerank, lexical_index) if args.rerank else None
+        retriever = Retriever(backend, searcher, args.limit, lexical_index=lexical_index, reranker=reranker)
+        context_builder = ContextBuilder(args.context_tokens) if args.context_tokens > 0 else None
+        start_time = time.perf_counter()
+        cache = WarmCache.build(args.out or "warm_cache", clusters, retriever, context_builder)
+        print(f"Precomputed {len(cache)} clusters ({len(cache.rows)} queries) in "
+              f"{time.perf_counter() - start_time:.1f}s into {args.out or 'warm_cache'}")
@@ -0,0 +1,335 @@
+"""
+Load test of the retrieval and chat endpoints at increasing arrival rates.
+
+Questions from the QA datasets are sent by an asyncio load generator at each of --rates
+requests per second for --duration seconds. Arrivals follow a Poisson process (open loop), so
+requests keep arriving at the offered rate even when the server slows down, just like students
+during registration week; at most --concurrency requests are in flight and the rest wait for a
+free slot. Latency is measured from the moment a request was due to be sent, so time spent
+waiting behind a saturated server counts too. A rate of 0 runs --concurrency clients back to
+back instead (closed loop), which measures the peak throughput.
+
+Targets:
+- retrieval:  POST {"prompt": ...} to a qdrantQuery-compatible endpoint (RetrievalService.py, the Firebase function)
+- chat:       POST a streamed chat completion to ChatGateway.py, also measuring the time to first token
+
+For every rate the report holds the achieved throughput, latency percentiles, the error rate
+(non-200 responses, timeouts, connection errors, malformed responses, counted by type) and whether the step was saturated: the server
+completed less than 90% of the offered rate, more than 1% of the requests failed, or the p95
+latency exceeded --slo-ms. The first saturated rate and the highest sustained throughput below
+it are the numbers to size a deployment with. The report is written as JSON (--out) and as an
+HTML page with a table and a latency chart (--html).
+
+The `stub` command runs a stand-in for qdrantQuery with a fixed number of workers and a fixed
+service time, so the harness can be tried, and its saturation point checked
+(workers / service time), without a search backend.
+
+Usage:
+    python LoadTest.py stub --port 8090 --workers 4 --service-ms 20
+    python LoadTest.py run --url http://localhost:8090/qdrantQuery --rates 50 100 150 200 250 --duration 10
+    python LoadTest.py run --target chat --url http://localhost:8081/v1/chat/completions --rates 1 2 4 8
+"""
+
+import argparse
+import asyncio
+import html
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+
+from EmbeddingBackends import DATASETS_DIR
+
+# Share of the offered rate a step must complete, and the error rate it may have, to count as sustained
+MIN_COMPLETION = 0.9
+MAX_ERROR_RATE = 0.01
+
+
+# Loads the questions of QA datasets, stripping the stray quotes the augmentation step left around some
+# of them and skipping the empty ones (the service rightly rejects those)
+def load_questions(paths):
+    questions = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            questions.extend(row["question"].strip().strip("'\"") for row in json.load(file))
+    return [question for question in questions if question]
+
+
+# Sends one question and returns (status code, seconds to the first streamed event or None)
+async def send(client, target, url, question, start_time):
+    if target == "retrieval":
+        response = await client.post(url, json={"prompt": question})
+        await response.aread()
+        return response.status_code, None
+
+    first_token = None
+    request = {"messages": [{"role": "user", "content": question}], "stream": True}
+    async with client.stream("POST", url, json=request) as response:
+        status = response.status_code
+        async for line in response.aiter_lines():
+            if not line.startswith("data:") or line == "data: [DONE]":
+                continue
+            event = json.loads(line[5:])
+            if "error" in event:
+                # The gateway reports upstream failures inside the stream, after the 200
+                status = 502
+            elif first_token is None and any(choice.get("delta", {}).get("content")
+                                             for choice in event.get("choices", [])):
+                first_token = time.perf_counter() - start_time
+    return status, first_token
+
+
+# Runs one step of the test and returns its statistics.
+# rate is in requests per second (0 for closed loop), duration in seconds.
+async def run_step(client, target, url, questions, rate, concurrency, duration, timeout, seed=0):
+    rng = np.random.default_rng(seed)
+    slots = asyncio.Semaphore(concurrency)
+    latencies, first_tokens, finished = [], [], []
+    errors = Counter()
+    sent = 0
+
+    # Sends one question once a slot is free; due is when it should have been sent
+    async def request(question, due):
+        async with slots:
+            try:
+                status, first_token = await asyncio.wait_for(send(client, target, url, question, due), timeout)
+            except asyncio.TimeoutError:
+                errors["timeout"] += 1
+                return
+            except Exception as e:
+                # Connection errors, malformed stream events and anything else fail this request only,
+                # counted by type, so one bad response does not abort the step and lose the report
+                errors[type(e).__name__] += 1
+                return
+        if status != 200:
+            errors[str(status)] += 1
+            return
+        finished.append(time.perf_counter())
+        latencies.append(finished[-1] - due)
+        if first_token is not None:
+            first_tokens.append(first_token)
+
+    start_time = time.perf_counter()
+    end_time = start_time + duration
+    if rate > 0:
+        tasks = []
+        due = start_time
+        while due < end_time:
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            tasks.append(asyncio.create_task(request(questions[sent % len(questions)], due)))
+            sent += 1
+            due += rng.exponential(1 / rate)
+        await asyncio.gather(*tasks)
+    else:
+        # Closed loop: every client sends its next question as soon as the previous one is answered
+        async def client_loop():
+            nonlocal sent
+            while time.perf_counter() < end_time:
+                question = questions[sent % len(questions)]
+                sent += 1
+                await request(question, time.perf_counter())
+        await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start_time
+
+    failed = sum(errors.values())
+    # Throughput over the span between the first and last answer, so the time the last requests
+    # take to drain does not count against it (a saturated server drains a backlog for longer)
+    span = max(finished) - min(finished) if len(finished) > 1 else elapsed
+    step = {
+        "offered_rps": rate or None,
+        # Poisson arrivals send a little more or less than the offered rate over a short step
+        "sent_rps": round(sent / duration, 2),
+        "concurrency": concurrency,
+        "requests": sent,
+        "completed": len(latencies),
+        "errors": dict(errors),
+        "error_rate": round(failed / max(sent, 1), 4),
+        "achieved_rps": round((len(finished) - 1) / span, 2) if len(finished) > 1 else 0.0,
+        "seconds": round(elapsed, 2),
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        step.update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2),
+                    max_ms=round(max(latencies) * 1000, 2))
+    if first_tokens:
+        step["first_token_p50_ms"], step["first_token_p95_ms"] = \
+            [round(value, 2) for value in np.percentile(first_tokens, [50, 95]) * 1000]
+    return step
+
+
+# True when a step did not keep up with its offered rate, failed too often or missed the latency objective
+def is_saturated(step, slo_ms=None):
+    if step["error_rate"] > MAX_ERROR_RATE:
+        return True
+    if step["offered_rps"] and step["achieved_rps"] < MIN_COMPLETION * step["sent_rps"]:
+        return True
+    # The percentiles are numpy floats, whose comparison gives a numpy bool that json cannot write
+    return slo_ms is not None and bool(step.get("p95_ms", float("inf")) > slo_ms)
+
+
+# Runs every rate in turn (stopping after the first saturated one unless keep_going) and returns the report
+async def run_test(target, url, questions, rates, concurrency, duration, timeout, slo_ms=None, keep_going=False):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    steps = []
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        # A few requests first so connection setup and cold caches don't count against the first step
+        await asyncio.gather(*[send(client, target, url, question, time.perf_counter())
+                               for question in questions[:min(concurrency, 8)]], return_exceptions=True)
+        for number, rate in enumerate(rates):
+            step = await run_step(client, target, url, questions, rate, concurrency, duration, timeout, seed=number)
+            step["saturated"] = is_saturated(step, slo_ms)
+            steps.append(step)
+            print(f"{rate or 'closed loop':>11} rps offered: {step['achieved_rps']:8.1f} rps achieved, "
+                  f"p50 {step.get('p50_ms', 0):8.1f}ms, p95 {step.get('p95_ms', 0):8.1f}ms, "
+                  f"errors {step['error_rate']:.1%}" + ("  SATURATED" if step["saturated"] else ""))
+            if step["saturated"] and not keep_going:
+                break
+
+    saturated = [step for step in steps if step["saturated"]]
+    sustained = steps[:steps.index(saturated[0])] if saturated else steps
+    # A closed-loop step has no offered rate, it saturates at its number of clients
+    closed_loop = bool(saturated) and saturated[0]["offered_rps"] is None
+    return {
+        "target": target,
+        "url": url,
+        "duration_per_step": duration,
+        "concurrency": concurrency,
+        "slo_ms": slo_ms,
+        "steps": steps,
+        "saturation_rps": saturated[0]["offered_rps"] if saturated else None,
+        "saturation_concurrency": saturated[0]["concurrency"] if closed_loop else None,
+        "saturation_achieved_rps": saturated[0]["achieved_rps"] if saturated else None,
+        "max_sustained_rps": max((step["achieved_rps"] for step in sustained), default=None),
+    }
+
+
+# Where a report saturated: the offered rate, or the clients and throughput of a closed-loop step
+def describe_saturation(report):
+    if report.get("saturation_concurrency") is not None:
+        return (f"{report['saturation_concurrency']} closed-loop clients "
+                f"({report['saturation_achieved_rps']} rps achieved)")
+    if report["saturation_rps"] is not None:
+        return f"{report['saturation_rps']} rps offered"
+    return "none of the tested rates"
+
+
+# Writes the report as a standalone HTML page: a summary, one table row per step and a p50/p95 chart
+def write_html(report, path):
+    columns = ["offered_rps", "sent_rps", "achieved_rps", "requests", "error_rate", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+               "first_token_p50_ms"]
+    rows = []
+    for step in report["steps"]:
+        cells = "".join(f"<td>{html.escape(str(step.get(column, '')))}</td>" for column in columns)
+        rows.append(f"<tr class=\"{'saturated' if step['saturated'] else ''}\">{cells}</tr>")
+
+    # Bar chart of p50 and p95 per step, scaled to the largest p95
+    steps = [step for step in report["steps"] if "p95_ms" in step]
+    top = max((step["p95_ms"] for step in steps), default=1.0) or 1.0
+    bars = []
+    for number, step in enumerate(steps):
+        x = 40 + number * 60
+        for offset, key, color in ((0, "p50_ms", "#4c78a8"), (22, "p95_ms", "#f58518")):
+            height = 200 * step[key] / top
+            bars.append(f'<rect x="{x + offset}" y="{220 - height:.1f}" width="20" height="{height:.1f}" fill="{color}">'
+                        f'<title>{key} {step[key]}</title></rect>')
+        bars.append(f'<text x="{x + 21}" y="238" font-size="11" text-anchor="middle">{step["offered_rps"] or "closed"}</text>')
+    chart = (f'<svg width="{60 * len(steps) + 60}" height="250">{"".join(bars)}'
+             f'<text x="0" y="12" font-size="11">{top:.0f} ms</text></svg>')
+
+    summary = (f"Target {html.escape(report['target'])} at {html.escape(report['url'])}, "
+               f"{report['duration_per_step']}s per step, concurrency {report['concurrency']}. "
+               f"Saturates at {html.escape(describe_saturation(report))}; "
+               f"highest sustained throughput {report['max_sustained_rps']} rps.")
+    page = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Load test report</title>
+<style>body {{ font-family: sans-serif; }} td, th {{ padding: 4px 10px; text-align: right; }}
+tr.saturated {{ background: #fdd; }}</style></head>
+<body><h1>Load test report</h1><p>{summary}</p>
+<table><tr>{"".join(f"<th>{column}</th>" for column in columns)}</tr>{"".join(rows)}</table>
+<h2>Latency per offered rate (p50 blue, p95 orange)</h2>{chart}</body></html>
+"""
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(page)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Stand-in for qdrantQuery: workers requests are served at once, each takes about service_ms
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this each response waits on a delayed ACK
+    disable_nagle_algorithm = True
+    workers = None
+    service_ms = 20.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.workers:
+            # Service times vary a little, like real searches do
+            time.sleep(self.service_ms / 1000 * np.random.uniform(0.8, 1.2))
+        hits = [{"id": number, "version": 0, "score": 1.0 - number / 10,
+                 "payload": {"text": f"Stub answer {number} to: {body.get('prompt', '')}"}, "vector": None}
+                for number in range(3)]
+        data = json.dumps({"message": "$ - Qdrant Response", "prompt": hits}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+# Creates the qdrantQuery stub; call serve_forever() on the result
+def make_stub_server(host="127.0.0.1", port=8090, workers=4, service_ms=20.0):
+    handler = type("Handler", (StubHandler,), {"workers": threading.BoundedSemaphore(workers),
+                                               "service_ms": service_ms})
+    return StubServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the retrieval service or the chat gateway.")
+    parser.add_argument("command", choices=["run", "stub"])
+    parser.add_argument("--url", default="http://localhost:8080/qdrantQuery")
+    parser.add_argument("--target", default="retrieval", choices=["retrieval", "chat"])
+    parser.add_argument("--questions", nargs="+",
+                        default=[os.path.join(DATASETS_DIR, "Run_2_Files", "run2_validate_augment.json")],
+                        help="QA datasets whose questions are replayed")
+    parser.add_argument("--rates", type=float, nargs="+", default=[5, 10, 20, 40, 80, 160],
+                        help="Arrival rates to test in requests per second, 0 for closed loop")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per rate")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a request counts as failed")
+    parser.add_argument("--slo-ms", type=float, default=None, help="p95 latency above which a rate counts as saturated")
+    parser.add_argument("--keep-going", action="store_true", help="Test every rate, even after saturation")
+    parser.add_argument("--out", default="load_test.json", help="JSON report")
+    parser.add_argument("--html", default="load_test.html", help="HTML report")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the stub listens on")
+    parser.add_argument("--port", type=int, default=8090, help="Port the stub listens on")
+    parser.add_argument("--workers", type=int, default=4, help="Requests the stub serves at once")
+    parser.add_argument("--service-ms", type=float, default=20.0, help="Milliseconds the stub takes per request")
+    args = parser.parse_args()
+
+    if args.command == "stub":
+        print(f"qdrantQuery stub on http://{args.host}:{args.port}/qdrantQuery, "
+              f"capacity about {args.workers * 1000 / args.service_ms:.0f} rps")
+        make_stub_server(args.host, args.port, args.workers, args.service_ms).serve_forever()
+
+    questions = load_questions(args.questions)
+    np.random.default_rng(0).shuffle(questions)
+    report = asyncio.run(run_test(args.target, args.url, questions, args.rates, args.concurrency, args.duration,
+                                  args.timeout, args.slo_ms, args.keep_going))
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    write_html(report, args.html)
+    print(f"Saturation at {describe_saturation(report)}, {report['max_sustained_rps']} rps sustained. "
+          f"Wrote {args.out} and {args.html}")
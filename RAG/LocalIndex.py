@@ -0,0 +1,288 @@
+"""
+In-process exact vector index for small corpora such as the QA datasets.
+
+The whole QA corpus is a few thousand rows, and at that size a network hop to Qdrant costs
+more than simply comparing the query against every row. The index is a directory holding:
+- vectors.npy:   the L2-normalized embedding matrix, opened with a memory map
+- table.jsonl:   one {"id": ..., "payload": {...}} line per row of the matrix
+- meta.json:     the name and dimension of the embedding backend used to build it, and the storage type
+
+The matrix is stored as float32, float16 (half the size) or uint8 (a quarter of the size, one
+code per component, see EmbeddingBackends.scalar_quantize; the scale and offset live in meta.json).
+Scores are always computed in float32 against the unquantized query.
+
+A snapshot exported by Snapshot.py has the same layout, except that the IDs and payloads are
+stored column by column in payloads.json instead of table.jsonl; it can be opened as an index as is.
+
+A search is one matrix-vector product followed by argpartition, and returns hits in the same
+shape as RetrievalService.QdrantSearcher, so the index can replace the Qdrant search in
+RetrievalService.py and QdrantQuery.py (--local-index). Those scripts open it with the name of
+their query backend, and an index built with another backend is refused. A search restricted to categories (see
+Categories.py) only scores the rows of those categories.
+
+Usage:
+    python LocalIndex.py build --source ../Datasets/Run_2_Files/run2_fix.json --backend hashing --out qa_index
+    python LocalIndex.py build --backend openai --dimensions 512 --dtype float16 --out qa_index_small
+    python LocalIndex.py benchmark --index qa_index
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from Categories import CATEGORY_FIELD, parse_category
+from EmbeddingBackends import get_backend, normalize_rows, scalar_quantize
+from Payloads import expand_payload
+
+# Storage types an index can keep its matrix in
+DTYPES = ("float32", "float16", "uint8")
+# Rows converted to float32 at a time when searching a float16 or uint8 matrix (4MB at 512 dimensions)
+SCORE_BLOCK_ROWS = 2048
+
+
+# Yields (id, text to embed, payload) for every document in a source file.
+# QA datasets (JSON lists with question/answer) embed the question and answer together and keep
+# the answer as the payload text, with the category split into its two fields (see Categories.py). The site dumps use their page text: "response" in uwp_data.json
+# and "body_content" in cs_data.json. Any other file is treated as Dataset.txt, one document per line.
+def iter_documents(path):
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as file:
+            rows = json.load(file)
+        for row in rows:
+            if "answer" in row:
+                payload = {"text": row["answer"], "ID": row.get("ID"), "question": row["question"],
+                           "category": row.get("category"), **parse_category(row.get("category"))}
+                yield row.get("ID"), f"{row['question']} {row['answer']}", payload
+            elif "body_content" in row:
+                yield row["code"], row["body_content"], {"text": row["body_content"], "code": row["code"],
+                                                         "file": row.get("file")}
+            else:
+                yield row["code"], row["response"], {"text": row["response"], "code": row["code"]}
+    else:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line_number, line in enumerate(file):
+                text = line.strip()
+                if text:
+                    yield line_number, text, {"text": text}
+
+
+# Writes ids and payloads column by column: {"ids": [...], "columns": {field: [value per row]},
+# "absent": {field: [rows without that field]}}, which is much smaller than one JSON object per row
+def write_columns(path, ids, payloads):
+    columns = {}
+    absent = {}
+    for row, payload in enumerate(payloads):
+        for field in payload:
+            if field not in columns:
+                columns[field] = [None] * row
+                absent[field] = list(range(row))
+        for field, values in columns.items():
+            values.append(payload.get(field))
+            if field not in payload:
+                absent[field].append(row)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({"ids": list(ids), "columns": columns,
+                   "absent": {field: rows for field, rows in absent.items() if rows}}, file)
+
+
+# Reads a file written by write_columns back into (ids, payloads)
+def read_columns(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        table = json.load(file)
+    payloads = [{} for _ in table["ids"]]
+    for field, values in table["columns"].items():
+        skip = set(table["absent"].get(field, ()))
+        for row, value in enumerate(values):
+            if row not in skip:
+                payloads[row][field] = value
+    return table["ids"], payloads
+
+
+# Returns the indexes of the k highest scores in a vector, best first
+def top_k_indexes(scores, k):
+    k = min(k, scores.shape[-1])
+    candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+class LocalIndex:
+    # backend_name, when given, must be the backend the index was built with: vectors of another
+    # model would be searched without error and return unrelated rows
+    def __init__(self, directory, backend_name=None):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), 'r') as file:
+            self.meta = json.load(file)
+        if backend_name is not None and self.meta.get("backend") != backend_name:
+            raise ValueError(f"{directory} holds vectors embedded with {self.meta.get('backend') or 'an unrecorded backend'}, "
+                             f"not {backend_name}")
+        self.dtype = self.meta.get("dtype", "float32")
+        # The matrix stays on disk and is paged in by the OS as it is used
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode='r')
+        self.ids = []
+        self.payloads = []
+        # Row numbers of each category, built on first use
+        self._partitions = None
+        if os.path.exists(os.path.join(directory, "payloads.json")):
+            # A Snapshot.py export
+            self.ids, self.payloads = read_columns(os.path.join(directory, "payloads.json"))
+            return
+        with open(os.path.join(directory, "table.jsonl"), 'r', encoding='utf-8') as file:
+            for line in file:
+                row = json.loads(line)
+                self.ids.append(row["id"])
+                self.payloads.append(row["payload"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Writes a new index directory from an embedding matrix, ids and payloads, and opens it.
+    # columnar writes payloads.json (the snapshot format) instead of table.jsonl, and extra_meta is added to meta.json.
+    @classmethod
+    def build(cls, directory, vectors, ids, payloads, backend_name=None, dtype="float32", columnar=False, extra_meta=None):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown storage type: {dtype}")
+        os.makedirs(directory, exist_ok=True)
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        meta = dict(extra_meta or {}, backend=backend_name, dim=int(vectors.shape[1]), count=int(vectors.shape[0]),
+                    dtype=dtype)
+        if dtype == "uint8":
+            vectors, meta["scale"], meta["offset"] = scalar_quantize(vectors)
+        np.save(os.path.join(directory, "vectors.npy"), vectors.astype(dtype))
+        if columnar:
+            write_columns(os.path.join(directory, "payloads.json"), ids, payloads)
+        else:
+            with open(os.path.join(directory, "table.jsonl"), 'w', encoding='utf-8') as file:
+                for point_id, payload in zip(ids, payloads):
+                    file.write(json.dumps({"id": point_id, "payload": payload}) + "\n")
+        with open(os.path.join(directory, "meta.json"), 'w') as file:
+            json.dump(meta, file)
+        return cls(directory)
+
+    # Returns the stored matrix as float32, undoing the uint8 quantization if needed
+    def matrix(self):
+        if self.dtype == "uint8":
+            return self.vectors * np.float32(self.meta["scale"]) + np.float32(self.meta["offset"])
+        return np.asarray(self.vectors, dtype=np.float32)
+
+    # Returns the sorted row numbers whose payload field is one of the given categories
+    def category_rows(self, categories, field=CATEGORY_FIELD):
+        if self._partitions is None:
+            partitions = {}
+            for row, payload in enumerate(self.payloads):
+                partitions.setdefault(payload.get(field), []).append(row)
+            self._partitions = {category: np.array(rows, dtype=np.int64) for category, rows in partitions.items()}
+        parts = [self._partitions[category] for category in categories if category in self._partitions]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    # Returns (row indexes, scores) of the best matches for a matrix of queries, one row per query.
+    # When rows is given only those rows are scored, so a search restricted to a category costs
+    # time in proportion to the size of the category instead of the whole index.
+    def search_rows(self, queries, limit, rows=None):
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if len(vectors) == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+        if self.dtype == "float32":
+            scores = queries @ vectors.T
+        else:
+            # A float32 @ float16/uint8 product skips BLAS and is ~20x slower, so convert a block at a
+            # time into one reused float32 buffer and multiply that
+            scores = np.empty((len(queries), len(vectors)), dtype=np.float32)
+            buffer = np.empty((min(SCORE_BLOCK_ROWS, len(vectors)), vectors.shape[1]), dtype=np.float32)
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                block = buffer[:min(SCORE_BLOCK_ROWS, len(vectors) - start)]
+                np.copyto(block, vectors[start:start + len(block)])
+                scores[:, start:start + len(block)] = queries @ block.T
+            if self.dtype == "uint8":
+                # Each code stands for code * scale + offset, so rescale the dot product and add the offset term
+                scores = scores * np.float32(self.meta["scale"]) \
+                    + np.float32(self.meta["offset"]) * queries.sum(axis=1, keepdims=True)
+        best = top_k_indexes(scores, limit)
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        return (best if rows is None else rows[best]), best_scores
+
+    # Same interface as RetrievalService.QdrantSearcher.search
+    def search(self, vector, limit, categories=None):
+        rows, scores = self.search_rows(vector, limit, None if categories is None else self.category_rows(categories))
+        return [
+            {"id": self.ids[row], "version": 0, "score": float(score), "payload": expand_payload(self.payloads[row]),
+             "vector": None}
+            for row, score in zip(rows[0], scores[0])
+        ]
+
+
+# Embeds every document of a source file in batches and builds an index from them
+def build_from_source(directory, source, backend, batch_size=256, dtype="float32"):
+    ids, texts, payloads = [], [], []
+    for point_id, text, payload in iter_documents(source):
+        ids.append(point_id)
+        texts.append(text)
+        payloads.append(payload)
+    vectors = np.concatenate([backend.embed(texts[start:start + batch_size])
+                              for start in range(0, len(texts), batch_size)])
+    return LocalIndex.build(directory, vectors, ids, payloads, backend.name, dtype)
+
+
+# Times a searcher over a list of query vectors and returns latency percentiles in milliseconds
+def time_searches(searcher, queries, limit=3):
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        searcher.search(query, limit)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+            "queries_per_sec": round(len(queries) / (sum(latencies) / 1000), 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or benchmark an in-process exact vector index.")
+    parser.add_argument("command", choices=["build", "benchmark"])
+    parser.add_argument("--source", default=os.path.join("..", "Datasets", "Run_2_Files", "run2_fix.json"),
+                        help="QA dataset (.json) or Dataset.txt to index")
+    parser.add_argument("--out", "--index", dest="index", default="qa_index", help="Index directory")
+    parser.add_argument("--backend", default="hashing", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the embeddings to this size")
+    parser.add_argument("--dtype", default="float32", choices=DTYPES, help="Storage type of the index matrix")
+    parser.add_argument("--url", default=None, help="Qdrant server to compare against, in-memory Qdrant if omitted")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--queries", type=int, default=500, help="Number of queries used by the benchmark")
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+
+    if args.command == "build":
+        index = build_from_source(args.index, args.source, backend, dtype=args.dtype)
+        print(f"Built {args.index} with {len(index)} {args.dtype} rows of size {index.vectors.shape[1]} "
+              f"({index.vectors.nbytes / 1024:.0f} KiB)")
+    else:
+        from qdrant_client import QdrantClient, models
+        from RetrievalService import QdrantSearcher
+
+        index = LocalIndex(args.index, backend.name)
+        # Load the same vectors into Qdrant so both paths search identical data
+        client = QdrantClient(":memory:") if args.url is None else QdrantClient(url=args.url, api_key=args.api_key)
+        name = "LocalIndexBenchmark"
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(name, vectors_config=models.VectorParams(size=index.vectors.shape[1],
+                                                                          distance=models.Distance.COSINE))
+        client.upload_collection(name, index.matrix(), payload=index.payloads, ids=list(range(len(index))))
+
+        questions = [payload.get("question") or payload["text"] for payload in index.payloads][:args.queries]
+        queries = backend.embed(questions)
+        print(f"{len(queries)} queries against {len(index)} rows")
+        print("local index:", json.dumps(time_searches(index, queries)))
+        print("qdrant:     ", json.dumps(time_searches(QdrantSearcher(client, name), queries)))
+        client.delete_collection(name)
@@ -0,0 +1,157 @@
+"""
+Instrumentation shared by the ingestion and retrieval scripts: timed spans, histograms and counters.
+
+Code records what it does through the module-level registry:
+
+    from Metrics import metrics
+    with metrics.span("embed"):
+        vectors = backend.embed(texts)
+    metrics.inc("api_calls_total", api="openai_embeddings")
+
+Every span name gets a histogram of its durations. Histograms keep Prometheus-style bucket counts,
+their sum and count, plus a window of the most recent samples for exact p50/p95/p99. Counters are
+plain running totals, optionally split by labels. The spans in use are embed, upsert, delete,
+search, rerank, context and serialize; the counters are api_calls_total, tokens_total,
+retries_total, errors_total, cache_hits_total, points_upserted_total and requests_total.
+
+The registry can be exported two ways:
+- prometheus(): the Prometheus text format, served by RetrievalService.py at GET /metrics
+- summary():     a JSON-friendly dictionary, printed (and saved with --metrics-out) at the end of
+                 batch runs such as DatasetToQdrant.py and BatchRetrieval.py
+"""
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Upper bounds of the histogram buckets in seconds, from half a millisecond to a minute
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=10000):
+        self.buckets = buckets
+        # Observations per bucket (not cumulative), the last slot counts values above every bound
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # Ring buffer of the most recent observations, used for percentiles
+        self._recent = np.zeros(window, dtype=np.float64)
+
+    def observe(self, value):
+        self._recent[self.count % len(self._recent)] = value
+        self.count += 1
+        self.sum += value
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    # Percentiles of the most recent observations
+    def percentiles(self, percents=(50, 95, 99)):
+        samples = self._recent[:min(self.count, len(self._recent))]
+        if not len(samples):
+            return [0.0 for _ in percents]
+        return [float(value) for value in np.percentile(samples, percents)]
+
+
+# Formats labels the way Prometheus expects them: {name="value",...}
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    def __init__(self, prefix="uwp_rag"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Records the duration of one run of a span
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    # Times the body of a with statement and records it, even when it raises
+    @contextmanager
+    def span(self, name, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # Returns {"counters": {...}, "spans": {name: {count, total_seconds, p50_ms, p95_ms, p99_ms}}}
+    def summary(self):
+        with self._lock:
+            counters = {name + format_labels(labels): value for (name, labels), value in sorted(self.counters.items())}
+            spans = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                p50, p95, p99 = histogram.percentiles()
+                spans[name + format_labels(labels)] = {
+                    "count": histogram.count,
+                    "total_seconds": round(histogram.sum, 6),
+                    "p50_ms": round(p50 * 1000, 3),
+                    "p95_ms": round(p95 * 1000, 3),
+                    "p99_ms": round(p99 * 1000, 3),
+                }
+        return {"counters": counters, "spans": spans}
+
+    # Returns every counter and histogram in the Prometheus text exposition format
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}_seconds"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    # Prints the summary and, when a path is given, writes it there as JSON
+    def report(self, path=None):
+        summary = self.summary()
+        for name, span in summary["spans"].items():
+            print(f"{name:25s} {span['count']:8d} runs  p50 {span['p50_ms']:9.3f}ms  "
+                  f"p95 {span['p95_ms']:9.3f}ms  p99 {span['p99_ms']:9.3f}ms")
+        for name, value in summary["counters"].items():
+            print(f"{name:50s} {value}")
+        if path:
+            with open(path, 'w') as file:
+                json.dump(summary, file, indent=2, sort_keys=True)
+            print(f"Wrote metrics to {path}")
+        return summary
+
+
+# The registry used by every script in this folder
+metrics = Metrics()
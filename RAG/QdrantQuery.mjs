@@ -2,6 +2,8 @@
 import { OpenAI } from 'openai';
 // Import the QdrantClient from the Qdrant JavaScript client package for REST API interactions
 import { QdrantClient } from "@qdrant/js-client-rest";
+// Import inflateSync to restore the texts DatasetToQdrant.py stored compressed (see Payloads.py)
+import { inflateSync } from 'zlib';
 
 // Initialize the OpenAI client with your API key
 const openai_client = new OpenAI({
@@ -28,11 +30,19 @@ const embedding = openaiResponse.data[0].embedding;  // Extract the embedding ve
 const searchResult = await qdrant_client.search("ChatbotDataset", {
   vector: embedding,  // Query vector
   limit: 10,  // Number of search results to return
+  with_payload: true,  // Return the payloads but not the vectors
+  with_vector: false,
 });
 
 // Output the search results
 console.log("Search Results:");
 for (const result of searchResult) {
-    console.log(result.payload);  // Print the payload of each search result
+    const payload = result.payload;
+    // Long texts are stored zlib-compressed and base64 encoded in text_z instead of text
+    if (typeof payload.text_z === 'string') {
+      payload.text = inflateSync(Buffer.from(payload.text_z, 'base64')).toString('utf-8');
+      delete payload.text_z;
+    }
+    console.log(payload);  // Print the payload of each search result
 }
 console.log("-----------------------------------");  // Print a separator line for clarity
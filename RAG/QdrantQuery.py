@@ -0,0 +1,74 @@
+"""
+Python counterpart of QdrantQuery.mjs for testing queries against the collection.
+
+The query is embedded with one of the backends in EmbeddingBackends.py. With the hashing or
+sentence-transformers backends the embedding is computed locally on the CPU, so the only
+network hop is the Qdrant search itself. The backend must match the one the collection was
+filled with by DatasetToQdrant.py.
+
+With --local-index the search runs against an in-process index built by LocalIndex.py
+instead of the Qdrant cluster, so no network is needed at all with a local backend.
+
+Usage:
+    python QdrantQuery.py "scholarships"
+    python QdrantQuery.py "parking permit" --backend hashing --collection ChatbotDatasetLocal
+    python QdrantQuery.py "parking permit" --backend hashing --local-index qa_index
+    python QdrantQuery.py "tuition deadline" --category "Admissions and Aid"
+"""
+
+import argparse
+
+# Import the QdrantClient from the qdrant_client package for interacting with the Qdrant API
+from qdrant_client import QdrantClient
+
+from Categories import CATEGORIES
+from EmbeddingBackends import get_backend
+from LocalIndex import LocalIndex
+from RetrievalService import QdrantSearcher
+
+# API keys and cluster URL, replace these with your own values
+OPENAI_API_KEY = "OPEN_AI_API_KEY"
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Specify the name of the collection in Qdrant to search
+collection_name = "ChatbotDataset"
+
+
+# Embeds a query with the backend and returns the payloads of the closest points.
+# searcher is a RetrievalService.QdrantSearcher or a LocalIndex.
+# categories optionally restricts the results to those question categories (see Categories.py).
+def search(backend, searcher, text, limit=10, categories=None):
+    embedding = backend.embed([text])[0]
+    return [hit["payload"] for hit in searcher.search(embedding, limit, categories)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the Qdrant collection.")
+    parser.add_argument("text", help="The text to search for")
+    parser.add_argument("--limit", type=int, default=10, help="Number of search results to return")
+    parser.add_argument("--collection", default=collection_name)
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--model", default=None, help="Model for the openai/sentence-transformers backends")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the query embedding, must match the ingestion")
+    parser.add_argument("--local-index", default=None, help="Search this LocalIndex.py directory instead of Qdrant")
+    parser.add_argument("--category", nargs="+", default=None, choices=CATEGORIES,
+                        help="Only return results from these question categories")
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key=OPENAI_API_KEY)
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+    if args.local_index:
+        searcher = LocalIndex(args.local_index, backend.name)
+    else:
+        searcher = QdrantSearcher(QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY), args.collection)
+
+    # Output the search results
+    print("Search Results:")
+    for payload in search(backend, searcher, args.text, args.limit, args.category):
+        print(payload)
+    print("-----------------------------------")
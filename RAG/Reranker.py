@@ -0,0 +1,159 @@
+"""
+Rerankers that rescore a wide candidate set from the vector search and keep the best few.
+
+The vector search is good at finding the neighbourhood of a question but its top 3 is noisy.
+RetrievalService.py (--rerank) fetches a wider candidate set, 50 by default, and one of these
+rerankers reorders it. Each reranker scores all the candidates of a query in one batch:
+- LexicalReranker:       BM25 of the query terms in each candidate, blended with the vector score.
+                         With a BM25Index.py index holding the candidates the precomputed postings are
+                         read directly; other candidates are tokenized and scored as one small
+                         (candidates x query terms) count matrix. Pure numpy, a few milliseconds at most.
+- CrossEncoderReranker:  a small cross-encoder (ms-marco-MiniLM-L-6-v2 by default) on the CPU that
+                         reads the query and each candidate together, all pairs in one forward batch.
+                         More accurate and slower (tens of milliseconds); needs sentence-transformers.
+
+Both take hits shaped like RetrievalService.QdrantSearcher results and return them reordered,
+with "score" replaced by the reranker's score.
+
+Usage:
+    python Reranker.py "When is the tuition deadline?" --local-index qa_index --bm25-index bm25_index
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from BM25Index import BM25Index, tokenize
+
+
+# The text a candidate is judged on: its question (QA rows) and its text
+def hit_text(hit):
+    payload = hit.get("payload") or {}
+    return f"{payload.get('question', '')} {payload.get('text', '')}".strip()
+
+
+# Scales scores to [0, 1] so scores from different stages can be blended
+def min_max(scores):
+    spread = scores.max() - scores.min() if len(scores) else 0
+    return (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
+
+
+# Orders hits by new scores, best first, and keeps the top limit
+def reorder(hits, scores, limit):
+    order = np.argsort(-scores, kind="stable")[:limit]
+    return [dict(hits[i], score=float(scores[i])) for i in order]
+
+
+class LexicalReranker:
+    # weight is the share of the lexical score in the final score, the rest is the (normalized) vector score
+    def __init__(self, bm25_index=None, weight=0.5, k1=1.2, b=0.75):
+        self.bm25_index = bm25_index
+        self.weight = weight
+        self.k1 = k1
+        self.b = b
+        # Row of every point in the BM25 index, so its scores can be looked up by point ID. QA IDs repeat
+        # across and within the dataset files; an ID held by several rows maps to None, so candidates
+        # with it are scored from their text instead of borrowing another row's score
+        self._rows = {}
+        for row, point_id in enumerate(bm25_index.ids if bm25_index else []):
+            self._rows[str(point_id)] = None if str(point_id) in self._rows else row
+
+    # IDF of each query term, from the BM25 index's document frequencies or from the candidates
+    def _idf(self, terms, counts):
+        if self.bm25_index is not None:
+            index = self.bm25_index
+            document_count = len(index)
+            frequencies = np.array([index.offsets[index.vocab[term] + 1] - index.offsets[index.vocab[term]]
+                                    if term in index.vocab else 0 for term in terms], dtype=np.float32)
+        else:
+            document_count = counts.shape[0]
+            frequencies = (counts > 0).sum(axis=0).astype(np.float32)
+        return np.log(1 + (document_count - frequencies + 0.5) / (frequencies + 0.5))
+
+    # BM25 scores of the candidates computed from their text
+    def _lexical_scores(self, query, hits):
+        terms = list(dict.fromkeys(tokenize(query)))
+        columns = {term: column for column, term in enumerate(terms)}
+        documents = [tokenize(hit_text(hit)) for hit in hits]
+
+        # Counts of every query term in every candidate
+        counts = np.zeros((len(hits), len(terms)), dtype=np.float32)
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)
+        for row, tokens in enumerate(documents):
+            for token in tokens:
+                column = columns.get(token)
+                if column is not None:
+                    counts[row, column] += 1
+
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        return (self._idf(terms, counts) * counts * (self.k1 + 1) / (counts + norm[:, None])).sum(axis=1)
+
+    def rerank(self, query, hits, limit):
+        if not hits:
+            return []
+        rows = [self._rows.get(str(hit["id"])) for hit in hits]
+        if self._rows and None not in rows:
+            # Every candidate is a single row of the BM25 index, its postings already hold the weights
+            lexical = self.bm25_index.scores(query)[rows]
+        else:
+            lexical = self._lexical_scores(query, hits)
+        dense = np.array([hit["score"] for hit in hits], dtype=np.float32)
+        scores = (1 - self.weight) * min_max(dense) + self.weight * min_max(lexical)
+        return reorder(hits, scores, limit)
+
+
+class CrossEncoderReranker:
+    def __init__(self, model="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=64):
+        # Imported here so the lexical reranker works without sentence-transformers installed
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model, device="cpu")
+        self.batch_size = batch_size
+
+    def rerank(self, query, hits, limit):
+        if not hits:
+            return []
+        scores = self.model.predict([(query, hit_text(hit)) for hit in hits], batch_size=self.batch_size,
+                                    show_progress_bar=False, convert_to_numpy=True)
+        return reorder(hits, np.asarray(scores, dtype=np.float32), limit)
+
+
+# Creates a reranker by name ("lexical" or "cross-encoder")
+def get_reranker(name, bm25_index=None, weight=0.5, model=None):
+    if name == "lexical":
+        return LexicalReranker(bm25_index, weight)
+    if name == "cross-encoder":
+        return CrossEncoderReranker(model or "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    raise ValueError(f"Unknown reranker: {name}")
+
+
+if __name__ == "__main__":
+    from EmbeddingBackends import get_backend
+    from LocalIndex import LocalIndex
+
+    parser = argparse.ArgumentParser(description="Compare the vector top hits with the reranked ones for a query.")
+    parser.add_argument("query")
+    parser.add_argument("--local-index", default="qa_index")
+    parser.add_argument("--bm25-index", default=None, help="BM25Index.py directory to take term IDFs from")
+    parser.add_argument("--reranker", default="lexical", choices=["lexical", "cross-encoder"])
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--backend", default="hashing", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
+    backend = get_backend(args.backend, openai_client, dim=args.hashing_dim)
+    reranker = get_reranker(args.reranker, BM25Index(args.bm25_index) if args.bm25_index else None)
+
+    candidates = LocalIndex(args.local_index, backend.name).search(backend.embed([args.query])[0], args.candidates)
+    start_time = time.perf_counter()
+    reranked = reranker.rerank(args.query, candidates, args.limit)
+    print(f"Reranked {len(candidates)} candidates in {(time.perf_counter() - start_time) * 1000:.2f}ms")
+    for title, hits in (("Vector search", candidates[:args.limit]), ("Reranked", reranked)):
+        print(title)
+        for hit in hits:
+            print(f"  {hit['score']:.3f} {hit_text(hit)[:100]}")
@@ -0,0 +1,220 @@
+"""
+Retrieval quality and latency benchmark on the UWP validation set.
+
+Datasets/Run_2_Files/run2_validate_augment.json holds parent questions and, for each parent,
+paraphrased children linked by "child_of". The parents (question + answer) form the corpus,
+and every child question is a query whose correct result is its parent's ID.
+
+For each retrieval backend the suite reports recall@1/3/10, MRR (over the top 10) and the
+p50/p95/p99 latency of answering one query end to end (embedding included). Everything runs
+offline: the vector backends use Qdrant's in-memory mode or LocalIndex.py, and queries are
+embedded with the deterministic hashing backend unless --backend says otherwise.
+
+The storage sweep rebuilds the local index with the embeddings shortened to 1/1, 1/2 and 1/4
+of the backend's size (--dimensions to choose), each stored as float32, float16 and uint8, and
+reports the size of the vector matrix and the p50/p95 latency of the index search alone
+(search_p50_ms, search_p95_ms, embedding excluded) next to the recall of every combination.
+
+Results are written as sorted, indented JSON so two runs can be diffed, and --compare prints
+the change of every metric against an earlier results file.
+
+Usage:
+    python RetrievalBenchmark.py --out benchmark_results.json
+    python RetrievalBenchmark.py --out new.json --compare benchmark_results.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from BM25Index import BM25Builder
+from Categories import CATEGORY_FIELD, CategoryClassifier, parse_category
+from EmbeddingBackends import DATASETS_DIR, TruncatedBackend, get_backend, truncate_rows
+from LocalIndex import DTYPES, LocalIndex, time_searches
+from Reranker import LexicalReranker
+from RetrievalService import QdrantSearcher, Retriever
+
+# The validation set with parent questions and their paraphrases
+VALIDATION_SET = os.path.join(DATASETS_DIR, "Run_2_Files", "run2_validate_augment.json")
+# Cut-offs reported as recall@k; the largest one is also the depth used for MRR
+RECALL_AT = (1, 3, 10)
+
+
+# Splits the validation set into the corpus (parents) and the queries (children and their parent IDs)
+def load_validation_set(path=VALIDATION_SET):
+    with open(path, 'r', encoding='utf-8') as file:
+        rows = json.load(file)
+    corpus = [row for row in rows if not row.get("child_of")]
+    queries = [row["question"].strip().strip("'\"") for row in rows if row.get("child_of")]
+    truths = [row["child_of"] for row in rows if row.get("child_of")]
+    return corpus, queries, truths
+
+
+# Text embedded/indexed for a corpus row and the payload stored with it
+def document_text(row):
+    return f"{row['question']} {row['answer']}"
+
+
+def document_payload(row):
+    return {"text": row["answer"], "ID": row["ID"], "question": row["question"], "category": row["category"],
+            **parse_category(row["category"])}
+
+
+# Wraps a Retriever as a retrieve(text, limit) -> [ids] function
+def retrieve_ids(retriever):
+    def retrieve(text, limit):
+        retriever.limit = limit
+        return [hit["id"] for hit in retriever.retrieve(text)]
+    return retrieve
+
+
+# Builds one retrieve(text, limit) -> [ids] function per retrieval backend over the same corpus
+def build_retrievers(corpus, backend, workdir):
+    ids = [row["ID"] for row in corpus]
+    texts = [document_text(row) for row in corpus]
+    payloads = [document_payload(row) for row in corpus]
+    vectors = backend.embed(texts)
+
+    # Qdrant in-memory mode, searched through the same code as the retrieval service
+    qdrant_client = QdrantClient(":memory:")
+    qdrant_client.create_collection("Benchmark", vectors_config=models.VectorParams(
+        size=vectors.shape[1], distance=models.Distance.COSINE))
+    qdrant_client.upload_collection("Benchmark", vectors, payload=payloads, ids=list(range(len(ids))))
+
+    local_index = LocalIndex.build(os.path.join(workdir, "local"), vectors, ids, payloads, backend.name)
+    bm25_builder = BM25Builder()
+    for point_id, text, payload in zip(ids, texts, payloads):
+        bm25_builder.add(point_id, text, payload)
+    bm25_index = bm25_builder.save(os.path.join(workdir, "bm25"))
+
+    # The embedding cache is turned off (size 0) so every query pays for its own embedding
+    qdrant = Retriever(backend, QdrantSearcher(qdrant_client, "Benchmark"), cache_size=0)
+    local = Retriever(backend, local_index, cache_size=0)
+    hybrid = Retriever(backend, local_index, cache_size=0, lexical_index=bm25_index)
+    # The category classifier learns from the corpus questions only, never from the queries
+    labelled = [(vector, payload[CATEGORY_FIELD]) for vector, payload in zip(vectors, payloads) if CATEGORY_FIELD in payload]
+    classifier = CategoryClassifier.fit([vector for vector, _ in labelled], [label for _, label in labelled])
+    category_first = Retriever(backend, local_index, cache_size=0, classifier=classifier)
+    reranked = Retriever(backend, local_index, cache_size=0, reranker=LexicalReranker(bm25_index))
+
+    # Qdrant points use row numbers as IDs, so map them back to the dataset IDs through the payload
+    def run_qdrant(text, limit):
+        qdrant.limit = limit
+        return [hit["payload"]["ID"] for hit in qdrant.retrieve(text)]
+
+    return {
+        "qdrant-memory": run_qdrant,
+        "local-index": retrieve_ids(local),
+        "bm25": lambda text, limit: [hit["id"] for hit in bm25_index.search_text(text, limit)],
+        "hybrid-rrf": retrieve_ids(hybrid),
+        "local-category-first": retrieve_ids(category_first),
+        "local-rerank-lexical": retrieve_ids(reranked),
+    }
+
+
+# Builds one local index per (dimension, storage type) and returns
+# {name: (retrieve function, matrix bytes, search latency of the index alone)}.
+# The corpus and queries are embedded once at full size and truncated, which is what the shortened models return.
+def build_storage_retrievers(corpus, queries, backend, workdir, dimensions=None):
+    ids = [row["ID"] for row in corpus]
+    payloads = [document_payload(row) for row in corpus]
+    vectors = backend.embed([document_text(row) for row in corpus])
+    query_vectors = backend.embed(queries)
+    full = vectors.shape[1]
+    retrievers = {}
+    for dim in dimensions or (full, full // 2, full // 4):
+        reduced = backend if dim == full else TruncatedBackend(backend, dim)
+        for dtype in DTYPES:
+            name = f"local-{dim}d-{dtype}"
+            index = LocalIndex.build(os.path.join(workdir, name), truncate_rows(vectors, dim), ids, payloads,
+                                     reduced.name, dtype)
+            latency = time_searches(index, truncate_rows(query_vectors, dim), max(RECALL_AT))
+            retrievers[name] = (retrieve_ids(Retriever(reduced, index, cache_size=0)), int(index.vectors.nbytes),
+                                latency)
+    return retrievers
+
+
+# Runs every query through a retriever and computes recall@k, MRR and latency percentiles
+def evaluate(retrieve, queries, truths, recall_at=RECALL_AT):
+    depth = max(recall_at)
+    ranks = []
+    latencies = []
+    for query, truth in zip(queries, truths):
+        start_time = time.perf_counter()
+        results = retrieve(query, depth)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        ranks.append(results.index(truth) + 1 if truth in results else None)
+
+    metrics = {f"recall@{k}": sum(1 for rank in ranks if rank is not None and rank <= k) / len(ranks)
+               for k in recall_at}
+    metrics[f"mrr@{depth}"] = sum(1.0 / rank for rank in ranks if rank is not None) / len(ranks)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    metrics.update({"p50_ms": p50, "p95_ms": p95, "p99_ms": p99})
+    return {name: round(float(value), 4) for name, value in metrics.items()}
+
+
+# Runs the whole suite and returns a results dictionary ready to be written as JSON
+def run_benchmark(backend, only=None, dimensions=None):
+    corpus, queries, truths = load_validation_set()
+    with tempfile.TemporaryDirectory() as workdir:
+        retrievers = build_retrievers(corpus, backend, workdir)
+        results = {name: evaluate(retrieve, queries, truths)
+                   for name, retrieve in retrievers.items() if only is None or name in only}
+        storage = build_storage_retrievers(corpus, queries, backend, workdir, dimensions)
+        for name, (retrieve, memory_bytes, latency) in storage.items():
+            if only is None or name in only:
+                results[name] = dict(evaluate(retrieve, queries, truths), memory_bytes=memory_bytes,
+                                     search_p50_ms=latency["p50_ms"], search_p95_ms=latency["p95_ms"])
+    return {
+        "dataset": os.path.basename(VALIDATION_SET),
+        "corpus_size": len(corpus),
+        "queries": len(queries),
+        "embedding_backend": backend.name,
+        "results": results,
+    }
+
+
+# Prints the change of every metric between two results files
+def compare(new, old):
+    for name, metrics in new["results"].items():
+        previous = old.get("results", {}).get(name)
+        if previous is None:
+            print(f"{name}: new backend")
+            continue
+        changes = ", ".join(f"{metric} {previous.get(metric, 0):.4f} -> {value:.4f}"
+                            for metric, value in metrics.items() if previous.get(metric) != value)
+        print(f"{name}: {changes or 'unchanged'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency on the validation set.")
+    parser.add_argument("--backend", default="hashing", choices=["openai", "sentence-transformers", "hashing"],
+                        help="Embedding backend, the default hashing backend runs fully offline")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--only", nargs="+", default=None, help="Only run these retrieval backends")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=None,
+                        help="Embedding sizes compared by the storage sweep (default: full, 1/2 and 1/4)")
+    parser.add_argument("--out", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key="OPEN_AI_API_KEY")
+    results = run_benchmark(get_backend(args.backend, openai_client, dim=args.hashing_dim), args.only, args.dimensions)
+
+    for name, metrics in results["results"].items():
+        print(f"{name:20s} " + "  ".join(f"{metric}={value}" for metric, value in metrics.items()))
+    with open(args.out, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print(f"Wrote {args.out}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(results, json.load(file))
@@ -0,0 +1,577 @@
+"""
+Long-lived retrieval service with the same contract as the qdrantQuery Firebase function.
+
+    POST /qdrantQuery  {"prompt": "..."}  ->  {"message": "$ - Qdrant Response", "prompt": [top 3 hits]}
+
+Unlike the Firebase function, the embedding backend and the Qdrant client are created once at
+startup and reused, so their HTTP connections stay open (keep-alive) between requests. Query
+embeddings are kept in an LRU cache, and identical queries that arrive while one is already
+being answered wait for that answer instead of embedding and searching again, so a burst of
+the same question costs one embedding and one search. With --semantic-cache-size set, results
+are also served for paraphrases of recent queries (see SemanticCache.py). With --local-index
+the search runs in-process against a LocalIndex.py directory instead of the Qdrant cluster.
+With --bm25-index a BM25 search (see BM25Index.py) runs at the same time as the embedding and
+vector search, and the two rankings are merged by reciprocal rank fusion.
+
+With --shard-by the collection is split into shards (see Shards.py) that are searched concurrently,
+their best hits merged by score.
+
+A request may add "categories": [...] to only search rows of those question categories (see
+Categories.py). With --category-model the category of every other query is predicted from its
+embedding and that category is searched first; the whole collection is only searched when the
+prediction is not confident or the category has fewer hits than requested.
+
+With --rerank the search fetches --rerank-candidates hits (50 by default) and a reranker from
+Reranker.py picks the best --limit of them. Every response carries the time spent in each stage
+(embedding, search, reranking) under "timings", and /stats reports the average of each stage.
+The same stages, plus context packing and JSON serialization, feed the histograms of Metrics.py,
+which GET /metrics serves in the Prometheus text format together with counters of requests,
+API calls, tokens and cache hits.
+
+With --context-tokens N the response also carries "context": {"text", "tokens", "sources"}, the
+most relevant sentences of the hits packed into N tokens by ContextBuilder.py, ready to be put
+in the chat prompt. A request can ask for a different budget with "context_tokens".
+
+With --answer-index the curated questions of the QA datasets and close paraphrases of them are
+answered from AnswerIndex.py before any search: the response carries the stored answer under
+"answer" (and as the only hit), and the chat client shows it without generating. A request can
+send "answer": false to always search.
+
+With --query-log every query that is retrieved is appended to a JSON lines log, from which
+HotQueries.py finds the most asked questions and precomputes their embeddings, hits and
+contexts at deploy time. With --warm-cache those are loaded at startup, so the hot questions
+are answered without embedding or searching from the very first request.
+
+A request can add "fields": [...] to get only those payload fields of each hit ([] for none,
+e.g. when it only uses "context"); --payload-fields sets the default and also limits what is
+fetched from Qdrant. Texts stored compressed by DatasetToQdrant.py are restored before use
+(see Payloads.py), and responses are serialized without whitespace.
+
+Usage:
+    python RetrievalService.py --port 8080 --backend openai
+"""
+
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Import the QdrantClient from the qdrant_client package for interacting with the Qdrant API
+from qdrant_client import QdrantClient
+
+from AnswerIndex import AnswerIndex
+from BM25Index import BM25Index, reciprocal_rank_fusion
+from Categories import CATEGORIES, CategoryClassifier, category_filter
+from ContextBuilder import ContextBuilder
+from EmbeddingBackends import get_backend
+from HotQueries import QueryLog, WarmCache
+from LocalIndex import LocalIndex
+from Metrics import metrics
+from Payloads import expand_payload, payload_selector, select_fields
+from Reranker import get_reranker
+from SemanticCache import SemanticCache
+from Shards import SHARD_KEYS, ShardedSearcher, list_shards
+
+# API keys and cluster URL, replace these with your own values
+OPENAI_API_KEY = "OPEN_AI_API_KEY"
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Specify the name of the collection in Qdrant to search
+collection_name = "ChatbotDataset"
+
+
+# Collapses whitespace so trivially different spellings of a query share cache entries
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class LRUCache:
+    # A thread-safe dictionary that forgets its least recently used entry once it holds max_size entries
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SingleFlight:
+    # Runs at most one call per key at a time; callers that arrive while it runs share its result
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = function()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class QdrantSearcher:
+    # Searches a Qdrant collection and returns hits as plain dictionaries shaped like Qdrant's JSON.
+    # payload_fields limits the payload fetched from Qdrant to those fields (None fetches all of it).
+    # timeout, in seconds, makes Qdrant give up on a search that takes longer (rounded up, Qdrant takes whole seconds).
+    def __init__(self, qdrant_client, collection=collection_name, payload_fields=None, timeout=None):
+        self.client = qdrant_client
+        self.collection = collection
+        self.payload_fields = payload_fields
+        self.timeout = None if timeout is None else max(math.ceil(timeout), 1)
+
+    # categories restricts the search to points whose question category is one of them, using the payload index
+    def search(self, vector, limit, categories=None):
+        query_filter = category_filter(categories) if categories is not None else None
+        points = self.client.query_points(self.collection, query=list(map(float, vector)), limit=limit,
+                                          query_filter=query_filter, with_payload=payload_selector(self.payload_fields),
+                                          with_vectors=False, timeout=self.timeout).points
+        return [
+            {"id": point.id, "version": point.version, "score": point.score, "payload": expand_payload(point.payload),
+             "vector": None}
+            for point in points
+        ]
+
+
+class Retriever:
+    # Embeds a prompt (through the LRU cache) and returns the closest hits from the searcher.
+    # An optional SemanticCache answers queries that are close enough to a recent one without searching.
+    # An optional BM25Index adds a lexical leg: both legs fetch fusion_candidates hits and are fused by RRF.
+    # An optional Categories.CategoryClassifier picks a category to search first when it is at least
+    # category_margin more similar to the query than the runner-up.
+    # An optional reranker (see Reranker.py) reorders rerank_candidates hits and keeps the best limit.
+    # An optional AnswerIndex answers the curated questions and their paraphrases without searching.
+    # An optional HotQueries.QueryLog records every query that is retrieved, and an optional
+    # HotQueries.WarmCache serves the hot queries precomputed at deploy time without embedding or searching.
+    def __init__(self, backend, searcher, limit=3, cache_size=1024, semantic_cache=None, lexical_index=None,
+                 fusion_candidates=20, classifier=None, category_margin=0.05, reranker=None, rerank_candidates=50,
+                 answer_index=None, query_log=None, warm_cache=None):
+        self.backend = backend
+        self.searcher = searcher
+        self.limit = limit
+        self.semantic_cache = semantic_cache
+        self.lexical_index = lexical_index
+        self.fusion_candidates = fusion_candidates
+        self.classifier = classifier
+        self.category_margin = category_margin
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.answer_index = answer_index
+        self.query_log = query_log
+        self.warm_cache = warm_cache
+        if warm_cache is not None:
+            if (warm_cache.meta["backend"], warm_cache.meta["limit"]) != (backend.name, limit):
+                raise ValueError(f"The warm cache holds {warm_cache.meta['limit']} hits per query embedded with "
+                                 f"{warm_cache.meta['backend']}, not {limit} embedded with {backend.name}")
+            # Paraphrases of the hot queries are served by the semantic cache from the first request
+            if semantic_cache is not None:
+                for vector, hits in warm_cache.seeds():
+                    semantic_cache.put(vector, hits)
+        self._pool = ThreadPoolExecutor(max_workers=8) if lexical_index is not None else None
+        self.embedding_cache = LRUCache(cache_size)
+        self.inflight = SingleFlight()
+        self.embed_calls = 0
+        self.searches = 0
+        self.category_searches = 0
+        self.category_fallbacks = 0
+        # Total seconds and number of runs of every stage, for the averages in stats()
+        self.stage_seconds = {}
+        self.stage_runs = {}
+        self._stage_lock = threading.Lock()
+
+    def embed(self, text):
+        vector = self.embedding_cache.get(text)
+        if vector is not None:
+            metrics.inc("cache_hits_total", cache="query_embedding")
+            return vector
+        if self.warm_cache is not None:
+            vector = self.warm_cache.embedding(text)
+        if vector is not None:
+            metrics.inc("cache_hits_total", cache="warm_embedding")
+        else:
+            vector = self.backend.embed([text])[0]
+            self.embed_calls += 1
+        self.embedding_cache.put(text, vector)
+        return vector
+
+    # Searches the given categories, or the predicted category first when there is a classifier
+    def _search(self, vector, limit, categories):
+        if categories is None and self.classifier is not None:
+            predicted = self.classifier.choose(vector, self.category_margin)
+            if predicted is not None:
+                self.category_searches += 1
+                hits = self.searcher.search(vector, limit, [predicted])
+                if len(hits) >= limit:
+                    return hits
+                self.category_fallbacks += 1
+        return self.searcher.search(vector, limit, categories)
+
+    # Adds the time since start_time to the timings of a request and to the running totals
+    def _record(self, timings, stage, start_time):
+        seconds = time.perf_counter() - start_time
+        timings[f"{stage}_ms"] = round(seconds * 1000, 3)
+        with self._stage_lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            self.stage_runs[stage] = self.stage_runs.get(stage, 0) + 1
+        metrics.observe(stage, seconds)
+
+    # Returns (hits, timings in milliseconds per stage)
+    def _retrieve(self, query, categories=None):
+        timings = {}
+        # The precomputed results were not filtered either, so they only serve unrestricted queries
+        if self.warm_cache is not None and categories is None:
+            hits = self.warm_cache.results(query)
+            if hits is not None:
+                metrics.inc("cache_hits_total", cache="warm")
+                return hits, timings
+        # Without a reranker the search returns the final hits, with one it returns the candidates
+        candidates = self.limit if self.reranker is None else self.rerank_candidates
+        # Start the lexical leg first so it runs while the query is embedded and searched
+        lexical = None
+        if self.lexical_index is not None:
+            lexical = self._pool.submit(self.lexical_index.search_text, query,
+                                        max(self.fusion_candidates, candidates), categories)
+
+        start_time = time.perf_counter()
+        vector = self.embed(query)
+        self._record(timings, "embed", start_time)
+        # Cached results were not filtered, so the semantic cache only serves unrestricted queries
+        if self.semantic_cache is not None and categories is None:
+            hits = self.semantic_cache.lookup(vector)
+            if hits is not None:
+                metrics.inc("cache_hits_total", cache="semantic")
+                if lexical is not None:
+                    lexical.cancel()
+                return hits, timings
+
+        start_time = time.perf_counter()
+        self.searches += 1
+        if lexical is None:
+            hits = self._search(vector, candidates, categories)
+        else:
+            dense_hits = self._search(vector, max(self.fusion_candidates, candidates), categories)
+            hits = reciprocal_rank_fusion([dense_hits, lexical.result()], candidates)
+        self._record(timings, "search", start_time)
+        if self.reranker is not None:
+            rerank_start = time.perf_counter()
+            hits = self.reranker.rerank(query, hits, self.limit)
+            self._record(timings, "rerank", rerank_start)
+        if self.semantic_cache is not None and categories is None:
+            self.semantic_cache.put(vector, hits, time.perf_counter() - start_time)
+        return hits, timings
+
+    # Same as retrieve, but returns (hits, timings) where timings holds the milliseconds spent in each stage.
+    # Requests coalesced with an identical one in flight share its timings.
+    def retrieve_with_timings(self, prompt, categories=None):
+        query = normalize_query(prompt)
+        if categories is not None:
+            categories = sorted(set(categories))
+        if self.query_log is not None:
+            self.query_log.append(query, categories)
+        key = query if categories is None else (query, tuple(categories))
+        return self.inflight.do(key, lambda: self._retrieve(query, categories))
+
+    # Returns (stored answer or None, timings) from the answer index. The query embedding it may
+    # compute stays in the embedding cache, so a miss does not pay for it again in retrieve().
+    def answer(self, prompt, categories=None):
+        timings = {}
+        if self.answer_index is None:
+            return None, timings
+        query = normalize_query(prompt)
+        start_time = time.perf_counter()
+        answer = self.answer_index.lookup(query, self.embed)
+        self._record(timings, "answer", start_time)
+        if answer is not None and categories is not None and answer["category"] not in categories:
+            answer = None
+        if answer is not None:
+            metrics.inc("answers_total", match=answer["match"])
+        return answer, timings
+
+    # Returns the context precomputed for a hot query when it was packed into max_tokens, or None
+    def cached_context(self, prompt, max_tokens):
+        if self.warm_cache is None:
+            return None
+        context = self.warm_cache.context(normalize_query(prompt), max_tokens)
+        if context is not None:
+            metrics.inc("cache_hits_total", cache="warm_context")
+        return context
+
+    # categories, if given, restricts the results to those question categories
+    def retrieve(self, prompt, categories=None):
+        return self.retrieve_with_timings(prompt, categories)[0]
+
+    def stats(self):
+        stats = {
+            "embed_calls": self.embed_calls,
+            "searches": self.searches,
+            "embedding_cache_hits": self.embedding_cache.hits,
+            "embedding_cache_size": len(self.embedding_cache),
+            "coalesced_requests": self.inflight.coalesced,
+        }
+        with self._stage_lock:
+            for stage, seconds in self.stage_seconds.items():
+                stats[f"avg_{stage}_ms"] = round(seconds * 1000 / self.stage_runs[stage], 3)
+        if self.classifier is not None:
+            stats.update({"category_searches": self.category_searches, "category_fallbacks": self.category_fallbacks})
+        if self.semantic_cache is not None:
+            stats.update(self.semantic_cache.stats())
+        if self.answer_index is not None:
+            stats.update(self.answer_index.stats())
+        if self.warm_cache is not None:
+            stats.update(self.warm_cache.stats())
+        if isinstance(self.searcher, ShardedSearcher):
+            stats.update(self.searcher.stats())
+        return stats
+
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps client connections open between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle on, the body waits for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    retriever = None
+    context_builder = None
+    # Payload fields returned when a request does not ask for "fields", None returns whole payloads
+    payload_fields = None
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        # Same CORS behaviour as the Firebase function ({cors: true})
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, json.dumps(self.retriever.stats()))
+        elif self.path == "/metrics":
+            self._send(200, metrics.prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, "Not Found", "text/plain")
+
+    def do_POST(self):
+        body = self._read_json()
+        prompt = body.get("prompt") if isinstance(body, dict) else None
+        if not prompt:
+            metrics.inc("requests_total", status="400")
+            self._send(400, "No prompt field in the request", "text/plain")
+            return
+        categories = body.get("categories")
+        if isinstance(categories, str):
+            categories = [categories]
+        if categories is not None and (not isinstance(categories, list) or not set(categories) <= set(CATEGORIES)):
+            metrics.inc("requests_total", status="400")
+            self._send(400, "categories must be a list of: " + ", ".join(CATEGORIES), "text/plain")
+            return
+        context_tokens = body.get("context_tokens")
+        # bool is a subclass of int, so JSON true/false would otherwise pass as 1/0
+        if context_tokens is not None and (not isinstance(context_tokens, int) or isinstance(context_tokens, bool)
+                                           or context_tokens <= 0):
+            metrics.inc("requests_total", status="400")
+            self._send(400, "context_tokens must be a positive integer", "text/plain")
+            return
+        fields = body.get("fields", self.payload_fields)
+        if fields is not None and (not isinstance(fields, list) or not all(isinstance(field, str) for field in fields)):
+            metrics.inc("requests_total", status="400")
+            self._send(400, "fields must be a list of payload field names", "text/plain")
+            return
+        try:
+            answer, answer_timings = None, {}
+            if body.get("answer", True) is not False:
+                answer, answer_timings = self.retriever.answer(prompt, categories)
+            if answer is not None:
+                # The stored answer stands in for the hits, so clients that only read prompt[0] still get it
+                hit = {"id": answer["id"], "version": 0, "score": answer["score"],
+                       "payload": {"text": answer["text"], "question": answer["question"]}, "vector": None}
+                response = {"message": "$ - Qdrant Response", "prompt": [select_fields(hit, fields)],
+                            "answer": answer, "timings": answer_timings}
+            else:
+                hits, timings = self.retriever.retrieve_with_timings(prompt, categories)
+                response = {"message": "$ - Qdrant Response", "prompt": [select_fields(hit, fields) for hit in hits],
+                            "timings": dict(answer_timings, **timings)}
+            if self.context_builder is not None and answer is None:
+                start_time = time.perf_counter()
+                context = self.retriever.cached_context(prompt, context_tokens or self.context_builder.max_tokens)
+                if context is None:
+                    context = self.context_builder.build(prompt, hits, context_tokens)
+                response["context"] = context
+                seconds = time.perf_counter() - start_time
+                response["timings"]["context_ms"] = round(seconds * 1000, 3)
+                metrics.observe("context", seconds)
+            with metrics.span("serialize"):
+                data = json.dumps(response, separators=(",", ":"))
+        except Exception as e:
+            print(f"$ - Error occurred: {e}")
+            metrics.inc("requests_total", status="500")
+            self._send(500, "Internal Server Error", "text/plain")
+            return
+        metrics.inc("requests_total", status="200")
+        self._send(200, data)
+
+    # Keep the console quiet, one line per request is too much under load
+    def log_message(self, format, *args):
+        pass
+
+
+class RetrievalServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections when a burst of students arrives at once
+    request_queue_size = 128
+
+
+# Creates the HTTP server for a retriever; call serve_forever() on the result.
+# With a ContextBuilder every response also carries the packed context of its hits.
+# payload_fields is the default list of payload fields returned per hit, None returns whole payloads.
+def make_server(retriever, host="0.0.0.0", port=8080, context_builder=None, payload_fields=None):
+    handler = type("Handler", (RetrievalHandler,), {"retriever": retriever, "context_builder": context_builder,
+                                                    "payload_fields": payload_fields})
+    return RetrievalServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve qdrantQuery-compatible retrieval over HTTP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--collection", default=collection_name)
+    parser.add_argument("--limit", type=int, default=3, help="Number of hits returned per query")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Number of query embeddings kept in the LRU cache")
+    parser.add_argument("--semantic-cache-size", type=int, default=0,
+                        help="Number of recent queries kept in the semantic cache, 0 turns it off")
+    parser.add_argument("--semantic-distance", type=float, default=0.05,
+                        help="Maximum cosine distance between a query and a cached query to reuse its results")
+    parser.add_argument("--semantic-ttl", type=float, default=3600.0, help="Seconds a semantic cache entry stays valid")
+    parser.add_argument("--local-index", default=None, help="Search this LocalIndex.py directory instead of Qdrant")
+    parser.add_argument("--shard-by", default=None, choices=SHARD_KEYS,
+                        help="Search every <collection>_<shard> collection written by DatasetToQdrant.py --shard-by in parallel")
+    parser.add_argument("--shard-timeout", type=float, default=None,
+                        help="Seconds to wait for each shard, slower shards are left out of the results")
+    parser.add_argument("--bm25-index", default=None,
+                        help="BM25Index.py directory built with the same point IDs, enables hybrid search")
+    parser.add_argument("--fusion-candidates", type=int, default=20,
+                        help="Hits fetched from each leg before reciprocal rank fusion")
+    parser.add_argument("--rerank", default=None, choices=["lexical", "cross-encoder"],
+                        help="Rerank a wider candidate set with this reranker (see Reranker.py)")
+    parser.add_argument("--rerank-candidates", type=int, default=50, help="Candidates fetched for the reranker")
+    parser.add_argument("--rerank-weight", type=float, default=0.5,
+                        help="Share of the lexical score in the lexical reranker's final score")
+    parser.add_argument("--context-tokens", type=int, default=0,
+                        help="Also return the hits packed into this many tokens of context, 0 turns it off")
+    parser.add_argument("--payload-fields", nargs="*", default=None,
+                        help="Payload fields fetched and returned per hit (e.g. text), all of them by default")
+    parser.add_argument("--answer-index", default=None,
+                        help="AnswerIndex.py directory, its stored answers are returned without searching")
+    parser.add_argument("--answer-similarity", type=float, default=0.9,
+                        help="Similarity to a curated question needed to return its answer (see AnswerIndex.py evaluate)")
+    parser.add_argument("--query-log", default=None,
+                        help="Append every retrieved query to this JSON lines file (see HotQueries.py)")
+    parser.add_argument("--warm-cache", default=None,
+                        help="Warm cache directory written by HotQueries.py warm, its hot queries skip embedding and search")
+    parser.add_argument("--category-model", default=None,
+                        help="CategoryClassifier saved by Categories.py, searches the predicted category first")
+    parser.add_argument("--category-margin", type=float, default=0.05,
+                        help="How much more similar the predicted category must be than the runner-up")
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"])
+    parser.add_argument("--model", default=None, help="Model for the openai/sentence-transformers backends")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shorten the query embeddings, must match the ingestion")
+    args = parser.parse_args()
+
+    # The clients are created once and shared by every request
+    openai_client = None
+    if args.backend == "openai":
+        import openai
+        openai_client = openai.Client(api_key=OPENAI_API_KEY)
+    backend = get_backend(args.backend, openai_client, args.model, args.hashing_dim, args.idf, args.dimensions)
+    # The reranker, the context builder and the hybrid fusion (BM25Index.row_key) read the question and
+    # text of the hits, so those are always fetched
+    search_fields = None
+    if args.payload_fields is not None:
+        needed = ["text", "question"] if args.rerank or args.context_tokens > 0 or args.bm25_index else []
+        search_fields = list(dict.fromkeys(args.payload_fields + needed))
+    if args.local_index:
+        searcher = LocalIndex(args.local_index, backend.name)
+    elif args.shard_by:
+        qdrant_client = QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY)
+        shards = list_shards(qdrant_client, args.collection, args.shard_by)
+        searcher = ShardedSearcher({name: QdrantSearcher(qdrant_client, name, search_fields, args.shard_timeout)
+                                    for name in shards}, args.collection, args.shard_by, args.shard_timeout)
+        print(f"Searching {len(shards)} shards: {', '.join(shards)}")
+    else:
+        searcher = QdrantSearcher(QdrantClient(url=QDRANT_CLUSTER_URL, api_key=QDRANT_API_KEY), args.collection,
+                                  search_fields)
+
+    semantic_cache = None
+    if args.semantic_cache_size > 0:
+        semantic_cache = SemanticCache(backend.dim, args.semantic_cache_size, args.semantic_distance, args.semantic_ttl)
+    lexical_index = BM25Index(args.bm25_index) if args.bm25_index else None
+    classifier = CategoryClassifier.load(args.category_model) if args.category_model else None
+    reranker = get_reranker(args.rerank, lexical_index, args.rerank_weight) if args.rerank else None
+    answer_index = AnswerIndex(args.answer_index, backend.name, args.answer_similarity) if args.answer_index else None
+    query_log = QueryLog(args.query_log) if args.query_log else None
+    warm_cache = WarmCache(args.warm_cache) if args.warm_cache else None
+    retriever = Retriever(backend, searcher, args.limit, args.cache_size, semantic_cache, lexical_index,
+                          args.fusion_candidates, classifier, args.category_margin, reranker, args.rerank_candidates,
+                          answer_index, query_log, warm_cache)
+    context_builder = ContextBuilder(args.context_tokens) if args.context_tokens > 0 else None
+    server = make_server(retriever, args.host, args.port, context_builder, args.payload_fields)
+    print(f"Serving retrieval for {args.collection} on http://{args.host}:{args.port}")
+    server.serve_forever()
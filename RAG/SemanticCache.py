@@ -0,0 +1,87 @@
+"""
+Semantic cache of retrieval results, keyed on query-embedding similarity.
+
+Student questions repeat a lot ("how much is tuition", "what does tuition cost"), so the
+retrieval service remembers the embeddings of recent queries together with their results.
+A new query whose embedding is within max_distance (cosine distance) of a cached query is
+answered from the cache without searching the collection.
+
+Cached embeddings live in one preallocated float32 matrix, so a lookup is a single
+matrix-vector product. The cache holds at most max_size entries: expired entries (older than
+ttl seconds) are never served, and when the cache is full the least recently used entry is replaced.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, dim, max_size=1024, max_distance=0.05, ttl=3600.0):
+        self.dim = dim
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+        self._vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self._results = [None] * max_size
+        # Time each slot was filled (for the TTL) and last used (for LRU eviction), 0 means empty
+        self._created = np.zeros(max_size)
+        self._used = np.zeros(max_size)
+        # Sum of the time spent on misses, used to estimate what each hit saved
+        self._miss_seconds = 0.0
+        self._lock = threading.Lock()
+
+    # Returns the cached result for the closest query within max_distance, or None
+    def lookup(self, vector):
+        start_time = time.perf_counter()
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        with self._lock:
+            live = (self._created > 0) & (now - self._created <= self.ttl)
+            similarities = np.where(live, self._vectors @ query, -np.inf)
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < 1.0 - self.max_distance:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used[slot] = now
+            # A hit saves roughly the average cost of a miss, minus the lookup itself
+            if self.misses:
+                saved = self._miss_seconds / self.misses - (time.perf_counter() - start_time)
+                self.seconds_saved += max(saved, 0.0)
+            return self._results[slot]
+
+    # Stores the result of a query that missed; seconds is how long producing the result took
+    def put(self, vector, result, seconds=0.0):
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        with self._lock:
+            self._miss_seconds += seconds
+            expired = (self._created == 0) | (now - self._created > self.ttl)
+            # Reuse an empty or expired slot if there is one, otherwise evict the least recently used
+            slot = int(np.argmax(expired)) if expired.any() else int(np.argmin(self._used))
+            self._vectors[slot] = query
+            self._results[slot] = result
+            self._created[slot] = now
+            self._used[slot] = now
+
+    def __len__(self):
+        now = time.time()
+        return int(((self._created > 0) & (now - self._created <= self.ttl)).sum())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "semantic_cache_hits": self.hits,
+            "semantic_cache_misses": self.misses,
+            "semantic_cache_hit_rate": self.hits / lookups if lookups else 0.0,
+            "semantic_cache_seconds_saved": round(self.seconds_saved, 4),
+            "semantic_cache_size": len(self),
+        }
@@ -0,0 +1,193 @@
+"""
+Splits the data over several Qdrant collections (shards) and searches them all at once.
+
+With --shard-by, DatasetToQdrant.py writes every point to the collection "<collection>_<shard>"
+instead of one big collection, where the shard is either:
+- source:    the dataset file the point came from (Dataset, run2_fix, uwp_data, cs_data, ...),
+             stored in the "source" payload field of every point
+- category:  the question category of the point (see Categories.py), "uncategorized" when it has none
+
+ShardRouter creates a shard collection the first time a point is routed to it. A shard that needs
+special settings can be created beforehand with CreateCollection.py under the same name. Each shard
+is small and can be re-ingested (--sync) or recreated on its own while the others keep serving:
+syncing only uwp_data.json touches only the uwp_data shard.
+
+ShardedSearcher is the query side. It sends the search to every shard concurrently on a thread
+pool and merges their top hits by score, so a query costs about as much as the slowest shard.
+When the shards are categories and a search asks for categories, only those shards are searched.
+A shard that fails or does not answer within the timeout is skipped, so one shard being rebuilt
+does not fail the query. A thread cannot be stopped from outside, so the timeout is also given to
+Qdrant (QdrantSearcher's timeout) to end the search itself, the pool has room for a second round of
+searches, and the searches still running after their timeout are counted in stats().
+
+Usage:
+    python DatasetToQdrant.py --source ../Datasets/UWP_Website_Files/uwp_data.json ../Datasets/CS_Website_Files/cs_data.json --shard-by source
+    python RetrievalService.py --shard-by source
+    python Shards.py --collection ChatbotDataset
+"""
+
+import argparse
+import heapq
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Import the QdrantClient from the qdrant_client package for interacting with the Qdrant API
+from qdrant_client import QdrantClient
+
+from Categories import CATEGORIES, CATEGORY_FIELD
+from CreateCollection import create_collection
+from Metrics import metrics
+
+# Cluster URL and API key, replace these with your own values
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Payload field holding the name of the dataset a point came from
+SOURCE_FIELD = "source"
+# Ways of splitting points into shards
+SHARD_KEYS = ("source", "category")
+
+
+# Name of a dataset for the source field: its file name without the extension
+def source_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# Adds the source field to the payload of every (key, text, payload) item
+def tag_source(items, source):
+    for key, text, payload in items:
+        yield key, text, dict(payload, **{SOURCE_FIELD: source})
+
+
+# The shard a payload belongs to when sharding by source or by category
+def shard_key(payload, by):
+    if by == "source":
+        return payload.get(SOURCE_FIELD) or "default"
+    if by == "category":
+        return payload.get(CATEGORY_FIELD) or "uncategorized"
+    raise ValueError(f"Unknown shard key: {by}")
+
+
+# Name of the collection holding a shard: the prefix, an underscore and the shard in lowercase
+def shard_collection(prefix, key):
+    return f"{prefix}_{re.sub(r'[^0-9a-z]+', '_', key.lower()).strip('_')}"
+
+
+# Names of the shard collections that exist for a prefix. The rest of the name must be a shard key as
+# shard_collection() writes it, and one of the category shards when by is "category", so collections
+# that merely start with the prefix (ChatbotDatasetOld, ChatbotDataset-backup) are not taken for shards
+def list_shards(qdrant_client, prefix, by=None):
+    pattern = re.compile(re.escape(prefix) + r"_[0-9a-z]+(_[0-9a-z]+)*")
+    names = [collection.name for collection in qdrant_client.get_collections().collections
+             if pattern.fullmatch(collection.name)]
+    if by == "category":
+        wanted = {shard_collection(prefix, key) for key in CATEGORIES + ("uncategorized",)}
+        names = [name for name in names if name in wanted]
+    return sorted(names)
+
+
+class ShardRouter:
+    # Picks the shard collection of every point, creating collections (with create_options) as they are first needed
+    def __init__(self, qdrant_client, prefix, by="source", dim=1536, **create_options):
+        if by not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key: {by}")
+        self.client = qdrant_client
+        self.prefix = prefix
+        self.by = by
+        self.dim = dim
+        self.create_options = create_options
+        self.collections = set()
+        self._lock = threading.Lock()
+
+    def collection(self, payload):
+        name = shard_collection(self.prefix, shard_key(payload, self.by))
+        if name not in self.collections:
+            # Upsert workers route points concurrently, so only one of them may create a shard
+            with self._lock:
+                if name not in self.collections:
+                    if not self.client.collection_exists(name):
+                        create_collection(self.client, name, self.dim, **self.create_options)
+                        print(f"Created shard {name}")
+                    self.collections.add(name)
+        return name
+
+
+class ShardedSearcher:
+    # Searches several searchers (one per shard collection, e.g. RetrievalService.QdrantSearcher) in parallel.
+    # by tells how the shards were split, so category searches can skip the other shards; timeout is
+    # in seconds and shards slower than it are left out of the results.
+    def __init__(self, searchers, prefix=None, by=None, timeout=None):
+        self.searchers = dict(searchers)
+        self.prefix = prefix
+        self.by = by
+        self.timeout = timeout
+        self.failures = 0
+        self.timeouts = 0
+        # A search that outlived the timeout keeps its worker until it ends, so twice as many workers as
+        # shards let the next query run while one round of stale searches finishes
+        self._pool = ThreadPoolExecutor(max_workers=max(2 * len(self.searchers), 1))
+        # Timed out searches that were already running
+        self._stuck = set()
+        self._lock = threading.Lock()
+
+    # Searches one shard and times it under its own label
+    def _search_shard(self, name, vector, limit, categories):
+        with metrics.span("shard_search", shard=name):
+            return self.searchers[name].search(vector, limit, categories)
+
+    # Returns the best limit hits of all the shards that may hold points of the categories
+    def search(self, vector, limit, categories=None):
+        names = list(self.searchers)
+        if self.by == "category" and categories is not None:
+            # Every point of a category shard has that category, so no filter is needed
+            wanted = {shard_collection(self.prefix, category) for category in categories}
+            names = [name for name in names if name in wanted]
+            categories = None
+        if not names:
+            return []
+
+        futures = {self._pool.submit(self._search_shard, name, vector, limit, categories): name for name in names}
+        done, not_done = wait(futures, timeout=self.timeout)
+        hits = []
+        answered = 0
+        for future in done:
+            try:
+                hits.extend(future.result())
+                answered += 1
+            except Exception as e:
+                self.failures += 1
+                metrics.inc("errors_total", stage="shard_search")
+                print(f"Shard {futures[future]} failed: {e}")
+        for future in not_done:
+            self.timeouts += 1
+            metrics.inc("shard_timeouts_total", shard=futures[future])
+            # cancel only stops a search still waiting for a worker, a running one is counted until it ends
+            if not future.cancel():
+                with self._lock:
+                    self._stuck.add(future)
+        if not answered:
+            raise RuntimeError(f"None of the {len(names)} shards answered")
+        return heapq.nlargest(limit, hits, key=lambda hit: hit["score"])
+
+    # Timed out searches still holding a worker
+    def stuck(self):
+        with self._lock:
+            self._stuck = {future for future in self._stuck if not future.done()}
+            return len(self._stuck)
+
+    def stats(self):
+        return {"shard_failures": self.failures, "shard_timeouts": self.timeouts, "shard_searches_stuck": self.stuck()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the shard collections of a prefix and their sizes.")
+    parser.add_argument("--collection", default="ChatbotDataset", help="Prefix of the shard collections")
+    parser.add_argument("--url", default=QDRANT_CLUSTER_URL)
+    parser.add_argument("--api-key", default=QDRANT_API_KEY)
+    parser.add_argument("--shard-by", default=None, choices=SHARD_KEYS, help="Only list shards of this kind")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=args.url, api_key=args.api_key)
+    for name in list_shards(client, args.collection, args.shard_by):
+        print(f"{name:40s} {client.count(name, exact=True).count:8d} points")
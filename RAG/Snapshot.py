@@ -0,0 +1,143 @@
+"""
+Compact snapshots of a Qdrant collection, so a new environment can be set up without re-embedding.
+
+The export command scrolls through the collection, vectors and payloads included, and writes:
+- vectors.npy:    the vector matrix (float32, or float16/uint8 with --dtype to make it smaller)
+- payloads.json:  point IDs and payloads stored column by column (see LocalIndex.write_columns)
+- meta.json:      the source collection and its settings (vector size and datatype, on-disk
+                  storage, HNSW and quantization), the embedding backend, point count and storage type
+
+The collection holds no record of the model that embedded it, so export takes the same --backend
+options as the other scripts and stores the backend name. The import command creates a collection
+with the recorded settings and bulk uploads the snapshot into it, so restoring makes no embedding
+calls. A snapshot is also a valid LocalIndex.py
+directory: a retrieval node can skip Qdrant and start with --local-index <snapshot>, which
+memory-maps the matrix instead of loading or embedding anything, and refuses the snapshot if it
+was exported with another backend.
+
+Only collections with cosine distance are supported, their vectors are stored normalized.
+
+Usage:
+    python Snapshot.py export --collection ChatbotDataset --backend openai --out snapshot
+    python Snapshot.py import --snapshot snapshot --collection ChatbotDataset --recreate
+    python RetrievalService.py --local-index snapshot --backend openai
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+# Import the QdrantClient and models from the qdrant_client package for interacting with the Qdrant API
+from qdrant_client import QdrantClient, models
+
+from CreateCollection import create_collection
+from EmbeddingBackends import get_backend
+from LocalIndex import DTYPES, LocalIndex
+
+# Replace these with the actual URL and API key of your Qdrant cluster
+QDRANT_CLUSTER_URL = "QDRANT_CLUSTER_URL"
+QDRANT_API_KEY = "QDRANT_API_KEY"
+# Name of the collection shared by all scripts in this folder
+collection_name = "ChatbotDataset"
+
+
+# Reads the create_collection arguments that rebuild a collection with the same settings
+def collection_settings(config):
+    params = config.params.vectors
+    quantization = params.quantization_config or config.quantization_config
+    if quantization is None:
+        quantization_name = None
+    elif isinstance(quantization, models.ScalarQuantization):
+        quantization_name = "scalar"
+    elif isinstance(quantization, models.BinaryQuantization):
+        quantization_name = "binary"
+    else:
+        raise ValueError(f"Unsupported quantization: {quantization}")
+    hnsw = params.hnsw_config or models.HnswConfigDiff()
+    return {
+        "quantization": quantization_name,
+        "on_disk": bool(params.on_disk),
+        "hnsw_m": config.hnsw_config.m if hnsw.m is None else hnsw.m,
+        "hnsw_ef_construct": config.hnsw_config.ef_construct if hnsw.ef_construct is None else hnsw.ef_construct,
+        "datatype": params.datatype.value if params.datatype else "float32",
+    }
+
+
+# Scrolls through a whole collection and writes it to a snapshot directory, returns the snapshot as a LocalIndex.
+# backend_name is the embedding backend the collection was filled with, the collection itself does not record it.
+def export_snapshot(client, directory, backend_name, collection=collection_name, page_size=1000, dtype="float32"):
+    config = client.get_collection(collection).config
+    params = config.params.vectors
+    if params.distance != models.Distance.COSINE:
+        raise ValueError(f"Only cosine collections can be exported, {collection} uses {params.distance}")
+    settings = collection_settings(config)
+
+    ids, payloads, pages = [], [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(collection, limit=page_size, offset=offset,
+                                       with_payload=True, with_vectors=True)
+        if points:
+            ids.extend(point.id for point in points)
+            payloads.extend(point.payload or {} for point in points)
+            pages.append(np.array([point.vector for point in points], dtype=np.float32))
+        if offset is None:
+            break
+
+    vectors = np.concatenate(pages) if pages else np.zeros((0, params.size), dtype=np.float32)
+    return LocalIndex.build(directory, vectors, ids, payloads, backend_name, dtype=dtype, columnar=True,
+                            extra_meta={"collection": collection, "collection_settings": settings,
+                                        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+
+# Uploads a snapshot into a collection, creating it (or replacing it with recreate) first with the settings
+# of the exported collection. Snapshots from before the settings were recorded get the default settings.
+# parallel > 1 uploads with several processes, which only works against a Qdrant server.
+def import_snapshot(client, directory, collection=collection_name, recreate=False, batch_size=256, parallel=1):
+    snapshot = LocalIndex(directory)
+    if recreate or not client.collection_exists(collection):
+        create_collection(client, collection, snapshot.meta["dim"], recreate=recreate,
+                          **snapshot.meta.get("collection_settings", {}))
+    client.upload_collection(collection, snapshot.matrix(), payload=snapshot.payloads, ids=snapshot.ids,
+                             batch_size=batch_size, parallel=parallel, wait=True)
+    return len(snapshot)
+
+
+# Total size of the files in a directory, in bytes
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a Qdrant collection to a local snapshot, or import one.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--collection", default=collection_name)
+    parser.add_argument("--out", "--snapshot", dest="snapshot", default="snapshot", help="Snapshot directory")
+    parser.add_argument("--url", default=QDRANT_CLUSTER_URL)
+    parser.add_argument("--api-key", default=QDRANT_API_KEY)
+    parser.add_argument("--backend", default="openai", choices=["openai", "sentence-transformers", "hashing"],
+                        help="Embedding backend the collection was filled with, recorded when exporting")
+    parser.add_argument("--model", default=None, help="Model for the openai/sentence-transformers backends")
+    parser.add_argument("--hashing-dim", type=int, default=512)
+    parser.add_argument("--idf", default=None, help="IDF weights written by EmbeddingBackends.py --fit-idf")
+    parser.add_argument("--dimensions", type=int, default=None, help="Shortened embedding size used by the ingestion")
+    parser.add_argument("--dtype", default="float32", choices=DTYPES, help="Storage type of the exported vectors")
+    parser.add_argument("--page-size", type=int, default=1000, help="Points per scroll request when exporting")
+    parser.add_argument("--batch-size", type=int, default=256, help="Points per upload request when importing")
+    parser.add_argument("--parallel", type=int, default=4, help="Upload processes when importing")
+    parser.add_argument("--recreate", action="store_true", help="Replace the collection if it already exists")
+    args = parser.parse_args()
+
+    # Initialize the QdrantClient object with the URL and API key for the Qdrant cluster
+    client = QdrantClient(url=args.url, api_key=args.api_key)
+    start_time = time.perf_counter()
+    if args.command == "export":
+        # Only the backend's name is needed, so no embedding client is created
+        backend = get_backend(args.backend, None, args.model, args.hashing_dim, args.idf, args.dimensions)
+        snapshot = export_snapshot(client, args.snapshot, backend.name, args.collection, args.page_size, args.dtype)
+        print(f"Exported {len(snapshot)} points of size {snapshot.meta['dim']} to {args.snapshot} "
+              f"({directory_bytes(args.snapshot) / 1024 / 1024:.1f} MiB) in {time.perf_counter() - start_time:.2f}s")
+    else:
+        count = import_snapshot(client, args.snapshot, args.collection, args.recreate, args.batch_size, args.parallel)
+        print(f"Imported {count} points into {args.collection} in {time.perf_counter() - start_time:.2f}s")